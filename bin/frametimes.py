@@ -1,39 +1,18 @@
 #!/usr/bin/env python
 
-from datetime import datetime
 import sys
 
-# Print long reqframes requests. Feed with the Gen2-side logs on stdin.
+from gen2Actor import logstats
+
+# Print long reqframes requests. Feed with the Gen2-side logs on stdin, or name them.
 # e.g. cat /data/logs/actors/gen2/2023*_*.log | frameTimes.py
 #
+# gen2logstats.py does the pairing, and covers all the other Gen2 calls too.
+#
 def run():
-    t0 = None
-    while True:
-        l = sys.stdin.readline()
-        if not l:
-            break
-        if '(reqframes)' not in l:
-            continue
-
-        ts, rest = l.split('|', 1)
-        ts = ts.strip()
-        try:
-            t = datetime.strptime(ts, '%Y-%m-%d %H:%M:%S,%f')
-        except Exception as e:
-            print(f'failed to parse date: {ts}')
-            raise
-
-        if 'reqframes num=' in l:
-            t0 = t
-        else:
-            t1 = t
-            dt = (t1-t0).total_seconds()
-
-            if dt > 1:
-                print(f'{t0.strftime("%Y-%m-%d %H:%M:%S")} {dt}')
+    summary = logstats.scanFiles(sys.argv[1:] or ['-'], ['reqframes'], slowThreshold=1, maxSlow=None)
+    for t0, call, dt in sorted(summary.slow):
+        print(f'{t0.strftime("%Y-%m-%d %H:%M:%S")} {dt}')
 
 if __name__ == "__main__":
     run()
-    
-        
-        
@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+
+# End-to-end gen2 actor benchmarks against a fake Gen2. e.g.
+#   gen2bench.py --threads 8 --iterations 100 --out /tmp/gen2bench.json
+#   gen2bench.py --compare /tmp/gen2bench.json
+#
+import sys
+
+from gen2Actor import bench
+
+if __name__ == "__main__":
+    sys.exit(bench.main())
@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+
+# Gen2 call latency tables from the Gen2-side gen2 actor logs. e.g.
+#   gen2logstats.py /data/logs/actors/gen2/2023-05*.log* --slow 1 --csv /tmp/g2stats
+#
+from gen2Actor import logstats
+
+if __name__ == "__main__":
+    logstats.main()
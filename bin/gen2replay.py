@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+
+# Replay a session recorded with the gen2 recordSession command against a fake Gen2. e.g.
+#   gen2replay.py $ICS_MHS_DATA_ROOT/gen2/sessions/session-20230501T180000.jsonl --speed 10
+#   gen2replay.py session.jsonl --speed 0 --threads 8 --out /tmp/replay.json
+#
+from gen2Actor import replay
+
+if __name__ == "__main__":
+    replay.main()
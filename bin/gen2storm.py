@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+
+# Load-test the archiving keyvar callbacks with bursts of synthetic updates, against a fake Gen2. e.g.
+#   gen2storm.py --rates 10,50,100,200 --duration 20 --mix mcs=8,agcc=2
+#   gen2storm.py --archiveLatency 0.5 --out /tmp/storm.json
+#
+from gen2Actor import storm
+
+if __name__ == "__main__":
+    storm.main()
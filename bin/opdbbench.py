@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+
+from gen2Actor import opdbpool
+
+
+def worker(pool, threadNum, nVisits):
+    """Mimic the getVisit + updateTelStatus traffic for a run of visits. """
+
+    for i in range(nVisits):
+        visit = threadNum * 100000 + i
+        now = datetime.datetime.now().isoformat()
+        pool.insert('pfs_visit', pfs_visit_id=visit, pfs_visit_description='bench',
+                    pfs_design_id=0, issued_at=now)
+        seq = pool.queryScalar('SELECT COALESCE(MAX(status_sequence_id)+1, 0) '
+                               'FROM tel_status WHERE pfs_visit_id=:visit_id',
+                               params=dict(visit_id=visit), name='nextSequenceId')
+        pool.insert('tel_status', pfs_visit_id=visit, status_sequence_id=seq,
+                    altitude=60.0, azimuth=180.0, caller='bench', created_at=now)
+        pool.insert('env_condition', pfs_visit_id=visit, status_sequence_id=seq,
+                    dome_temperature=5.0, outside_temperature=3.0, created_at=now)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gen2 opdb connection pool.')
+    parser.add_argument('--url', default=None,
+                        help='SQLAlchemy URL. Default is a scratch SQLite file.')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--visits', type=int, default=200,
+                        help='visits per thread')
+    parser.add_argument('--poolSize', type=int, default=4)
+    opts = parser.parse_args(argv)
+
+    url = opts.url
+    if url is None:
+        tmpdir = tempfile.mkdtemp(prefix='opdbbench')
+        url = f'sqlite:///{os.path.join(tmpdir, "opdb.sqlite")}'
+
+    pool = opdbpool.OpdbPool(url, poolSize=opts.poolSize)
+    if url.startswith('sqlite'):
+        pool.createSqliteTables()
+
+    threads = [threading.Thread(target=worker, args=(pool, i, opts.visits))
+               for i in range(opts.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f'url={url} threads={opts.threads} visits/thread={opts.visits}')
+    for stats in pool.stats:
+        print(stats.summary(pcts=(50, 90, 95, 99)))
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import functools
+import itertools
 import os
 import time
 
@@ -14,6 +15,7 @@ __all__ = ['pfsDribble',
            'mcsexpose',
            'getPfsVisit',
            'archivePfsFile',
+           'archivePfsFiles',
            'archivePfsConfig',
            'newFilePath',
            'newMcsBoresight',
@@ -66,11 +68,16 @@ def _runPfsCmd(self, actor, cmdStr, tag, timelim=30.0, callFunc=None):
       Called as callFunc(replyLine, tag=tag)
     """
 
-    self.logger.info(f'dispatching MHS command with timelim {timelim}: {actor} {cmdStr}')
+    # Ties the dispatching and finished log lines together, for gen2logstats.py.
+    # Kept on self, so that it survives reloads of this module.
+    callId = next(self.__dict__.setdefault('mhsCallIds', itertools.count(1)))
+
+    self.logger.info(f'dispatching MHS command #{callId} with timelim {timelim}: {actor} {cmdStr}')
     if callFunc is None:
         ret = self.actor.cmdr.call(actor=actor,
                                    cmdStr=cmdStr,
                                    timeLim=timelim)
+        self.logger.info(f'finished MHS command #{callId} (didFail={ret.didFail}): {actor} {cmdStr}')
         if ret.didFail:
             # If there is a text="explanation" keyword on the failing line,
             # append that to the error sent to Gen2
@@ -83,12 +90,16 @@ def _runPfsCmd(self, actor, cmdStr, tag, timelim=30.0, callFunc=None):
             raise CamCommandError(f'actor {actor} command {cmdStr} failed{extraErrorMsg}')
         return ret
     else:
-        callFunc = functools.partial(callFunc, tag=tag)
+        def mhsReply(reply, callFunc=functools.partial(callFunc, tag=tag)):
+            if reply.isDone:
+                self.logger.info(f'finished MHS command #{callId} (didFail={reply.didFail}): {actor} {cmdStr}')
+            return callFunc(reply)
+
         self.actor.cmdr.bgCall(actor=actor,
                                cmdStr=cmdStr,
                                timeLim=timelim,
                                callCodes=AllCodes,
-                               callFunc=callFunc)
+                               callFunc=mhsReply)
         return None
 
 def pfsDribble(self, reply, tag=None):
@@ -97,13 +108,16 @@ def pfsDribble(self, reply, tag=None):
     self.logger.info(f'reply: {reply}, line: {reply.lastReply}')
 
     if reply.didFail:
+        try:
+            self.progress.update(tag, task_error=str(reply.lastReply))
+        except Exception as e:
+            self.logger.warning(f'failed to report the failure of {reply} to Gen2: {e}')
         raise CamCommandError(f'fail: {reply}')
     if reply.isDone:
-        self.ocs.setvals(tag, task_end=time.time(),
-                         cmd_str=f'OK')
+        self.progress.update(tag, task_end=time.time(),
+                             cmd_str=f'OK')
         return
-    self.ocs.setvals(tag, cmd_str=str(reply.lastReply))
-    time.sleep(0.1)
+    self.progress.update(tag, cmd_str=str(reply.lastReply))
 
 def pfscmd(self, tag=None, actor=None, cmd=None, callFunc=None, timelim=None, keyVars=None):
     """ Send an arbitrary command to an arbitrary actor.
@@ -132,14 +146,15 @@ def pfscmd(self, tag=None, actor=None, cmd=None, callFunc=None, timelim=None, ke
     if callFunc is True:
         callFunc = self.pfsDribble
 
-    self.ocs.setvals(subtag, task_start=time.time(),
-                     cmd_str=f'calling {actor} {cmd} ...')
+    self.progress.update(subtag, task_start=time.time(),
+                         cmd_str=f'calling {actor} {cmd} ...')
     ret = self._runPfsCmd(actor, cmd, subtag, timelim=timelim, callFunc=callFunc)
 
     if callFunc is None:
         lines = [str(l) for l in ret.replyList]
-        self.ocs.setvals(subtag,
-                         cmd_str='\n'.join(lines))
+        self.progress.update(subtag,
+                             cmd_str='\n'.join(lines))
+        self.progress.flush(subtag)
     return ret
 
 def keyFromReply(self, cmdReply, keyName):
@@ -155,8 +170,8 @@ def mcsexpose(self, tag=None, exptype='bias', exptime=0.0, docentroid='FALSE'):
 
     subtag = self._subtag(tag)
 
-    self.ocs.setvals(subtag, task_start=time.time(),
-                     cmd_str=f'Starting {exptype} exposure')
+    self.progress.update(subtag, task_start=time.time(),
+                         cmd_str=f'Starting {exptype} exposure')
 
     if exptype in {'object', 'test'} and docentroid == 'true':
         doCentroidArg = "doCentroid"
@@ -171,33 +186,68 @@ def mcsexpose(self, tag=None, exptype='bias', exptime=0.0, docentroid='FALSE'):
                           cmd=f'expose {exptype} expTime={exptime} {doCentroidArg}',
                           timelim=exptime + 15)
 
-    self.ocs.setvals(subtag, cmd_str="Finished MCS exposure",
-                     task_end=time.time())
+    self.progress.update(subtag, cmd_str="Finished MCS exposure",
+                         task_end=time.time())
 
 def _frameToVisit(self, frame):
     return int(frame[4:4+6], base=10), int(frame[10:12], base=10)
 
-def getPfsVisit(self):
-    """ Return a PFS visit ID, wrapping the standard .reqframes() """
+def getPfsVisit(self, timeout=None, fallback=None):
+    """ Return a PFS visit ID, wrapping the standard .reqframes()
+
+    Args
+    ----
+    timeout : float
+      How long to wait for Gen2. Defaults to the ocsGuard getFrames deadline.
+    fallback : LocalVisitAllocator
+      If set, where to get a visit if Gen2 fails or is too slow.
+    """
+
+    if fallback is None:
+        frame = self.reqframes(num=100, deadline=timeout)[0]
+    else:
+        try:
+            frame = self.reqframes(num=100, deadline=timeout)[0]
+        except Exception as e:
+            self.logger.warning('reqframes failed: %s', e)
+            return fallback.allocate(reason=f'reqframes failed: {e}')
 
-    frame = self.reqframes(num=100)[0]
     visit, rest = self._frameToVisit(frame)
+    if rest != 0:
+        # Someone has taken PFSA frames other than in blocks of 100.
+        msg = f'reqframes returned {frame}, which does not start a visit'
+        if fallback is None:
+            raise CamCommandError(msg)
+        self.logger.warning(msg)
+        return fallback.allocate(reason=msg)
 
     return visit
 
 def archivePfsFile(self, pathname, frameId=None):
-    if frameId is None:
-        filename = os.path.basename(pathname)
-        fullframeId = os.path.splitext(filename)[0]
-        frameId = fullframeId
+    self.archivePfsFiles([(pathname, frameId)])
 
-    framelist = [(frameId, pathname, os.path.getsize(pathname))]
+def archivePfsFiles(self, files):
+    """ Archive several files with a single Gen2 archive_framelist call.
+
+    Args
+    ----
+    files : list of (pathname, frameId)
+      The files to archive. A frameId of None means to take it from the filename.
+    """
+
+    framelist = []
+    for pathname, frameId in files:
+        if frameId is None:
+            filename = os.path.basename(pathname)
+            frameId = os.path.splitext(filename)[0]
+        framelist.append((frameId, pathname, os.path.getsize(pathname)))
     self.logger.info('archiving: %s' % (framelist))
 
-    self.ocs.archive_framelist(framelist)
+    self.ocsGuard.call('archive_framelist', framelist)
+    self.logger.info('archived: %s' % (','.join(f[0] for f in framelist)))
 
 def archivePfsConfig(self, frameId, pathname):
     framelist = [(frameId, pathname, os.path.getsize(pathname))]
     self.logger.info('archiving: %s' % (framelist))
 
-    self.ocs.archive_framelist(framelist)
+    self.ocsGuard.call('archive_framelist', framelist)
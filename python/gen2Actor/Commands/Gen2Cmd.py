@@ -1,25 +1,44 @@
 #!/usr/bin/env python
 
+import collections
+import concurrent.futures
 import datetime
 import logging
 import os
 import re
+import threading
 import time
 from zoneinfo import ZoneInfo
 
 import numpy as np
+from twisted.internet import reactor
 
 import opscore.protocols.keys as keys
 import opscore.protocols.types as types
 from opscore.utility.qstr import qstr
 from pfs.utils import butler
 
-from pfs.utils.database.opdb import OpDB
-
 import astropy.coordinates
 import astropy.units as u
 
+from gen2Actor import alerts
+from gen2Actor import archiveagg
+from gen2Actor import archiveledger
+from gen2Actor import archivescan
+from gen2Actor import checksums
+from gen2Actor import framepool
+from gen2Actor import logpipe
 from gen2Actor import cachedict
+from gen2Actor import opdbpool
+from gen2Actor import reactorcmd
+from gen2Actor import session
+from gen2Actor import shmstatus
+from gen2Actor import statusgroups
+from gen2Actor import statusrecorder
+from gen2Actor import statussource
+from gen2Actor import subscriptions
+from gen2Actor import visitalloc
+from gen2Actor import visitsummary
 
 
 class Gen2Cmd(object):
@@ -39,23 +58,43 @@ class Gen2Cmd(object):
             ('getVisit', '[<caller>] [<designId>]', self.getVisit),
             ('updateTelStatus', '[<caller>] [<visit>]',
              self.updateTelStatus),
+            ('endVisit', '<visit>', self.endVisit),
             ('updateDomeState', '',
              self.updateDomeState),
+            ('statusGroups', '[<group>] [<period>]', self.statusGroups),
+            ('subscribe', '[<aliases>] [<groups>] [<period>] [<subscriber>]', self.subscribe),
+            ('unsubscribe', '[<subscriber>]', self.unsubscribe),
+            ('subscriptions', '', self.listSubscriptions),
+            ('getGen2Keys', '<aliases> [<maxAge>] [<cnt>] [<rate>]', self.getGen2Keys),
+            ('getFrameIds', '<frameType> [<cnt>]', self.getFrameIds),
+            ('framePools', '', self.listFramePools),
+            ('statusSources', '', self.statusSources),
+            ('ocsStats', '', self.ocsStats),
             ('gen2Reload', '', self.gen2Reload),
-            ('archive', '<pathname>', self.archive),
+            ('archive', '<pathname> [@force]', self.archive),
+            ('archiveStatus', '[<pathname>]', self.archiveStatus),
+            ('catchUp', '<startDay> <endDay> [@dryRun]', self.catchUp),
+            ('recordSession', '[@stop]', self.recordSession),
             ('updateArchiving', '', self.updateArchiving),
             ('makeTables', '', self.makePfsTables),
             ('setupCallbacks', '', self.setupCallbacks),
             ('sendAlert', '[<id>] <name> <severity> [<description>] [<detail>]', self.sendAlert),
             ('clearAlert', '<id>', self.clearAlert),
+            ('listAlerts', '', self.listAlerts),
+            ('opdbStats', '', self.opdbStats),
+            ('logPipeline', '', self.logPipelineStats),
+            ('commandLanes', '', self.commandLanes),
+            ('progressStats', '', self.progressStats),
+            ('checksumStats', '', self.checksumStats),
+            ('localVisits', '[@reconciled]', self.localVisits),
         ]
 
         # Define typed command arguments for the above commands.
         self.keys = keys.KeysDictionary("core_core", (1, 1),
                                         keys.Key("caller", types.String(),
                                                  help='who should be listed as requesting a visit.'),
-                                        keys.Key("frameType", types.Enum('A', 'A9'),
-                                                 help=''),
+                                        keys.Key("frameType", types.Enum('A', 'B', 'C', 'D', 'A9'),
+                                                 help='Gen2 frame type, e.g. A for PFSA frames'),
                                         keys.Key("cam", types.String(),
                                                  help='camera name, e.g. r1'),
                                         keys.Key("pathname", types.String(),
@@ -83,13 +122,46 @@ class Gen2Cmd(object):
                                                  help='one-line description, for Gen2 alerts'),
                                         keys.Key('detail', types.String(),
                                                  help='further details, for Gen2 alerts. Can be multiline.'),
+                                        keys.Key('startDay', types.String(),
+                                                 help='first day to scan, YYYY-MM-DD'),
+                                        keys.Key('endDay', types.String(),
+                                                 help='last day to scan, YYYY-MM-DD'),
+                                        keys.Key('group', types.String(),
+                                                 help='name of a group of Gen2 status keys'),
+                                        keys.Key('period', types.Float(),
+                                                 help='seconds between polls'),
+                                        keys.Key('aliases', types.String()*(1, None),
+                                                 help='Gen2 status aliases, e.g. TSCS.AZ'),
+                                        keys.Key('groups', types.String()*(1, None),
+                                                 help='names of groups of Gen2 status keys'),
+                                        keys.Key('maxAge', types.Float(),
+                                                 help='oldest cached value to accept, seconds'),
+                                        keys.Key('rate', types.Float(),
+                                                 help='samples per second'),
+                                        keys.Key('subscriber', types.String(),
+                                                 help='who status subscription updates are for'),
                                         keys.Key('severity',
                                                  types.Enum('debug', 'normal', 'ok', 'info', 'warning', 'error', 'critical'),
                                                  help='Gen2-defined alert levels'),
                                         )
 
         self.logger = logging.getLogger('Gen2Cmd')
-        self.opdb = OpDB()
+        self.logPipeline = self._getLogPipeline()
+        self.opdb = self._getOpdbPool()
+        self.visitAllocator = self._getVisitAllocator()
+        self.visitTimeout = float(self.actor.actorConfig['gen2'].get('visitTimeout', 5.0))
+        self.visitExecutor = self._getVisitExecutor()
+        self.alertManager = self._getAlertManager()
+        self.archiveAggregator = self._getArchiveAggregator()
+        self.archiveLedger = self._getArchiveLedger()
+        self.checksumPool = self._getChecksumPool()
+        self.archiveExecutor = self._getArchiveExecutor()
+        self.subscriptions = self._getSubscriptions()
+        self.statusPoller = self._startStatusPoller()
+        self.statusRecorder = self._getStatusRecorder()
+        self.visitSummarizer = self._getVisitSummarizer()
+        self.shmStatus = self._getShmStatusWriter()
+        self.framePools = self._getFramePools()
         self.visit = 0
         self.statusSequences = cachedict.cacheDict(size=10)
 
@@ -97,6 +169,679 @@ class Gen2Cmd(object):
         self.setupCallbacks()
         self.updateArchiving()
 
+    def _getLogPipeline(self):
+        """Put the actor's log handlers behind a queue and a rate limit, once. """
+
+        try:
+            return self.actor.logPipeline
+        except AttributeError:
+            pass
+
+        self.actor.logPipeline = logpipe.fromConfig(logging.getLogger(), self.actor.actorConfig['gen2'])
+        return self.actor.logPipeline
+
+    def _getOpdbPool(self):
+        """Return the actor's opdb connection pool, creating it if necessary.
+
+        The pool is kept on the actor so that it survives reloads of this module.
+        """
+        try:
+            return self.actor.opdbPool
+        except AttributeError:
+            pass
+
+        gen2Config = self.actor.actorConfig['gen2']
+        url = opdbpool.opdbUrl(gen2Config)
+        poolSize = int(gen2Config.get('opdbPoolSize', 4))
+        self.actor.opdbPool = opdbpool.OpdbPool(url, poolSize=poolSize,
+                                                logger=logging.getLogger('opdbpool'))
+        return self.actor.opdbPool
+
+    def _stateDir(self):
+        """Return the directory where we keep our persistent local state. """
+
+        stateDir = self.actor.actorConfig['gen2'].get('stateDir', '$ICS_MHS_DATA_ROOT/gen2')
+        stateDir = os.path.expandvars(stateDir)
+        os.makedirs(stateDir, exist_ok=True)
+        return stateDir
+
+    def _getVisitAllocator(self):
+        """Return the actor's local visit allocator, creating it if necessary. """
+
+        try:
+            return self.actor.visitAllocator
+        except AttributeError:
+            pass
+
+        visitRange = self.actor.actorConfig['gen2'].get('localVisitRange', (990000, 999999))
+        if isinstance(visitRange, str):
+            visitRange = visitRange.split(',')
+        first, last = visitRange
+        self.actor.visitAllocator = visitalloc.LocalVisitAllocator(self._stateDir(),
+                                                                   first=int(first), last=int(last),
+                                                                   logger=logging.getLogger('visitalloc'))
+        return self.actor.visitAllocator
+
+    def _getVisitExecutor(self):
+        """Return the actor's thread pool for the overlapped getVisit stages, creating it if necessary. """
+
+        try:
+            return self.actor.visitExecutor
+        except AttributeError:
+            pass
+
+        self.actor.visitExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=8,
+                                                                         thread_name_prefix='getVisit')
+        return self.actor.visitExecutor
+
+    def _getAlertManager(self):
+        """Return the actor's Gen2 alert manager, creating it if necessary. """
+
+        try:
+            return self.actor.alertManager
+        except AttributeError:
+            pass
+
+        def sendEvent(ev):
+            self.actor.gen2.ocsGuard.call('send_event', ev)
+
+        gen2Config = self.actor.actorConfig['gen2']
+        self.actor.alertManager = alerts.AlertManager(sendEvent,
+                                                      window=float(gen2Config.get('alertWindow', 60.0)),
+                                                      batchDelay=float(gen2Config.get('alertBatchDelay', 0.5)),
+                                                      logger=logging.getLogger('alerts'))
+        return self.actor.alertManager
+
+    def _getArchiveAggregator(self):
+        """Return the actor's per-visit archive aggregator, creating it if necessary.
+
+        Returns None if archiveBatchTimeout is 0, in which case each file is archived on its own.
+        """
+
+        try:
+            return self.actor.archiveAggregator
+        except AttributeError:
+            pass
+
+        actor = self.actor
+
+        def submit(visit, entries):
+            # A file which has gone missing fails alone, not with the rest of its visit.
+            files = []
+            for path, filetype, frameId in entries:
+                try:
+                    os.path.getsize(path)
+                except OSError as e:
+                    actor.archiveLedger.append(path, 'failed', visit=visit, error=str(e))
+                    continue
+                files.append((str(path), frameId))
+            if not files:
+                return
+
+            try:
+                actor.gen2.archivePfsFiles(files)
+            except Exception as e:
+                for path, frameId in files:
+                    actor.archiveLedger.append(path, 'failed', visit=visit, error=str(e))
+                raise
+            for path, frameId in files:
+                actor.archiveLedger.append(path, 'archived', visit=visit)
+
+        def complete(visit):
+            # All of a visit's SPS files are in: it is over.
+            summarizer = getattr(actor, 'visitSummarizer', None)
+            if summarizer is not None:
+                summarizer.visitEnded(visit)
+
+        timeout = float(self.actor.actorConfig['gen2'].get('archiveBatchTimeout', 30.0))
+        if timeout <= 0:
+            self.actor.archiveAggregator = None
+        else:
+            # Batches complete on the reactor: never make their Gen2 call there.
+            executor = self._getArchiveExecutor()
+            self.actor.archiveAggregator = archiveagg.ArchiveAggregator(submit, onComplete=complete,
+                                                                        executor=executor,
+                                                                        timeout=timeout,
+                                                                        logger=logging.getLogger('archiveagg'))
+        return self.actor.archiveAggregator
+
+    def _getArchiveLedger(self):
+        """Return the actor's archive ledger, creating it if necessary. """
+
+        try:
+            return self.actor.archiveLedger
+        except AttributeError:
+            pass
+
+        path = os.path.join(self._stateDir(), 'archiveLedger.jsonl')
+        self.actor.archiveLedger = archiveledger.ArchiveLedger(path, logger=logging.getLogger('archiveledger'))
+        return self.actor.archiveLedger
+
+    def _getChecksumPool(self):
+        """Return the actor's checksum process pool, creating it if necessary.
+
+        Returns None if archiveChecksum is 'none'.
+        """
+
+        try:
+            return self.actor.checksumPool
+        except AttributeError:
+            pass
+
+        gen2Config = self.actor.actorConfig['gen2']
+        algorithm = gen2Config.get('archiveChecksum', 'md5')
+        if algorithm == 'none':
+            self.actor.checksumPool = None
+        else:
+            self.actor.checksumPool = checksums.ChecksumPool(nProcs=int(gen2Config.get('checksumProcs', 2)),
+                                                             algorithm=algorithm)
+        return self.actor.checksumPool
+
+    def _getArchiveExecutor(self):
+        """Return the actor's thread pool for checksumming and archiving files off the reactor. """
+
+        try:
+            return self.actor.archiveExecutor
+        except AttributeError:
+            pass
+
+        self.actor.archiveExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=4,
+                                                                           thread_name_prefix='archive')
+        return self.actor.archiveExecutor
+
+    def _getStatusRecorder(self):
+        """Return the actor's recorder of full Gen2 status snapshots, creating it if necessary.
+
+        The gen2 side records into it each time it latches the status.
+        Returns None if recordStatus is false.
+        """
+
+        try:
+            return self.actor.statusRecorder
+        except AttributeError:
+            pass
+
+        gen2Config = self.actor.actorConfig['gen2']
+        if str(gen2Config.get('recordStatus', True)).lower() in ('false', '0', 'no'):
+            self.actor.statusRecorder = None
+        else:
+            root = os.path.join(self._stateDir(), 'status')
+            capacity = int(gen2Config.get('statusRecordCapacity', 20000))
+            self.actor.statusRecorder = statusrecorder.StatusRecorder(root, capacity=capacity,
+                                                                      logger=logging.getLogger('statusrecorder'))
+        return self.actor.statusRecorder
+
+    def _getVisitSummarizer(self):
+        """Return the actor's per-visit status summarizer, creating it if necessary.
+
+        Returns None if we are not recording the status, which it summarizes.
+        """
+
+        try:
+            return self.actor.visitSummarizer
+        except AttributeError:
+            pass
+
+        recorder = self.actor.statusRecorder
+        if recorder is None:
+            self.actor.visitSummarizer = None
+        else:
+            path = os.path.join(self._stateDir(), 'visitSummaries.jsonl')
+            self.actor.visitSummarizer = visitsummary.VisitSummarizer(recorder.root, path,
+                                                                      logger=logging.getLogger('visitsummary'))
+        return self.actor.visitSummarizer
+
+    def _getShmStatusWriter(self):
+        """Return the actor's shared memory status publisher, creating it if necessary.
+
+        The gen2 side publishes each full status latch through it, for
+        actors on this host to read with `shmstatus.ShmStatusReader`.
+        Returns None if shmStatusName is empty or the segment cannot be created.
+        """
+
+        try:
+            return self.actor.shmStatus
+        except AttributeError:
+            pass
+
+        name = self.actor.actorConfig['gen2'].get('shmStatusName', shmstatus.DEFAULT_NAME)
+        writer = None
+        if name:
+            try:
+                writer = shmstatus.ShmStatusWriter(name, logger=logging.getLogger('shmstatus'))
+            except Exception as e:
+                self.logger.warning(f'cannot publish status in shared memory {name}: {e}')
+        self.actor.shmStatus = writer
+        return writer
+
+    def _getFramePools(self):
+        """Return the actor's frame ID pools, by frame type, creating them if necessary.
+
+        They are configured by framePools, a list of type:batchSize:lowWater.
+        The pools are filled by their first draw, and again as they are drawn down.
+        'A' frames, which share the Gen2 counter with the visits, are never pooled.
+        """
+
+        try:
+            return self.actor.framePools
+        except AttributeError:
+            pass
+
+        actor = self.actor
+        config = actor.actorConfig['gen2'].get('framePools', 'B:100:20,C:100:20,D:100:20')
+        pools = dict()
+        for spec in str(config).split(','):
+            spec = spec.strip()
+            if not spec:
+                continue
+            frameType, batchSize, lowWater = spec.split(':')
+            if frameType in framepool.unpooledFrameTypes:
+                self.logger.warning(f'not pooling {frameType} frame IDs: they are used for visits')
+                continue
+
+            def fetch(num, frameType=frameType):
+                return actor.gen2.reqframes(num=num, type=frameType)
+
+            pools[frameType] = framepool.FramePool(frameType, fetch,
+                                                   batchSize=int(batchSize), lowWater=int(lowWater),
+                                                   logger=logging.getLogger('framepool'))
+        actor.framePools = pools
+        return pools
+
+    def _getSubscriptions(self):
+        """Return the actor's status subscriptions, creating them if needed. """
+
+        try:
+            return self.actor.statusSubscriptions
+        except AttributeError:
+            pass
+
+        minPeriod = float(self.actor.actorConfig['gen2'].get('subscriptionMinPeriod', 1.0))
+        subs = subscriptions.SubscriptionSet(minPeriod=minPeriod,
+                                             logger=logging.getLogger('subscriptions'))
+        self.actor.statusSubscriptions = subs
+        return subs
+
+    def _callInReactor(self, func, *args, **kwargs):
+        """Have the reactor thread call func, as replies must not be sent from our own threads.
+
+        An actor with a `reactor` attribute (e.g. `fakes.FakeActor`) uses that instead of twisted's.
+        """
+
+        getattr(self.actor, 'reactor', reactor).callFromThread(func, *args, **kwargs)
+
+    def _reactorCmd(self, cmd):
+        """Return cmd wrapped so that its replies can be made from any thread. """
+
+        return reactorcmd.ReactorCmd(cmd, self._callInReactor)
+
+    def _startStatusPoller(self):
+        """(Re-)start the thread which polls our small Gen2 status groups.
+
+        Any poller left over from a previous load of this module is stopped,
+        so that the group callbacks always call into the current object.
+        """
+
+        oldPoller = getattr(self.actor, 'statusPoller', None)
+        oldPeriods = dict()
+        if oldPoller is not None:
+            oldPeriods = {g.name: g.period for g in oldPoller.getGroups()}
+            oldPoller.stop()
+
+        def fetch(cards):
+            gen2 = getattr(self.actor, 'gen2', None)
+            if gen2 is None or getattr(gen2, 'ocs', None) is None:
+                raise RuntimeError('Gen2 connection not yet initialized')
+            return gen2.fetch_status(cards)
+
+        def domeCallback(snap):
+            self._callInReactor(self._updateDomeState, self.actor.bcast,
+                                statusDict=snap, onlyOnChanges=True)
+
+        domePeriod = float(self.actor.actorConfig['gen2'].get('domePollPeriod', 5.0))
+        poller = statusgroups.StatusPoller(fetch, logger=logging.getLogger('statusgroups'))
+        poller.addGroup(statusgroups.StatusGroup('dome', statusgroups.domeCards,
+                                                 oldPeriods.get('dome', domePeriod),
+                                                 domeCallback))
+        self._updateSubscriptionGroup(poller)
+        poller.start()
+
+        self.actor.statusPoller = poller
+        return poller
+
+    def statusGroups(self, cmd):
+        """List the polled Gen2 status groups, or change the polling period of one. """
+
+        cmdKeys = cmd.cmd.keywords
+        if 'group' in cmdKeys:
+            name = str(cmdKeys['group'].values[0])
+            groups = [g for g in self.statusPoller.getGroups() if g.name == name]
+            if not groups:
+                cmd.fail(f'text="unknown status group: {name}"')
+                return
+            if 'period' in cmdKeys:
+                groups[0].period = float(cmdKeys['period'].values[0])
+        else:
+            groups = self.statusPoller.getGroups()
+
+        now = time.monotonic()
+        for g in groups:
+            cmd.inform(f'statusGroup={g.name},{g.period:0.1f},{now - g.lastPolled:0.1f},'
+                       f'{g.nPolls},{g.nFailures},{qstr(" ".join(g.cards))}')
+        cmd.finish()
+
+    def _updateSubscriptionGroup(self, poller=None):
+        """Make the polled 'subscriptions' group match the current subscriptions. """
+
+        if poller is None:
+            poller = self.statusPoller
+        old = poller.removeGroup('subscriptions')
+        aliases = self.subscriptions.union()
+        if not aliases:
+            return
+
+        def fetch(aliases):
+            gen2 = getattr(self.actor, 'gen2', None)
+            if gen2 is None or getattr(gen2, 'statusSource', None) is None:
+                raise RuntimeError('Gen2 connection not yet initialized')
+            return gen2.statusSource.fetch(aliases)
+
+        group = statusgroups.StatusGroup('subscriptions', aliases, self.subscriptions.period(),
+                                         self._pushSubscriptions, fetch=fetch)
+        if old is not None:
+            group.lastPolled = old.lastPolled
+            group.nPolls = old.nPolls
+            group.nFailures = old.nFailures
+        poller.addGroup(group)
+
+    def _pushSubscriptions(self, values):
+        """Tell each subscriber about those of its values which changed.
+
+        Called from the poller thread, so the replies are sent from the reactor.
+        """
+
+        replies = []
+        for subscriber, changed in self.subscriptions.changes(values, time.monotonic()):
+            for alias, val in changed.items():
+                _, valStr = self._formatGen2Value(val)
+                replies.append(f'gen2Subscribed={qstr(subscriber)},{qstr(alias)},{valStr}')
+        if replies:
+            self._callInReactor(self._informAll, self.actor.bcast, replies)
+
+    def _informAll(self, cmd, replies):
+        for reply in replies:
+            cmd.inform(reply)
+
+    def _formatGen2Value(self, val):
+        """Return the type ('I', 'F', 'S', or 'Bad' for Gen2's placeholders) and MHS form of a raw value. """
+
+        if isinstance(val, (bool, np.bool_, int, np.integer)):
+            return 'I', str(int(val))
+        if isinstance(val, (float, np.floating)):
+            return 'F', repr(float(val))
+        if val in statussource.badValues:
+            return 'Bad', qstr('' if val is None else str(val))
+        return 'S', qstr(str(val))
+
+    def _subscriptionAliases(self, groups):
+        """Return the Gen2 aliases behind some named status groups. """
+
+        header = self.actor.gen2.tel_header
+        aliases = []
+        for name in groups:
+            try:
+                cards = statusgroups.namedGroups[name]
+            except KeyError:
+                raise KeyError(f'unknown status group: {name} '
+                               f'(known: {",".join(statusgroups.namedGroups)})')
+            for card in cards:
+                alias = header[card][0]
+                if alias != 'NA':
+                    aliases.append(alias)
+        return aliases
+
+    def subscribe(self, cmd):
+        """Push changes to some Gen2 status values to a subscriber, at most every period seconds.
+
+        The values are sent as gen2Subscribed=subscriber,alias,value
+        keywords, starting with all of them. The subscriber defaults to
+        the commander. Subscribing again replaces the earlier subscription.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        subscriber = str(cmdKeys['subscriber'].values[0]) if 'subscriber' in cmdKeys else cmd.cmdr
+        period = float(cmdKeys['period'].values[0]) if 'period' in cmdKeys else 5.0
+
+        aliases = [str(a) for a in cmdKeys['aliases'].values] if 'aliases' in cmdKeys else []
+        if 'groups' in cmdKeys:
+            try:
+                aliases.extend(self._subscriptionAliases(str(g) for g in cmdKeys['groups'].values))
+            except KeyError as e:
+                cmd.fail(f'text={qstr(e.args[0])}')
+                return
+        if not aliases:
+            cmd.fail('text="no aliases or groups to subscribe to"')
+            return
+
+        # Check that Gen2 knows them all now, rather than failing everyone's polls later.
+        try:
+            self.actor.gen2.statusSource.fetch(aliases)
+        except Exception as e:
+            cmd.fail(f'text={qstr(f"cannot fetch {aliases} from Gen2: {e}")}')
+            return
+
+        sub = self.subscriptions.subscribe(subscriber, aliases, period)
+        self._updateSubscriptionGroup()
+        cmd.finish(f'gen2Subscription={qstr(subscriber)},{sub.period:0.1f},0,0,'
+                   f'{qstr(" ".join(sub.aliases))}')
+
+    def unsubscribe(self, cmd):
+        """Stop pushing status values to a subscriber (by default, the commander). """
+
+        cmdKeys = cmd.cmd.keywords
+        subscriber = str(cmdKeys['subscriber'].values[0]) if 'subscriber' in cmdKeys else cmd.cmdr
+        if self.subscriptions.unsubscribe(subscriber) is None:
+            cmd.fail(f'text={qstr(f"{subscriber} has no status subscription")}')
+            return
+        self._updateSubscriptionGroup()
+        cmd.finish()
+
+    def listSubscriptions(self, cmd):
+        """List the status subscriptions, with how much each has been sent. """
+
+        for sub in self.subscriptions.getSubscriptions():
+            cmd.inform(f'gen2Subscription={qstr(sub.subscriber)},{sub.period:0.1f},'
+                       f'{sub.nPushes},{sub.nValues},{qstr(" ".join(sub.aliases))}')
+        period = self.subscriptions.period()
+        cmd.finish(f'gen2SubscriptionPoll={len(self.subscriptions.union())},'
+                   f'{0.0 if period is None else period:0.1f}')
+
+    def getGen2Keys(self, cmd):
+        """Fetch any Gen2 status aliases, in one request, optionally sampling them repeatedly.
+
+        Each value is returned, with its age in seconds, as one of
+        gen2KeyI, gen2KeyF or gen2KeyS=alias,value,age by type, or
+        gen2KeyBad=alias,placeholder,age if Gen2 has no good value.
+        Values fetched by anything else within maxAge seconds (default
+        1) are returned from the cache. With cnt, the aliases are sampled
+        cnt times, at rate samples per second (default 1), and each
+        sample starts with gen2KeySample=n,timestamp.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        aliases = [str(a) for a in cmdKeys['aliases'].values]
+        maxAge = float(cmdKeys['maxAge'].values[0]) if 'maxAge' in cmdKeys else 1.0
+        cnt = int(cmdKeys['cnt'].values[0]) if 'cnt' in cmdKeys else None
+        rate = float(cmdKeys['rate'].values[0]) if 'rate' in cmdKeys else 1.0
+        if rate <= 0:
+            cmd.fail('text="rate must be positive"')
+            return
+
+        if cnt is None:
+            self._sampleGen2Keys(cmd, aliases, maxAge, 1, rate, tagSamples=False)
+            return
+
+        # Each sample should be fresh, so do not accept values older than the sampling period.
+        maxAge = min(maxAge, 1.0 / rate)
+        t = threading.Thread(target=self._sampleGen2Keys,
+                             args=(self._reactorCmd(cmd), aliases, maxAge, cnt, rate),
+                             name='getGen2Keys', daemon=True)
+        t.start()
+
+    def _sampleGen2Keys(self, cmd, aliases, maxAge, cnt, rate, tagSamples=True):
+        source = self.actor.gen2.statusSource
+        period = 1.0 / rate
+        start = time.monotonic()
+        for n in range(cnt):
+            due = start + n * period
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                values, ages = source.fetchCached(aliases, maxAge)
+            except Exception as e:
+                cmd.fail(f'text={qstr(f"failed to fetch Gen2 status: {e}")}')
+                return
+
+            if tagSamples:
+                cmd.inform(f'gen2KeySample={n + 1},{time.time():0.3f}')
+            for alias, val in values.items():
+                kind, valStr = self._formatGen2Value(val)
+                cmd.inform(f'gen2Key{kind}={qstr(alias)},{valStr},{ages[alias]:0.3f}')
+        cmd.finish()
+
+    def getFrameIds(self, cmd):
+        """Draw cnt (default 1) Gen2 frame IDs of one type from our pool. """
+
+        cmdKeys = cmd.cmd.keywords
+        frameType = str(cmdKeys['frameType'].values[0])
+        cnt = int(cmdKeys['cnt'].values[0]) if 'cnt' in cmdKeys else 1
+        pool = self.framePools.get(frameType)
+        if pool is None:
+            cmd.fail(f'text="no frame ID pool for type {frameType}"')
+            return
+        if cnt < 1:
+            cmd.fail('text="cnt must be at least 1"')
+            return
+
+        if pool.available() >= cnt:
+            self._drawFrameIds(cmd, pool, cnt)
+        else:
+            # We would have to wait for Gen2: do not hold up other commands.
+            t = threading.Thread(target=self._drawFrameIds,
+                                 args=(self._reactorCmd(cmd), pool, cnt),
+                                 name='getFrameIds', daemon=True)
+            t.start()
+
+    def _drawFrameIds(self, cmd, pool, cnt):
+        try:
+            frameIds = pool.draw(cnt)
+        except Exception as e:
+            cmd.fail(f'text={qstr(f"failed to get {cnt} {pool.frameType} frame IDs: {e}")}')
+            return
+        cmd.finish(f'frameIds={pool.frameType},{",".join(frameIds)}')
+
+    def listFramePools(self, cmd):
+        """Report the stock and use of each frame ID pool. """
+
+        for frameType, pool in self.framePools.items():
+            cmd.inform(f'framePool={frameType},{pool.available()},{pool.batchSize},{pool.lowWater},'
+                       f'{pool.nDrawn},{pool.nFetched},{pool.nWaits}')
+            cmd.inform(f'framePoolLatency={pool.fetchStats.keyValues()}')
+        cmd.finish()
+
+    def statusSources(self, cmd):
+        """Report the latency and health of each Gen2 status interface. """
+
+        source = self.actor.gen2.statusSource
+        for backend in source.candidates():
+            stats = source.stats[backend]
+            cmd.inform(f'statusSource={stats.keyValues()},{not source.isDemoted(backend)}')
+        cmd.inform(f'statusCache={len(source.cache)},{source.nCacheHits},{source.nCacheMisses}')
+        cmd.finish(f'statusSourceInUse={source.lastUsed}')
+
+    def ocsStats(self, cmd):
+        """Report latencies, hedges and circuit breaker states for our Gen2 OCS calls. """
+
+        guard = self.actor.gen2.ocsGuard
+        edges = ','.join(f'{e:g}' for e in guard.histogramEdges)
+        cmd.inform(f'ocsHistogramEdges={edges}')
+        for stats in guard.stats:
+            name = stats.name
+            breaker = guard.breaker(name)
+            cmd.inform(f'ocsLatency={stats.keyValues()}')
+            cmd.inform(f'ocsHistogram="{name}",{",".join(str(c) for c in guard.histogram(name))}')
+            cmd.inform(f'ocsCall="{name}",{breaker.state},{breaker.failures},{guard.nHedges.get(name, 0)}')
+        cmd.finish(f'ocsAbandoned={guard.nAbandoned},{guard.maxAbandoned}')
+
+    def localVisits(self, cmd):
+        """List the visits we issued ourselves while Gen2 was unavailable.
+
+        These need to be registered with Gen2 by hand. Once that has been
+        done, run this with 'reconciled' to clear the list.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        issued = self.visitAllocator.issued()
+        for visit, t, reason in issued:
+            tStr = datetime.datetime.fromtimestamp(t, tz=ZoneInfo("HST")).isoformat()
+            cmd.inform(f'localVisit={visit},{qstr(tStr)},{qstr(reason)}')
+
+        if 'reconciled' in cmdKeys:
+            path = self.visitAllocator.markReconciled(visit for visit, _, _ in issued)
+            cmd.inform(f'text="marked {len(issued)} local visits as reconciled, saved in {path}"')
+        cmd.finish(f'localVisitCount={len(issued)}')
+
+    def checksumStats(self, cmd):
+        """Report the throughput of each archive checksum worker process. """
+
+        if self.checksumPool is None:
+            cmd.finish('checksumAlgorithm=none')
+            return
+
+        for pid, nFiles, mb, rate in self.checksumPool.throughput():
+            cmd.inform(f'checksumWorker={pid},{nFiles},{mb:0.1f},{rate:0.1f}')
+        cmd.finish(f'checksumAlgorithm={self.checksumPool.algorithm}')
+
+    def logPipelineStats(self, cmd):
+        """Report how many log records are queued, written and suppressed. """
+
+        pipelines = [('actor', self.logPipeline),
+                     ('gen2', getattr(self.actor, 'gen2LogPipeline', None))]
+        for name, pipeline in pipelines:
+            if pipeline is None:
+                continue
+            limiter = pipeline.limiter
+            cmd.inform(f'logPipeline={name},{pipeline.queued()},{limiter.nPassed},{limiter.nSuppressed}')
+        cmd.finish()
+
+    def commandLanes(self, cmd):
+        """Report the limits, use, admission waits and run times of each lane of Gen2 commands. """
+
+        for name, lane in self.actor.gen2.lanes.lanes.items():
+            maxRunning = -1 if lane.maxRunning is None else lane.maxRunning
+            cmd.inform(f'commandLane={name},{maxRunning},{lane.maxWaiting},'
+                       f'{lane.nRunning},{lane.nWaiting},{lane.nRefused}')
+            cmd.inform(f'commandLaneWait={lane.waitStats.keyValues()}')
+            cmd.inform(f'commandLaneRun={lane.runStats.keyValues()}')
+        cmd.finish()
+
+    def progressStats(self, cmd):
+        """Report how many subtag progress updates we were given, and how many setvals we sent. """
+
+        reporter = self.actor.gen2.progress
+        cmd.finish(f'progressStats={reporter.flushInterval},{reporter.nUpdates},'
+                   f'{reporter.nSent},{reporter.nFailed}')
+
+    def opdbStats(self, cmd):
+        """Report opdb connection health and per-statement latencies. """
+
+        ok = self.opdb.healthCheck()
+        for stats in self.opdb.stats:
+            cmd.inform(f'opdbLatency={stats.keyValues()}')
+        cmd.finish(f'opdbAlive={ok}')
+
     def getDesignId(self, cmd):
         """Return the current designId for the instrument.
 
@@ -138,44 +883,103 @@ class Gen2Cmd(object):
         We also survive opdb outages. The actors will have to be
         robust against missing pfs_visit table entries.
 
+        Only the visit itself is on the critical path: the Gen2 status
+        latch runs while we wait for Gen2 to give us a frame, and the
+        command finishes as soon as we have the visit. The pfs_visit
+        insert and the telescope keys follow on the broadcast
+        connection, then a visitTiming key with the per-stage latencies.
         """
         cmdKeys = cmd.cmd.keywords
         caller = str(cmdKeys['caller'].values[0]) if 'caller' in cmdKeys else None
         description = caller if caller is not None else cmd.cmdr
 
-        self.visit = visit = self.actor.gen2.getPfsVisit()
-        self.statusSequences[visit] = 0
+        t0 = time.monotonic()
+        startTime = time.time()
+        timing = dict()
+
+        def timed(stage, func, *args, **kwargs):
+            t = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timing[stage] = time.monotonic() - t
+
+        executor = self.visitExecutor
+        visitFuture = executor.submit(timed, 'gen2Visit', self.actor.gen2.getPfsVisit,
+                                      timeout=self.visitTimeout, fallback=self.visitAllocator)
+        statusFuture = executor.submit(timed, 'statusLatch', self._latchStatusDict,
+                                       self._reactorCmd(self.actor.bcast))
+
         try:
-            designId = self.getDesignId(cmd)
+            designId = timed('designId', self.getDesignId, cmd)
         except Exception as e:
             cmd.warn(f'text="failed to get designId: {e}"')
             designId = -9999
 
-        cmd.debug(f'text="updating opdb.pfs_visit with visit={visit}, design_id={designId}, '
-                  f'and description={description}"')
-
-        now = datetime.datetime.now(tz=ZoneInfo("HST"))
         try:
-            self.opdb.insert_kw('pfs_visit', pfs_visit_id=visit, pfs_visit_description=description,
-                             pfs_design_id=designId, issued_at=now.isoformat())
+            visit = visitFuture.result()
         except Exception as e:
-            cmd.warn('text="failed to insert into pfs_visit: %s"' % (e))
-
-        self._genActorKeys(cmd, caller=caller)
+            cmd.fail(f'text="failed to get a visit from either Gen2 or the local allocator: {e}"')
+            return
+        if self.visitAllocator.isLocal(visit):
+            cmd.warn(f'text="Gen2 did not supply a visit, so issued local visit {visit}. '
+                     f'It will need to be reconciled with Gen2."')
 
+        self.visit = visit
+        self.statusSequences[visit] = 0
+        if self.visitSummarizer is not None:
+            self.visitSummarizer.visitStarted(visit, startTime)
         cmd.finish('visit=%d' % (visit))
+        timing['reply'] = time.monotonic() - t0
+
+        executor.submit(self._finishVisit, visit, designId, description, caller,
+                        statusFuture, timed, timing, t0)
+
+    def _finishVisit(self, visit, designId, description, caller,
+                     statusFuture, timed, timing, t0):
+        """The parts of getVisit which can follow the visit= reply.
+
+        This runs on a visitExecutor thread, so all its replies go through the reactor.
+        """
+
+        cmd = self._reactorCmd(self.actor.bcast)
+        try:
+            cmd.debug(f'text="updating opdb.pfs_visit with visit={visit}, design_id={designId}, '
+                      f'and description={description}"')
+
+            now = datetime.datetime.now(tz=ZoneInfo("HST"))
+            try:
+                timed('pfsVisit', self.opdb.insert, 'pfs_visit',
+                      pfs_visit_id=visit, pfs_visit_description=description,
+                      pfs_design_id=designId, issued_at=now.isoformat())
+            except Exception as e:
+                cmd.warn('text="failed to insert into pfs_visit: %s"' % (e))
+
+            try:
+                statusDict = statusFuture.result()
+            except Exception as e:
+                cmd.warn(f'text="failed to latch Gen2 status for visit {visit}: {e}"')
+                statusDict = None
+            timed('actorKeys', self._genActorKeys, cmd, caller=caller, visit=visit,
+                  statusDict=statusDict)
+        except Exception as e:
+            self.logger.warning(f'failed to generate keys for visit {visit}: {e}', exc_info=True)
+            cmd.warn(f'text="failed to generate keys for visit {visit}: {e}"')
+        finally:
+            timing['total'] = time.monotonic() - t0
+            stages = ('reply', 'gen2Visit', 'designId', 'statusLatch', 'pfsVisit', 'actorKeys', 'total')
+            cmd.inform(f'visitTiming={visit},' +
+                       ','.join(f'{timing.get(s, float("nan")) * 1000:0.1f}' for s in stages))
 
     def clearAlert(self, cmd):
         """Clear a possibly existing Gen2 event. """
 
         cmdKeys = cmd.cmd.keywords
-        alertId = cmdKeys['id'].values[0]
+        alertId = str(cmdKeys['id'].values[0])
 
         now = time.time()
-        self.actor.gen2.ocs.send_event(dict(alarm_id=str(alertId),
-                                            name='',
-                                            timestamp=now,
-                                            severity='ok'))
+        if not self.alertManager.clearAlert(alertId, now=now):
+            cmd.debug(f'text="alert {alertId} was already cleared; not resending"')
         cmd.finish(f'alert={alertId},"",ok,{now:0.3f},"","",""')
 
     def sendAlert(self, cmd):
@@ -194,23 +998,27 @@ class Gen2Cmd(object):
         if alertId is None:
             t = int(time.time() * 1000)
             alertId = f'{cmd.cmdr}_{t}'
-        alarmDict = dict(alarm_id=alertId,
-                         severity=severity,
-                         name=alertName,
-                         timestamp=now)
-        if description:
-            alarmDict['description'] = description
-        else:
-            description = ''
-
-        if detail:
-            alarmDict['detail_text'] = detail
-        else:
-            detail = ''
 
-        self.actor.gen2.ocs.send_event(alarmDict)
+        alert, queued = self.alertManager.raiseAlert(alertId, alertName, severity,
+                                                     description=description, detail=detail,
+                                                     now=now)
+        if not queued:
+            cmd.debug(f'text="alert {alertId} unchanged; not resending (seen {alert.count} times)"')
         cmd.finish(f'alert={alertId},{alertName},{severity},{now:0.3f},{qstr(description)},{qstr(detail)}')
 
+    def listAlerts(self, cmd):
+        """List the Gen2 alerts we have raised and not yet cleared. """
+
+        mgr = self.alertManager
+        active = mgr.activeAlerts()
+        for alert in active:
+            cmd.inform(f'alert={alert.alertId},{alert.name},{alert.severity},{alert.lastChanged:0.3f},'
+                       f'{qstr(alert.description)},{qstr(alert.detail)}')
+        for alertId, t, err in mgr.failedSends():
+            cmd.warn(f'alertSendError={alertId},{t:0.3f},{qstr(err)}')
+        cmd.inform(f'alertStats={mgr.nSent},{mgr.nSuppressed},{mgr.nCoalesced},{mgr.nFailed}')
+        cmd.finish(f'alertCount={len(active)}')
+
     def updateTelStatus(self, cmd):
         """Query for a new PFS status info.
 
@@ -221,10 +1029,41 @@ class Gen2Cmd(object):
         caller = cmd.cmd.keywords['caller'].values[0] if 'caller' in cmd.cmd.keywords else None
         visit = cmd.cmd.keywords['visit'].values[0] if 'visit' in cmd.cmd.keywords else None
 
+        if visit is not None and self.visitSummarizer is not None:
+            self.visitSummarizer.visitStarted(int(visit))
         self._genActorKeys(cmd, caller=caller, visit=visit)
 
         cmd.finish()
 
+    def endVisit(self, cmd):
+        """Summarize the status recorded during a visit, into visitSummaries.jsonl in the state directory.
+
+        Visits whose SPS files all arrive are summarized automatically;
+        this is for the others, e.g. MCS or AG-only visits.
+        """
+
+        visit = int(cmd.cmd.keywords['visit'].values[0])
+        if self.visitSummarizer is None:
+            cmd.fail('text="visit summaries need the status to be recorded (recordStatus)"')
+            return
+
+        try:
+            row = self.visitSummarizer.visitEnded(visit)
+        except OSError as e:
+            cmd.fail(f'text={qstr(f"failed to write the summary of visit {visit}: {e}")}')
+            return
+        if row is None:
+            cmd.fail(f'text="visit {visit} is not known to have started, or is already summarized"')
+            return
+
+        def fmt(v):
+            return 'nan' if v is None else f'{v:0.3f}'
+
+        cmd.finish(f'visitSummary={visit},{row["n_samples"]},'
+                   + ','.join(fmt(row[c]) for c in ('dome_temperature_mean', 'outside_temperature_mean',
+                                                    'altitude_drift', 'azimuth_drift', 'insrot_drift',
+                                                    'seeing_mean')))
+
     def gen2Reload(self, cmd):
         gen2 = self.actor.gen2
 
@@ -233,7 +1072,7 @@ class Gen2Cmd(object):
 
         self.updateArchiving(cmd)
 
-    def doArchivePath(self, path, filetype, frameId=None):
+    def doArchivePath(self, path, filetype, frameId=None, visit=None, cam=None, force=False):
         """Arrange for Gen2 archiving of a single file path
 
         Args:
@@ -245,17 +1084,69 @@ class Gen2Cmd(object):
         frameId : `str`
            a Gen2-sourced frameId to identify the path. Only used
            when the id does not match the filename (PFSF v. pfsConfig)
+        visit : `int`
+           the visit the file belongs to. If set, SPS and pfsConfig files
+           are held and archived along with the rest of the visit's files.
+        cam : `str`
+           the camera or source of the file, e.g. 'r1' or 'PFSC'.
+        force : `bool`
+           archive the file even if the archive ledger says it already was.
         """
 
         if path is None or not os.path.exists(path):
             self.logger.warning(f'NOT archiving nonexistant {filetype} file {path}')
             return
 
+        path = str(path)
+        ledgerFrameId = frameId if frameId is not None else os.path.splitext(os.path.basename(path))[0]
+        if not self.archiveLedger.claim(path, os.path.getsize(path), frameId=ledgerFrameId, force=force):
+            self.logger.info(f'NOT archiving {filetype} file {path}: already archived or queued')
+            return
+
+        if self.checksumPool is None:
+            self._archivePath(path, filetype, frameId=frameId, visit=visit, cam=cam)
+        else:
+            self.archiveExecutor.submit(self._checksumAndArchive, path, filetype,
+                                        frameId=frameId, visit=visit, cam=cam)
+
+    def _checksumAndArchive(self, path, filetype, frameId=None, visit=None, cam=None):
+        """Record the checksum of a file in the archive ledger, then archive it.
+
+        Runs in an archiveExecutor thread, so that neither the hashing nor
+        the wait for it holds up the reactor.
+        """
+
+        try:
+            size, digest = self.checksumPool.checksum(path)
+            self._recordChecksum(path, size, digest, frameId=frameId, visit=visit)
+        except Exception as e:
+            self.logger.warning(f'failed to checksum {filetype} file {path}: {e}')
+
+        self._archivePath(path, filetype, frameId=frameId, visit=visit, cam=cam)
+
+    def _recordChecksum(self, path, size, digest, frameId=None, visit=None):
+        self.archiveLedger.append(path, 'checksum', size=size, frameId=frameId,
+                                  visit=None if visit is None else int(visit),
+                                  algorithm=self.checksumPool.algorithm, checksum=digest)
+
+    def _archivePath(self, path, filetype, frameId=None, visit=None, cam=None):
+        """Archive one existing file, either alone or with the rest of its visit. """
+
+        if (visit is not None and self.archiveAggregator is not None
+                and filetype in archiveagg.aggregatedFileTypes):
+            self.logger.info(f'queuing archiving of {filetype} {path} for visit {visit}')
+            self.archiveAggregator.add(visit, cam if cam is not None else filetype,
+                                       str(path), filetype, frameId=frameId)
+            return
+
         self.logger.info(f'requesting archiving of {filetype} {path}')
         try:
             self.actor.gen2.archivePfsFile(str(path), frameId=frameId)
         except Exception as e:
             self.logger.warning(f'failed to archive {filetype} file {path}: {e}')
+            self.archiveLedger.append(path, 'failed', error=str(e))
+            return
+        self.archiveLedger.append(path, 'archived')
 
     def newPfscFilename(self, keyvar):
         """ Callback for instrument 'filename' keyword updates. """
@@ -281,7 +1172,7 @@ class Gen2Cmd(object):
             self.logger.warning(f'getPath(spsFile) with {idDict} failed: {e}')
             return
 
-        self.doArchivePath(path, 'PFSA')
+        self.doArchivePath(path, 'PFSA', visit=idDict['visit'], cam=str(idDict['cam']))
 
     def newPfsbFileIds(self, keyvar):
         """Archive a PFSB file described by a hx_mn.spsFileIds keyvar. """
@@ -289,7 +1180,16 @@ class Gen2Cmd(object):
         vals = keyvar.valueList
         path = vals[0]
 
-        self.doArchivePath(path, 'PFSB')
+        # PFSBvvvvvvsa.fits: visit, spectrograph, arm.
+        visit = cam = None
+        try:
+            fname = os.path.basename(str(path))
+            visit = int(fname[4:10])
+            cam = f'n{int(fname[10])}'
+        except (TypeError, ValueError, IndexError):
+            self.logger.warning(f'could not get visit and camera from PFSB path {path}')
+
+        self.doArchivePath(path, 'PFSB', visit=visit, cam=cam)
 
     def newPfscFileIds(self, keyvar):
         """Archive a PFSC file described by a mcs.mcsFileIds keyvar. """
@@ -305,7 +1205,7 @@ class Gen2Cmd(object):
             self.logger.warning(f'getPath(mcsFile) with {idDict} failed: {e}')
             return
 
-        self.doArchivePath(path, 'PFSC')
+        self.doArchivePath(path, 'PFSC', visit=idDict['visit'])
 
     def newPfsdFileIds(self, keyvar):
         """Archive a PFSD file described by an agcc.agccFileIds keyvar. """
@@ -320,7 +1220,7 @@ class Gen2Cmd(object):
         except Exception as e:
             self.logger.warning(f'getPath(agccFile) with {idDict} failed: {e}')
 
-        self.doArchivePath(path, 'PFSD')
+        self.doArchivePath(path, 'PFSD', visit=idDict['visit'])
 
     def newPfsConfig(self, keyvar):
         """Archive a pfsConfig file described by an iic.pfsConfig keyvar. """
@@ -335,7 +1235,7 @@ class Gen2Cmd(object):
         except Exception as e:
             self.logger.warning(f'getPath(pfsConfig) with {idDict} failed: {e}')
 
-        self.doArchivePath(path, 'PFSF', frameId=frameId)
+        self.doArchivePath(path, 'PFSF', frameId=frameId, visit=idDict['visit'], cam='pfsConfig')
 
     def newPfsDesign(self, keyvar):
         """MHS keyvar callback to pass PfsDesign info over to Gen2 """
@@ -432,12 +1332,44 @@ class Gen2Cmd(object):
         try:
             model[keyname]._removeAllCallbacks()
             if callback is not None:
-                model[keyname].addCallback(callback, callNow=False)
+                model[keyname].addCallback(self._sessionRecording(actor, keyname, callback),
+                                           callNow=False)
             self.logger.info(f'added callback {callback} for {actor}.{keyname}')
         except Exception as e:
             self.logger.warn(f'failed to add callback for {keyname}: {e}')
             return
 
+    def _sessionRecording(self, actorName, keyname, callback):
+        """Wrap a keyvar callback so that its values are recorded while a session is being recorded. """
+
+        def recordingCallback(keyvar):
+            recorder = getattr(self.actor, 'sessionRecorder', None)
+            if recorder is not None:
+                recorder.record('keyvar', actor=actorName, key=keyname,
+                                values=session.plainValues(keyvar.valueList))
+            callback(keyvar)
+
+        recordingCallback.__name__ = getattr(callback, '__name__', 'callback')
+        return recordingCallback
+
+    def recordSession(self, cmd):
+        """Start (or, with stop, end) recording Gen2 status, frames and keyvars for offline replay. """
+
+        oldRecorder = getattr(self.actor, 'sessionRecorder', None)
+        self.actor.sessionRecorder = None
+        if oldRecorder is not None:
+            oldRecorder.close()
+            cmd.inform(f'text="closed session {oldRecorder.path} with {oldRecorder.nEvents} events"')
+
+        if 'stop' in cmd.cmd.keywords:
+            cmd.finish('sessionRecording=""')
+            return
+
+        now = datetime.datetime.now(tz=ZoneInfo("HST"))
+        path = os.path.join(self._stateDir(), 'sessions', f'session-{now:%Y%m%dT%H%M%S}.jsonl')
+        self.actor.sessionRecorder = session.SessionRecorder(path, logger=logging.getLogger('session'))
+        cmd.finish(f'sessionRecording={qstr(path)}')
+
     def setupCallbacks(self, cmd=None):
         if cmd is None:
             cmd = self.actor.bcast
@@ -569,18 +1501,27 @@ class Gen2Cmd(object):
         self._updateCallback('agcc', 'pfsdPathIds',
                              self.newPfsdFileIds if 'PFSD' in doArchive else None)
 
+        expectedCams = []
         for sm in 1,2,3,4:
             for arm in 'b','r':
                 camName=f'{arm}{sm}'
                 actorName = f'hx_{camName}' if arm == 'n' else f'ccd_{camName}'
                 self._updateCallback(actorName, 'spsFileIds',
                                      self.newPfsaFileIds if camName in doArchive else None)
+                if camName in doArchive:
+                    expectedCams.append(camName)
             for arm in 'n',:
                 camName=f'{arm}{sm}'
                 actorName = f'hx_{camName}'
                 self.logger.info(f'wiring in {actorName}.filename if {camName in doArchive}')
                 self._updateCallback(actorName, 'filename',
                                      self.newPfsbFileIds if camName in doArchive else None)
+                if camName in doArchive:
+                    expectedCams.append(camName)
+
+        # A visit's files are sent as soon as all the SPS cameras have reported.
+        if self.archiveAggregator is not None:
+            self.archiveAggregator.setExpected(expectedCams)
 
         if cmd is not None:
             cmd.finish(f'text="archiving {doArchive}')
@@ -596,7 +1537,10 @@ class Gen2Cmd(object):
         pathname = cmd.cmd.keywords['pathname'].values[0]
 
         fname = os.path.basename(pathname)
-        if fname.startswith('pfsConfig'):
+        info = archivescan.archiveNameInfo(fname)
+        if info is not None:
+            filetype, frameId, visit, cam = info
+        elif fname.startswith('pfsConfig'):
             stem = os.path.splitext(fname)[0]
             visit = int(stem.split('-')[-1])
             frameId = f'PFSF{visit:06d}00'
@@ -605,9 +1549,160 @@ class Gen2Cmd(object):
             frameId = None
             filetype = fname[:4]
 
-        self.doArchivePath(str(pathname), filetype, frameId=frameId)
+        force = 'force' in cmd.cmd.keywords
+        entry = self.archiveLedger.lookup(pathname)
+        if entry is not None and entry.outcome == 'archived' and not force:
+            cmd.warn(f'text="{pathname} was already archived; use force to archive it again"')
+
+        self.doArchivePath(str(pathname), filetype, frameId=frameId, force=force)
         cmd.finish(f'text="registered {pathname} for archiving"')
 
+    def catchUp(self, cmd):
+        """Find and archive PFS files which were never archived, e.g. while we were down.
+
+        The day directories from startDay to endDay under the dataRoot
+        configuration variable are scanned for files named as the archive
+        command expects, and any which the gen2.archive configuration
+        variable selects and the ledger does not record as archived are
+        archived, one Gen2 request per visit.
+
+        The ledger does not know about files archived before it was
+        started, so check the days with dryRun first.
+        """
+
+        cmdKeys = cmd.cmd.keywords
+        firstDay = str(cmdKeys['startDay'].values[0])
+        lastDay = str(cmdKeys['endDay'].values[0])
+        dryRun = 'dryRun' in cmdKeys
+
+        t = threading.Thread(target=self._catchUp,
+                             args=(self._reactorCmd(cmd), firstDay, lastDay, dryRun),
+                             name='catchUp', daemon=True)
+        t.start()
+
+    def _catchUp(self, cmd, firstDay, lastDay, dryRun, reportInterval=5.0):
+        gen2Config = self.actor.actorConfig['gen2']
+        root = os.path.expandvars(gen2Config.get('dataRoot', '/data/raw'))
+        nThreads = int(gen2Config.get('catchUpThreads', 8))
+        minAge = float(gen2Config.get('catchUpMinAge', 60.0))
+        # The same selection as the callbacks set up by updateArchiving.
+        doArchive = gen2Config['archive']
+
+        try:
+            days = archivescan.dayDirs(root, firstDay, lastDay)
+        except OSError as e:
+            cmd.fail(f'text="cannot list {root}: {e}"')
+            return
+        cmd.inform(f'text="scanning {len(days)} day directories from {firstDay} to {lastDay} under {root}"')
+
+        # Anything recently modified may still be being written, and will be announced to us.
+        now = time.time()
+        errors = []
+        missing = collections.defaultdict(list)
+        nScanned = nMissing = nArchived = nFailed = 0
+        lastReport = time.monotonic()
+        for path, size, mtime in archivescan.scanTrees(days, nThreads=nThreads, errors=errors):
+            nScanned += 1
+            if now - mtime < minAge:
+                continue
+            entry = self.archiveLedger.lookup(path)
+            if entry is not None and entry.outcome == 'archived' and entry.size == size:
+                continue
+            filetype, frameId, visit, cam = archivescan.archiveNameInfo(os.path.basename(path))
+            if cam not in doArchive:
+                continue
+            missing[visit].append((path, filetype, frameId))
+            nMissing += 1
+            if time.monotonic() - lastReport > reportInterval:
+                cmd.inform(f'catchUp=scanning,{nScanned},{nMissing},{nArchived},{nFailed}')
+                lastReport = time.monotonic()
+
+        for err in errors[:10]:
+            cmd.warn(f'text={qstr(f"catchUp could not read {err}")}')
+        if len(errors) > 10:
+            cmd.warn(f'text="catchUp could not read {len(errors) - 10} more paths"')
+        cmd.inform(f'catchUp=scanned,{nScanned},{nMissing},{nArchived},{nFailed}')
+
+        for visit in sorted(missing):
+            if dryRun:
+                cmd.inform(f'catchUpVisit={visit},{len(missing[visit])}')
+                continue
+            archived, failed = self._archiveBulk(visit, missing[visit])
+            nArchived += archived
+            nFailed += failed
+            if time.monotonic() - lastReport > reportInterval:
+                cmd.inform(f'catchUp=archiving,{nScanned},{nMissing},{nArchived},{nFailed}')
+                lastReport = time.monotonic()
+
+        cmd.finish(f'catchUp=done,{nScanned},{nMissing},{nArchived},{nFailed}')
+
+    def _archiveBulk(self, visit, entries, chunkSize=100):
+        """Checksum and archive many files of one visit, in as few Gen2 requests as possible.
+
+        Returns
+        -------
+        nArchived, nFailed : `int`
+        """
+
+        claimed = []
+        for path, filetype, frameId in entries:
+            try:
+                size = os.path.getsize(path)
+            except OSError as e:
+                self.logger.warning(f'NOT archiving {filetype} file {path}: {e}')
+                continue
+            ledgerFrameId = frameId if frameId is not None else os.path.splitext(os.path.basename(path))[0]
+            if self.archiveLedger.claim(path, size, frameId=ledgerFrameId):
+                claimed.append((path, frameId))
+
+        if self.checksumPool is not None:
+            futures = [(path, frameId, self.checksumPool.submit(path)) for path, frameId in claimed]
+            for path, frameId, future in futures:
+                try:
+                    _, size, digest, _, _ = future.result()
+                    self._recordChecksum(path, size, digest, frameId=frameId, visit=visit)
+                except Exception as e:
+                    self.logger.warning(f'failed to checksum {path}: {e}')
+
+        nArchived = nFailed = 0
+        for i in range(0, len(claimed), chunkSize):
+            chunk = claimed[i:i + chunkSize]
+            try:
+                self.actor.gen2.archivePfsFiles(chunk)
+            except Exception as e:
+                self.logger.warning(f'failed to archive {len(chunk)} files for visit {visit}: {e}')
+                for path, frameId in chunk:
+                    self.archiveLedger.append(path, 'failed', visit=visit, error=str(e))
+                nFailed += len(chunk)
+                continue
+            for path, frameId in chunk:
+                self.archiveLedger.append(path, 'archived', visit=visit)
+            nArchived += len(chunk)
+
+        return nArchived, nFailed
+
+    def archiveStatus(self, cmd):
+        """Report what the archive ledger knows, about one file or overall. """
+
+        cmdKeys = cmd.cmd.keywords
+        ledger = self.archiveLedger
+        if 'pathname' in cmdKeys:
+            pathname = str(cmdKeys['pathname'].values[0])
+            e = ledger.lookup(pathname)
+            if e is None:
+                cmd.fail(f'text="{pathname} is not in the archive ledger"')
+                return
+            cmd.inform(f'archiveEntry={qstr(e.path)},{e.size},{e.time:0.3f},{qstr(e.frameId)},'
+                       f'{e.outcome},{qstr(e.checksum if e.checksum is not None else "")}')
+
+        if self.archiveAggregator is not None:
+            for visit, nFiles, waited in self.archiveAggregator.pending():
+                cmd.inform(f'archiveBatch={visit},{nFiles},{waited:0.1f}')
+
+        counts = ledger.counts()
+        cmd.finish(f'archiveLedger={len(ledger.index)},{counts["archived"]},'
+                   f'{counts["queued"]},{counts["failed"]}')
+
     def getNextSequenceId(self, cmd, visit):
         """Return the next sequence_id for a visit in the tel_status table.
 
@@ -617,7 +1712,8 @@ class Gen2Cmd(object):
         if visit not in self.statusSequences:
             try:
                 sql = "SELECT COALESCE(MAX(status_sequence_id)+1, 0) FROM tel_status WHERE pfs_visit_id=:visit_id"
-                nextSeq = self.opdb.query_scalar(sql, params={'visit_id': visit})
+                nextSeq = self.opdb.queryScalar(sql, params={'visit_id': visit},
+                                                name='nextSequenceId')
 
                 self.statusSequences[visit] = nextSeq
             except Exception as e:
@@ -636,72 +1732,73 @@ class Gen2Cmd(object):
         cmd.debug(f'text="updating opdb.tel_status with visit={visit}, '
                   f'sequence={statusSequence}, caller={caller}"')
 
-        def gk(name, cmd=cmd, statusDict=statusDict):
-            return self._getGen2Key(cmd, name, statusDict=statusDict)
-
-        try:
-            self.opdb.insert_kw('tel_status',
-                                pfs_visit_id=visit, status_sequence_id=statusSequence,
-                                altitude=gk('ALTITUDE'), azimuth=gk('AZIMUTH'),
-                                insrot=gk('INR-STR'), inst_pa=gk('INST-PA'),
-                                adc_pa=gk('ADC-STR'),
-                                m2_pos3=gk('M2-POS3'),
-                                m2_off3=gk('W_M2OFF3'),
-                                tel_ra=float(pointing.ra.degree), tel_dec= float(pointing.dec.degree),
-                                dome_shutter_status=-9998, dome_light_status=-9998,
-                                dither_ra=gk('W_DTHRA'), dither_dec=gk('W_DTHDEC'), dither_pa=gk('W_DTHPA'),
-                                caller=caller,
-                                created_at=now.isoformat())
+        gk = statusDict.get
+
+        try:
+            self.opdb.insert('tel_status',
+                             pfs_visit_id=visit, status_sequence_id=statusSequence,
+                             altitude=gk('ALTITUDE'), azimuth=gk('AZIMUTH'),
+                             insrot=gk('INR-STR'), inst_pa=gk('INST-PA'),
+                             adc_pa=gk('ADC-STR'),
+                             m2_pos3=gk('M2-POS3'),
+                             m2_off3=gk('W_M2OFF3'),
+                             tel_ra=float(pointing.ra.degree), tel_dec= float(pointing.dec.degree),
+                             dome_shutter_status=-9998, dome_light_status=-9998,
+                             dither_ra=gk('W_DTHRA'), dither_dec=gk('W_DTHDEC'), dither_pa=gk('W_DTHPA'),
+                             caller=caller,
+                             created_at=now.isoformat())
         except Exception as e:
             cmd.warn('text="failed to insert into tel_status: %s"' % (e))
 
         cmd.debug('text="updating opdb.env_condition"')
         try:
-            self.opdb.insert_kw('env_condition',
-                                pfs_visit_id=visit, status_sequence_id=statusSequence,
-                                dome_temperature=gk('DOM-TMP'), dome_pressure=gk('DOM-PRS'),
-                                dome_humidity=gk('DOM-HUM'),
-                                outside_temperature=gk('OUT-TMP'), outside_pressure=gk('OUT-PRS'),
-                                outside_humidity=gk('OUT-HUM'),
-                                created_at=now.isoformat())
+            self.opdb.insert('env_condition',
+                             pfs_visit_id=visit, status_sequence_id=statusSequence,
+                             dome_temperature=gk('DOM-TMP'), dome_pressure=gk('DOM-PRS'),
+                             dome_humidity=gk('DOM-HUM'),
+                             outside_temperature=gk('OUT-TMP'), outside_pressure=gk('OUT-PRS'),
+                             outside_humidity=gk('OUT-HUM'),
+                             created_at=now.isoformat())
         except Exception as e:
             cmd.warn('text="failed to insert into env_condition: %s"' % (e))
 
         return statusSequence
 
     def _latchStatusDict(self, cmd):
-        """Return an up-to-date copy of the current Gen2 statusDict."""
+        """Return a freshly latched, typed snapshot of the Gen2 status.
 
-        self.actor.gen2.update_header_stat()
+        Any values which could not be fetched or converted are reported once, here.
+        """
+
+        snap = self.actor.gen2.update_header_stat()
+        if snap.errors:
+            errors = "; ".join(snap.errors)
+            cmd.warn(f'text={qstr(f"FAILED to retrieve or convert {len(snap.errors)} Gen2 values: {errors}")}')
 
-        return self.actor.gen2.statusDictTel.copy()
+        return snap
 
     def _getGen2Key(self, cmd, name, statusDict=None):
         """ Utility to wrap fetching Gen2 keyword values.
 
-        Bugs
-        ----
+        Parameters
+        ----------
+        cmd : `Command`
+            The Command to report to, if we need to latch the status.
+        name : `str`
+            The FITS card name, per header_telescope.txt.
+        statusDict : `StatusSnapshot`
+            The snapshot to read from. If None, latch a new one.
 
-        This is disgustingly intimate with the current PFS.py internals. Those will change.
+        Returns
+        -------
+        The typed value, the raw value if it could not be converted,
+        or None if it was not available.
         """
 
         if statusDict is None:
-            statusDict = self._latchStatusDict()
-
-        try:
-            hdr1 = self.actor.gen2.tel_header[name]
-            val = statusDict[hdr1[0]]
-            valType = hdr1[2]
-        except:
-            cmd.warn(f'text="FAILED to retrieve {name}"')
-            return None
-
-        try:
-            val = valType(val)
-        except:
-            cmd.warn(f'text="FAILED to convert {name}:{val} as a {valType}"')
+            statusDict = self._latchStatusDict(cmd)
 
-        return val
+        return statusDict.get(name)
 
     def _getScreenState(self, cmd, frontPos, rearPos):
         """Clean up and pin down FF screen positions.
@@ -786,10 +1883,9 @@ class Gen2Cmd(object):
         """
         cmd.debug('text="starting updateDomeStatus"')
         if statusDict is None:
-            statusDict = self._latchStatusDict(cmd)
+            statusDict = self.actor.gen2.fetch_status(statusgroups.domeCards)
 
-        def gk(name, cmd=cmd, statusDict=statusDict):
-            return self._getGen2Key(cmd, name, statusDict=statusDict)
+        gk = statusDict.get
 
         screenFront, screenRear, screenPos = self._getScreenState(cmd, gk("W_TFFSFP"), gk("W_TFFSRP"))
         domeShutter = self._getShutterPos(cmd, gk("W_TSHUTR"))
@@ -819,6 +1915,29 @@ class Gen2Cmd(object):
                        f'topScreenPos={screenFront:0.1f},{screenRear:0.1f},{screenPos}')
             cmd.inform(f'domeVents={domeVentsAll},{domeVentsObs}')
 
+        self._updateRingLamps(cmd, statusDict, onlyOnChanges=onlyOnChanges)
+
+    def _updateRingLamps(self, cmd, statusDict, onlyOnChanges=True):
+        """Generate ring lamp keys.
+
+        The measured voltages are noisy, so only changes in the lamp
+        states or commanded voltages count as changes.
+        """
+        gk = statusDict.get
+
+        lampStatus = tuple(gk(f'W_TFF{i}ST') for i in range(1, 5))
+        lampCmd = tuple(gk(f'W_TFF{i}VC') for i in range(1, 5))
+        lampVolts = tuple(gk(f'W_TFF{i}VV') for i in range(1, 5))
+
+        state = (lampStatus, lampCmd)
+        changed = getattr(self, 'ringLampState', None) != state
+        self.ringLampState = state
+
+        if not onlyOnChanges or changed:
+            cmd.inform(f'ringLampsStatus={",".join(str(v) for v in lampStatus)}')
+            cmd.inform(f'ringLampsCmd={",".join(f"{v:0.1f}" for v in lampCmd)}')
+            cmd.inform(f'ringLamps={",".join(f"{v:0.1f}" for v in lampVolts)}')
+
     def updateDomeState(self, cmd):
         """Generate dome status keys"""
         self._updateDomeState(cmd=cmd, onlyOnChanges=False)
@@ -829,11 +1948,13 @@ class Gen2Cmd(object):
         cmd.finish('text="poked dome status keys"')
 
     def _genActorKeys(self, cmd,
-                      caller=None, visit=None):
+                      caller=None, visit=None, statusDict=None):
         """Generate all gen2 status keys.
 
         For this actor, this might get called from either the gen2 or the MHS sides.
 
+        If statusDict is passed, it is used instead of latching a new snapshot.
+
         Bugs
         ---
 
@@ -844,13 +1965,13 @@ class Gen2Cmd(object):
         """
         tz = datetime.timezone(datetime.timedelta(hours=-10), "HST")
         now = datetime.datetime.now(tz=tz)
-        statusDict = self._latchStatusDict(cmd)
+        if statusDict is None:
+            statusDict = self._latchStatusDict(cmd)
 
         if visit is None:
             visit = self.visit
 
-        def gk(name, cmd=cmd, statusDict=statusDict):
-            return self._getGen2Key(cmd, name, statusDict=statusDict)
+        gk = statusDict.get
 
         sky = astropy.coordinates.SkyCoord(f'{gk("RA")} {gk("DEC")}',
                                            unit=(u.hourangle, u.deg),
@@ -900,11 +2021,5 @@ class Gen2Cmd(object):
 
         self._updateDomeState(cmd, statusDict=statusDict, onlyOnChanges=False)
 
-        cmd.inform(f'ringLampsStatus={gk("W_TFF1ST")},{gk("W_TFF2ST")},{gk("W_TFF3ST")},{gk("W_TFF4ST")}')
-        cmd.inform(f'ringLampsCmd={gk("W_TFF1VC"):0.1f},{gk("W_TFF2VC"):0.1f},'
-                   f'{gk("W_TFF3VC"):0.1f},{gk("W_TFF4VC"):0.1f}')
-        cmd.inform(f'ringLamps={gk("W_TFF1VV"):0.1f},{gk("W_TFF2VV"):0.1f},'
-                   f'{gk("W_TFF3VV"):0.1f},{gk("W_TFF4VV"):0.1f}')
-
         if caller is not None:
             cmd.inform(f'statusUpdate={visit},{statusSequence},{caller}')
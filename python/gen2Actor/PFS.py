@@ -28,6 +28,13 @@ from g2base import Bunch, Task
 from g2cam.Instrument import BASECAM, CamCommandError
 from g2cam.util import common_task
 
+from gen2Actor import lanes
+from gen2Actor import logpipe
+from gen2Actor import ocsguard
+from gen2Actor import progress
+from gen2Actor import snapshot
+from gen2Actor import statussource
+
 # Value to return for executing unimplemented command.
 # 0: OK, non-zero: error
 unimplemented_res = 0
@@ -181,6 +188,24 @@ class PFS(BASECAM):
         # Thread pool for autonomous tasks
         self.threadPool = self.ocs.threadPool
 
+        # Deadlines, hedging and circuit breakers for our calls to Gen2.
+        self.ocsGuard = ocsguard.OcsGuard(self.ocs, logger=self.logger)
+
+        # Picks the fastest working status interface for us.
+        self.statusSource = statussource.StatusSource(self.ocsGuard.call, logger=self.logger)
+
+        # Batches the progress we report on subtags.
+        actor = getattr(self, 'actor', None)
+        config = actor.actorConfig['gen2'] if actor is not None else dict()
+        self.progress = progress.ProgressReporter(self.ocs.setvals,
+                                                  flushInterval=float(config.get('progressFlushInterval', 1.0)),
+                                                  logger=self.logger)
+
+        # Bounds on the g2cam workers which normal and bulk commands may hold.
+        limits, commandLanes, maxWait = lanes.parseConfig(config)
+        self.lanes = lanes.LaneDispatcher(limits=limits, commandLanes=commandLanes,
+                                          maxWait=maxWait, logger=self.logger)
+
         # For task inheritance:
         self.tag = 'pfs'
         self.shares = ['logger', 'ev_quit', 'threadPool']
@@ -221,6 +246,8 @@ class PFS(BASECAM):
         rootDir = os.environ['ICS_GEN2ACTOR_DIR']
         self.tel_header = self.read_header_list(os.path.join(rootDir, "header_telescope.txt"))
         self.statusDictTel = self.init_stat_dict(self.tel_header)
+        self.statusSnapshot = snapshot.StatusSnapshot.fromStatusDict(self.tel_header,
+                                                                     self.statusDictTel)
 
     def start(self, wait=True):
         super(PFS, self).start(wait=wait)
@@ -235,6 +262,11 @@ class PFS(BASECAM):
 
         self._reload()
 
+        # Queue and rate-limit our own log lines, as the actor does its.
+        actor = getattr(self, 'actor', None)
+        if actor is not None and getattr(actor, 'gen2LogPipeline', None) is None:
+            actor.gen2LogPipeline = logpipe.fromConfig(self.logger, actor.actorConfig['gen2'])
+
         # Start task to monitor summit power.  Call self.power_off
         # when we've been running on UPS power for 60 seconds
         t = common_task.PowerMonTask(self, self.power_off, upstime=60.0)
@@ -256,6 +288,8 @@ class PFS(BASECAM):
 
         self.power_task = None
 
+        self.progress.flushAll()
+
         self.logger.info("PFS STOPPED.")
 
 
@@ -274,18 +308,20 @@ class PFS(BASECAM):
                 break
             ret.append(l.strip())
 
-            self.ocs.setvals(subtag, cmd_str=l)
+            self.progress.update(subtag, cmd_str=l)
 
             if callback is not None:
                 callback(subtag, l)
 
             if re.search(r'^\S+ \S+ [fF] .*', l):
+                self.progress.flush(subtag)
                 raise CamCommandError(l)
 
             self.logger.debug('exec ret: %s', l)
 
         err = proc.stderr.read()
         self.logger.warn('exec stderr: %s', err)
+        self.progress.flush(subtag)
 
         self.logger.info('done with: %s', cmdStr)
         return ret
@@ -314,13 +350,72 @@ class PFS(BASECAM):
             self.logger.error(result)
             raise CamCommandError(result)
 
-        return method(*args, **params)
+        try:
+            return self.lanes.run(cmdName, method, *args, **params)
+        except lanes.LaneBusy as e:
+            raise CamCommandError(str(e))
 
     def update_header_stat(self):
-        """ Update the external data feeding our headers. """
+        """ Update the external data feeding our headers.
+
+        Returns
+        -------
+        snapshot : `StatusSnapshot`
+            The freshly latched and converted status.
+        """
 
         self.logger.info('updating telescope info')
-        self.ocs.requestOCSstatus(self.statusDictTel)
+        self.statusDictTel.update(self.statusSource.fetch(self.statusDictTel.keys()))
+        self.logger.info('updated telescope info via %s', self.statusSource.lastUsed)
+
+        session = getattr(getattr(self, 'actor', None), 'sessionRecorder', None)
+        if session is not None:
+            session.record('status', values=dict(self.statusDictTel))
+
+        snap = snapshot.StatusSnapshot.fromStatusDict(self.tel_header, self.statusDictTel)
+        if snap.errors:
+            self.logger.warn('%d bad status values: %s', len(snap.errors), '; '.join(snap.errors))
+        self.statusSnapshot = snap
+
+        recorder = getattr(getattr(self, 'actor', None), 'statusRecorder', None)
+        if recorder is not None:
+            try:
+                recorder.record(snap, self.tel_header)
+            except Exception as e:
+                self.logger.warn('failed to record status snapshot: %s', e)
+
+        shmWriter = getattr(getattr(self, 'actor', None), 'shmStatus', None)
+        if shmWriter is not None:
+            try:
+                shmWriter.publish(snap, self.tel_header)
+            except Exception as e:
+                self.logger.warn('failed to publish status snapshot to shared memory: %s', e)
+
+        return snap
+
+    def fetch_status(self, names):
+        """ Latch only some of our status, through the fastest status interface.
+
+        Args
+        ----
+        names : list of str
+           FITS card names, per header_telescope.txt
+
+        Returns
+        -------
+        snapshot : `StatusSnapshot`
+           The typed values of just those cards.
+        """
+
+        aliases = []
+        for name in names:
+            alias = self.tel_header[name][0]
+            if alias != 'NA' and alias not in aliases:
+                aliases.append(alias)
+
+        return snapshot.StatusSnapshot.fromStatusDict(self.tel_header,
+                                                      self.statusSource.fetch(aliases),
+                                                      names=names)
 
     def return_new_header(self, frameid, mode, itime, fullHeader=True, doUpdate=True):
         """ Update the external data feeding our headers and generate one. """
@@ -336,6 +431,7 @@ class PFS(BASECAM):
         except Exception as e:
             self.logger.warn('failed to fetch header: %s', e)
             hdr = pyfits.Header()
+        self.logger.info('fetched header for %s', frameid)
 
         return base64.b64encode(hdr.tostring().encode('latin-1')).decode('latin-1')
 
@@ -407,20 +503,14 @@ class PFS(BASECAM):
             return hdr
 
         # Telescope header
+        snap = self.statusSnapshot
         for name, hdr1 in self.tel_header.items():
-            name = hdr1[1]
             comment = hdr1[4]
-            if hdr1[0] == 'NA':
-                hdr.set(name, hdr1[3], comment)
-            else:
-                val = self.statusDictTel[hdr1[0]]
-                valType = hdr1[2]
-                try:
-                    val = valType(val)
-                except:
-                    hdr.add_comment(f'FAILED to convert {name}:{val} as a {valType}')
+            val = snap[name]
+            if not snap.isValid(name):
+                hdr.add_comment(f'FAILED to convert {name}:{val} as a {hdr1[2]}')
 
-                hdr.set(name, val, comment)
+            hdr.set(name, val, comment)
 
         return hdr
 
@@ -459,19 +549,19 @@ class PFS(BASECAM):
         # * Having the value of str:
         #     cmd_str, task_error
 
-        self.ocs.setvals(subtag, task_start=time.time(),
-                         cmd_str='Sleep %f ...' % itime)
+        self.progress.update(subtag, task_start=time.time(),
+                             cmd_str='Sleep %f ...' % itime)
 
         self.logger.info("\nSleeping for %f sec..." % itime)
         while int(itime) > 0:
-            self.ocs.setvals(subtag, cmd_str='Sleep %f ...' % itime)
+            self.progress.update(subtag, cmd_str='Sleep %f ...' % itime)
             sleep_time = min(1.0, itime)
             time.sleep(sleep_time)
             itime -= 1.0
 
-        self.ocs.setvals(subtag, cmd_str='Awake!')
+        self.progress.update(subtag, cmd_str='Awake!')
         self.logger.info("Woke up refreshed!")
-        self.ocs.setvals(subtag, task_end=time.time())
+        self.progress.update(subtag, task_end=time.time())
 
     def _reload(self, subtag=None, module=None):
         self.logger.info("Reloading %s", module)
@@ -481,11 +571,11 @@ class PFS(BASECAM):
 
         for n in PFSCommands.__all__:
             if subtag is not None:
-                self.ocs.setvals(subtag, cmd_str=f'Trying to reload {n}\n')
+                self.progress.update(subtag, cmd_str=f'Trying to reload {n}\n')
             self.logger.info("Reloading %s.%s", module, n)
             setattr(self, n, getattr(PFSCommands, n).__get__(self))
             if subtag is not None:
-                self.ocs.setvals(subtag, cmd_str=f'reloaded {n}\n')
+                self.progress.update(subtag, cmd_str=f'reloaded {n}\n')
             self.logger.info("Reloaded %s.%s", module, n)
 
         self.logger.info("Reloaded all of %s", module)
@@ -494,10 +584,10 @@ class PFS(BASECAM):
         """ Reload some or all Gen2 commands. """
 
         subtag = self._subtag(tag)
-        self.ocs.setvals(subtag, task_start=time.time(),
-                         cmd_str=f'Reloading {module} ...')
+        self.progress.update(subtag, task_start=time.time(),
+                             cmd_str=f'Reloading {module} ...')
         self._reload(subtag=subtag, module=module)
-        self.ocs.setvals(subtag, task_end=time.time())
+        self.progress.update(subtag, task_end=time.time())
 
     def fits_file(self, motor='OFF', frame_no=None, target=None, template=None, delay=0,
                   tag=None):
@@ -535,7 +625,7 @@ class PFS(BASECAM):
             'FITS.PFS.OBJECT': 'None',
         }
         try:
-            res = self.ocs.requestOCSstatus(statusDict)
+            res = self.ocsGuard.call('requestOCSstatus', statusDict)
             self.logger.debug("Status returned: %s" % (str(res)))
 
         except PFSError as e:
@@ -601,7 +691,7 @@ class PFS(BASECAM):
         # If no delay specified, then just try to archive the file
         # before terminating the command.
         self.logger.info("Submitting framelist '%s'" % str(framelist))
-        self.ocs.archive_framelist(framelist)
+        self.ocsGuard.call('archive_framelist', framelist)
 
     def putstatus(self, target="ALL"):
         """Forced export of our status.
@@ -646,16 +736,23 @@ class PFS(BASECAM):
         self.ocs.view_file_as_buffer(path, num_hdu=num_hdu)
 
 
-    def reqframes(self, num=1, type="A"):
+    def reqframes(self, num=1, type="A", deadline=None):
         """Forced frame request.
+
+        Raises ocsguard.OcsTimeout if Gen2 does not answer within the
+        deadline, or ocsguard.OcsUnavailable if Gen2 has been timing out.
         """
 
         self.logger.info('reqframes num=%r type=%r', num, type)
-        framelist = self.ocs.getFrames(num, type)
+        framelist = self.ocsGuard.call('getFrames', num, type, deadline=deadline)
 
         # This request is not logged over DAQ logs
         self.logger.info("framelist: %s" % str(framelist))
 
+        session = getattr(getattr(self, 'actor', None), 'sessionRecorder', None)
+        if session is not None:
+            session.record('frames', num=num, type=type, frames=list(framelist))
+
         return framelist
 
     def kablooie(self, motor='OFF'):
@@ -0,0 +1,207 @@
+"""Coalescing and suppression of the alerts we forward to Gen2 as events.
+
+MHS actors raise and clear Gen2 alerts through our sendAlert/clearAlert
+commands. A flapping condition can generate a stream of identical
+requests, so we keep a local table of the active alerts and only send
+an event to Gen2 when an alert actually changes, or when an unchanged
+alert has not been successfully re-sent for a while. Events arriving in
+a burst are held briefly and coalesced, so that only the latest state of
+each alert is sent. Failed sends are remembered, for listAlerts, and do
+not hold back the next identical request.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from gen2Actor import cachedict
+
+
+class Alert(object):
+    """One active alert, as last raised. """
+
+    __slots__ = ('alertId', 'name', 'severity', 'description', 'detail',
+                 'firstRaised', 'lastChanged', 'lastSent', 'lastSeen', 'count')
+
+    def __init__(self, alertId, name, severity, description, detail, now):
+        self.alertId = alertId
+        self.name = name
+        self.severity = severity
+        self.description = description
+        self.detail = detail
+        self.firstRaised = now
+        self.lastChanged = now
+        self.lastSent = None
+        self.lastSeen = now
+        self.count = 1
+
+    def state(self):
+        return self.name, self.severity, self.description, self.detail
+
+    def event(self, timestamp):
+        """Return the Gen2 send_event dictionary for this alert. """
+
+        ev = dict(alarm_id=self.alertId,
+                  severity=self.severity,
+                  name=self.name,
+                  timestamp=timestamp)
+        if self.description:
+            ev['description'] = self.description
+        if self.detail:
+            ev['detail_text'] = self.detail
+        return ev
+
+
+class AlertManager(object):
+    """Track active alerts and rate-limit the events sent for them.
+
+    Parameters
+    ----------
+    sendEvent : callable
+        Called with each Gen2 event dictionary to send.
+    window : `float`
+        An unchanged alert is not re-sent more often than this, in seconds.
+    batchDelay : `float`
+        How long to gather events before sending them, in seconds.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, sendEvent, window=60.0, batchDelay=0.5, logger=None):
+        self.sendEvent = sendEvent
+        self.window = window
+        self.batchDelay = batchDelay
+        self.logger = logger if logger is not None else logging.getLogger('alerts')
+
+        self.active = dict()
+        self.recentlyCleared = dict()
+        self.pending = collections.OrderedDict()
+        self.flushTimer = None
+        self.lock = threading.Lock()
+        # alertId -> (time, error) of the last failed send, until one succeeds.
+        self.sendErrors = cachedict.cacheDict(size=100)
+
+        self.nSent = 0
+        self.nSuppressed = 0
+        self.nCoalesced = 0
+        self.nFailed = 0
+
+    def _queue(self, alertId, event):
+        """Queue one event, replacing any still-pending event for the same alert. Needs the lock. """
+
+        if alertId in self.pending:
+            self.nCoalesced += 1
+            del self.pending[alertId]
+        self.pending[alertId] = event
+
+        if self.flushTimer is None:
+            self.flushTimer = threading.Timer(self.batchDelay, self.flush)
+            self.flushTimer.daemon = True
+            self.flushTimer.start()
+
+    def raiseAlert(self, alertId, name, severity, description='', detail='', now=None):
+        """Create or update an alert.
+
+        Returns
+        -------
+        alert : `Alert`
+            The active alert.
+        queued : `bool`
+            Whether an event will be sent to Gen2 for this call.
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            self.recentlyCleared.pop(alertId, None)
+            alert = self.active.get(alertId)
+            newState = (name, severity, description, detail)
+            if alert is None:
+                alert = self.active[alertId] = Alert(alertId, name, severity,
+                                                     description, detail, now)
+            else:
+                alert.count += 1
+                alert.lastSeen = now
+                if alert.state() == newState:
+                    if alert.lastSent is not None and now - alert.lastSent < self.window:
+                        self.nSuppressed += 1
+                        return alert, False
+                else:
+                    alert.name, alert.severity, alert.description, alert.detail = newState
+                    alert.lastChanged = now
+
+            self._queue(alertId, alert.event(now))
+
+        return alert, True
+
+    def clearAlert(self, alertId, now=None):
+        """Clear an alert. Returns whether an event will be sent to Gen2.
+
+        We always forward the first clear of an alert we do not know
+        about, since Gen2 may still have it from before we restarted.
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            alert = self.active.pop(alertId, None)
+            if alert is None:
+                lastCleared = self.recentlyCleared.get(alertId)
+                if lastCleared is not None and now - lastCleared < self.window:
+                    self.nSuppressed += 1
+                    return False
+
+            self.recentlyCleared[alertId] = now
+            for oldId, t in list(self.recentlyCleared.items()):
+                if now - t > self.window:
+                    del self.recentlyCleared[oldId]
+
+            self._queue(alertId, dict(alarm_id=alertId,
+                                      name='',
+                                      timestamp=now,
+                                      severity='ok'))
+        return True
+
+    def flush(self):
+        """Send all pending events now. """
+
+        with self.lock:
+            events = list(self.pending.items())
+            self.pending.clear()
+            if self.flushTimer is not None:
+                self.flushTimer.cancel()
+                self.flushTimer = None
+
+        for alertId, ev in events:
+            isClear = ev['severity'] == 'ok'
+            try:
+                self.sendEvent(ev)
+            except Exception as e:
+                self.logger.warning(f'failed to send Gen2 event {ev}: {e}')
+                with self.lock:
+                    self.nFailed += 1
+                    self.sendErrors[alertId] = (time.time(), str(e))
+                    if isClear and self.recentlyCleared.get(alertId) == ev['timestamp']:
+                        # Let the next clear through.
+                        del self.recentlyCleared[alertId]
+                continue
+
+            with self.lock:
+                self.nSent += 1
+                self.sendErrors.pop(alertId, None)
+                alert = self.active.get(alertId)
+                if not isClear and alert is not None:
+                    alert.lastSent = ev['timestamp']
+
+    def failedSends(self):
+        """Return (alertId, time, error) for each alert whose last send failed. """
+
+        with self.lock:
+            return [(alertId, t, err) for alertId, (t, err) in self.sendErrors.items()]
+
+    def activeAlerts(self):
+        """Return the active alerts, ordered by id. """
+
+        with self.lock:
+            return [self.active[k] for k in sorted(self.active)]
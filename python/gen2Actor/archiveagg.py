@@ -0,0 +1,175 @@
+"""Gathering the files of one visit into a single Gen2 archive request.
+
+Each SPS visit produces up to one PFSA file per CCD and one PFSB file
+per H4RG, and a pfsConfig file. Rather than send each to STARS as its
+own archive_framelist call, we hold each visit's files until all the
+cameras we expect have reported, or until the visit's first file has
+waited `timeout` seconds, and send them together. Files which arrive for
+a visit after its batch has gone start a new batch.
+
+The MCS and AGCC files can never complete a batch, so they are not
+gathered: they would only ever be held for the full timeout.
+
+Files are added from the reactor, and a Gen2 archive call can take a
+long time, so with an executor each batch is archived on one of its
+threads, never by the caller.
+"""
+
+import logging
+import threading
+import time
+
+# The file types which are gathered by visit: SPS files and pfsConfig.
+aggregatedFileTypes = frozenset(('PFSA', 'PFSB', 'PFSF'))
+
+
+class VisitBatch(object):
+    """The files gathered so far for one visit. """
+
+    __slots__ = ('visit', 'entries', 'cams', 'started', 'timer')
+
+    def __init__(self, visit, now):
+        self.visit = visit
+        self.entries = []
+        self.cams = set()
+        self.started = now
+        self.timer = None
+
+
+class ArchiveAggregator(object):
+    """Group files to archive by visit, and submit each visit's files in one call.
+
+    Parameters
+    ----------
+    submit : callable
+        Called as submit(visit, entries), where entries is a list of
+        (path, filetype, frameId) tuples, to archive one batch.
+    onComplete : callable
+        If set, called as onComplete(visit) once a visit's batch has been
+        submitted because all the expected cameras reported, whether or
+        not the archiving succeeded.
+    executor : `concurrent.futures.Executor`
+        If set, where submit is called. Otherwise it is called by whoever
+        completed the batch.
+    expected : iterable of `str`
+        The cameras (e.g. 'b1', 'n3') whose files complete a visit.
+    timeout : `float`
+        The longest we hold a visit's first file, in seconds.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, submit, onComplete=None, executor=None, expected=(), timeout=30.0, logger=None):
+        self.submit = submit
+        self.onComplete = onComplete
+        self.executor = executor
+        self.expected = frozenset(expected)
+        self.timeout = timeout
+        self.logger = logger if logger is not None else logging.getLogger('archiveagg')
+
+        self.batches = dict()
+        self.lock = threading.Lock()
+
+        self.nFiles = 0
+        self.nBatches = 0
+        self.nTimeouts = 0
+
+    def setExpected(self, expected):
+        """Change the set of cameras which complete a visit. """
+
+        with self.lock:
+            self.expected = frozenset(expected)
+
+    def add(self, visit, cam, path, filetype, frameId=None):
+        """Add one file to its visit's batch, and submit the batch if it is now complete.
+
+        Parameters
+        ----------
+        visit : `int`
+            The PFS visit the file belongs to.
+        cam : `str`
+            The camera or source of the file, e.g. 'r1', 'PFSC', 'pfsConfig'.
+        path : `str`
+            The full path of the file.
+        filetype : `str`
+            A friendly identifier for messages, e.g. 'PFSA'.
+        frameId : `str`
+            The Gen2 frameId, if it does not match the filename.
+        """
+
+        visit = int(visit)
+        with self.lock:
+            batch = self.batches.get(visit)
+            if batch is None:
+                batch = self.batches[visit] = VisitBatch(visit, time.monotonic())
+                batch.timer = threading.Timer(self.timeout, self._expire, args=(visit, batch))
+                batch.timer.daemon = True
+                batch.timer.start()
+            batch.entries.append((path, filetype, frameId))
+            batch.cams.add(cam)
+            self.nFiles += 1
+
+            complete = bool(self.expected) and self.expected <= batch.cams
+            if complete:
+                self._pop(visit)
+
+        if complete:
+            self._submit(batch, 'complete')
+            if self.onComplete is not None:
+                try:
+                    self.onComplete(visit)
+                except Exception as e:
+                    self.logger.warning(f'failed to finish visit {visit}: {e}')
+
+    def _pop(self, visit):
+        """Remove and return a visit's batch. Needs the lock. """
+
+        batch = self.batches.pop(visit)
+        batch.timer.cancel()
+        return batch
+
+    def _expire(self, visit, batch):
+        with self.lock:
+            if self.batches.get(visit) is not batch:
+                return
+            self._pop(visit)
+            self.nTimeouts += 1
+
+        missing = sorted(self.expected - batch.cams)
+        self._submit(batch, f'timed out, missing {",".join(missing) if missing else "nothing"}')
+
+    def _submit(self, batch, why):
+        with self.lock:
+            self.nBatches += 1
+        waited = time.monotonic() - batch.started
+        self.logger.info(f'submitting {len(batch.entries)} files for visit {batch.visit} '
+                         f'after {waited:0.1f}s ({why})')
+        if self.executor is not None:
+            self.executor.submit(self._archive, batch)
+        else:
+            self._archive(batch)
+
+    def _archive(self, batch):
+        try:
+            self.submit(batch.visit, batch.entries)
+        except Exception as e:
+            self.logger.warning(f'failed to archive {len(batch.entries)} files '
+                                f'for visit {batch.visit}: {e}')
+
+    def flush(self, visit=None):
+        """Submit the batch of one visit, or all held batches, now. """
+
+        with self.lock:
+            visits = list(self.batches) if visit is None else [visit]
+            batches = [self._pop(v) for v in visits if v in self.batches]
+
+        for batch in batches:
+            self._submit(batch, 'flushed')
+
+    def pending(self):
+        """Return (visit, nFiles, secondsWaiting) for each batch still held. """
+
+        now = time.monotonic()
+        with self.lock:
+            return [(b.visit, len(b.entries), now - b.started)
+                    for b in sorted(self.batches.values(), key=lambda b: b.visit)]
@@ -0,0 +1,207 @@
+"""A local, append-only record of the files we hand to Gen2 for archiving.
+
+Each line of the ledger is one JSON object describing one event for one
+file: its checksum having been computed, it being queued for archiving,
+or the outcome of the archive request. The ledger is what we compare
+against when verifying what STARS received.
+
+When the ledger is opened the whole file is replayed into an in-memory
+index of the latest state of each path, so that we can tell in O(1)
+whether a path has already been archived, or is on its way. Callbacks
+are re-registered on reloads and keyvars can be re-delivered after hub
+reconnections, so the same file can be announced to us several times.
+
+The replayed file is then compacted to one merged entry per path, so
+that it grows with the number of files rather than with the number of
+times they were announced. Entries carrying checksums are fsync'ed, as
+they are what verification relies on.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+LedgerEntry = collections.namedtuple('LedgerEntry', 'path size time frameId outcome checksum')
+
+# The events which change a path's outcome. 'checksum' only adds to what we know.
+outcomes = ('queued', 'archived', 'failed')
+
+
+class ArchiveLedger(object):
+    """An append-only JSON-lines ledger of archived files, with an index by path.
+
+    Parameters
+    ----------
+    path : `str`
+        The ledger file. Created if necessary.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger if logger is not None else logging.getLogger('archiveledger')
+        self.lock = threading.Lock()
+        self.index = dict()
+
+        # Files queued before we started will never finish; they may be claimed again.
+        self.startTime = time.time()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        t0 = time.monotonic()
+        nEntries = 0
+        merged = dict()
+        for entry in self.entries():
+            self._index(entry)
+            self._merge(merged, entry)
+            nEntries += 1
+        self.logger.info(f'loaded {nEntries} entries for {len(self.index)} paths from {path} '
+                         f'in {time.monotonic() - t0:0.2f}s')
+        if nEntries > len(merged):
+            self._compact(merged)
+        self.file = open(path, 'a')
+
+    @staticmethod
+    def _merge(merged, entry):
+        """Fold one entry into the merged entry for its path, keeping all its fields. """
+
+        path = entry['path']
+        old = merged.get(path)
+        if old is None:
+            merged[path] = dict(entry)
+            return
+        event, frameId = old.get('event'), old.get('frameId')
+        old.update(entry)
+        old['frameId'] = entry.get('frameId') or frameId
+        if entry.get('event') not in outcomes:
+            old['event'] = event
+
+    def _compact(self, merged):
+        """Replace the ledger file with one merged entry per path. """
+
+        t0 = time.monotonic()
+        tmpPath = f'{self.path}.tmp'
+        with open(tmpPath, 'w') as f:
+            for entry in merged.values():
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+
+        dirFd = os.open(os.path.dirname(self.path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+        self.logger.info(f'compacted {self.path} to {len(merged)} entries '
+                         f'in {time.monotonic() - t0:0.2f}s')
+
+    def _index(self, entry):
+        """Fold one entry into the index. Needs the lock, once the ledger is open. """
+
+        path = entry['path']
+        old = self.index.get(path)
+        if old is None:
+            old = LedgerEntry(path, None, None, None, None, None)
+        event = entry.get('event')
+        self.index[path] = LedgerEntry(path,
+                                       entry.get('size', old.size),
+                                       entry.get('time', old.time),
+                                       entry.get('frameId') or old.frameId,
+                                       event if event in outcomes else old.outcome,
+                                       entry.get('checksum', old.checksum))
+
+    def _write(self, path, event, fields):
+        """Append one entry and index it. Needs the lock. """
+
+        entry = dict(path=str(path), event=event, time=time.time())
+        entry.update(fields)
+        self.file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.file.flush()
+        if entry.get('checksum') is not None:
+            os.fsync(self.file.fileno())
+        self._index(entry)
+        return entry
+
+    def append(self, path, event, **fields):
+        """Add one entry to the ledger.
+
+        Parameters
+        ----------
+        path : `str`
+            The archived file.
+        event : `str`
+            What happened: 'checksum', or one of `outcomes`.
+        fields
+            Anything else to record, which must be JSON-serializable.
+        """
+
+        with self.lock:
+            return self._write(path, event, fields)
+
+    def claim(self, path, size, frameId=None, force=False):
+        """Mark a file as queued for archiving, unless it already is or has been.
+
+        A file is only archived again if its size has changed, if its last
+        attempt failed, or if it was queued before we started.
+
+        Parameters
+        ----------
+        path : `str`
+            The file.
+        size : `int`
+            Its current size, in bytes.
+        frameId : `str`
+            Its Gen2 frame ID.
+        force : `bool`
+            Claim it whatever its history.
+
+        Returns
+        -------
+        claimed : `bool`
+            True if the caller should archive the file.
+        """
+
+        path = str(path)
+        with self.lock:
+            old = self.index.get(path)
+            if not force and old is not None and old.size == size:
+                if old.outcome == 'archived':
+                    return False
+                if old.outcome == 'queued' and old.time >= self.startTime:
+                    return False
+            self._write(path, 'queued', dict(size=size, frameId=frameId))
+        return True
+
+    def lookup(self, path):
+        """Return the `LedgerEntry` for a path, or None. """
+
+        with self.lock:
+            return self.index.get(str(path))
+
+    def counts(self):
+        """Return the number of paths with each outcome. """
+
+        with self.lock:
+            return collections.Counter(e.outcome for e in self.index.values())
+
+    def entries(self):
+        """Yield all the ledger entries, oldest first. """
+
+        try:
+            f = open(self.path)
+        except FileNotFoundError:
+            return
+        with f:
+            for lineNum, line in enumerate(f, start=1):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    self.logger.warning(f'skipping bad line {lineNum} of {self.path}')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,122 @@
+"""Finding PFS data files on disk, to archive the ones the keyvar callbacks missed.
+
+The naming rules for the files we archive live here, and are shared by
+the archive command and the catch-up scanner. The scanner walks the
+per-day data directories with os.scandir from a pool of threads, since
+the time goes in directory reads on network disks, not in Python.
+"""
+
+import concurrent.futures
+import datetime
+import os
+import re
+
+pfsFileRE = re.compile(r'^PFS([ABCD])(\d{6})(\d)(\d)\.fits$')
+pfsConfigRE = re.compile(r'^pfsConfig-0x([0-9a-fA-F]+)-(\d{6})\.fits$')
+dayDirRE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# armNum in PFSA names.
+armNames = {1: 'b', 2: 'r', 3: 'n', 4: 'm'}
+
+
+def archiveNameInfo(fname):
+    """Return what we need to archive a file with the given name.
+
+    Parameters
+    ----------
+    fname : `str`
+        The file name, without directory.
+
+    Returns
+    -------
+    info : `tuple` or None
+        (filetype, frameId, visit, cam), or None if this is not a file we
+        archive. frameId is None when it is the filename stem.
+    """
+
+    m = pfsFileRE.match(fname)
+    if m is not None:
+        letter, visit, n1, n2 = m.groups()
+        filetype = f'PFS{letter}'
+        if letter == 'A':
+            cam = f'{armNames.get(int(n2), "?")}{n1}'
+        elif letter == 'B':
+            cam = f'n{n1}'
+        else:
+            cam = filetype
+        return filetype, None, int(visit), cam
+
+    m = pfsConfigRE.match(fname)
+    if m is not None:
+        visit = int(m.group(2))
+        return 'PFSF', f'PFSF{visit:06d}00', visit, 'pfsConfig'
+
+    return None
+
+
+def dayDirs(root, firstDay, lastDay):
+    """Return the YYYY-MM-DD directories directly under root in the inclusive day range. """
+
+    first = firstDay.isoformat() if isinstance(firstDay, datetime.date) else firstDay
+    last = lastDay.isoformat() if isinstance(lastDay, datetime.date) else lastDay
+    dirs = []
+    with os.scandir(root) as it:
+        for e in it:
+            if dayDirRE.match(e.name) and first <= e.name <= last and e.is_dir():
+                dirs.append(e.path)
+    return sorted(dirs)
+
+
+def _scanDir(path):
+    """List the archivable files and the subdirectories of one directory. """
+
+    files = []
+    dirs = []
+    errors = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        dirs.append(e.path)
+                    elif archiveNameInfo(e.name) is not None and e.is_file():
+                        st = e.stat()
+                        files.append((e.path, st.st_size, st.st_mtime))
+                except OSError as err:
+                    errors.append(f'{e.path}: {err}')
+    except OSError as err:
+        errors.append(f'{path}: {err}')
+    return files, dirs, errors
+
+
+def scanTrees(roots, nThreads=8, errors=None):
+    """Walk directory trees in parallel, yielding the archivable files found.
+
+    Parameters
+    ----------
+    roots : iterable of `str`
+        The directories to walk.
+    nThreads : `int`
+        How many directories to read at once.
+    errors : `list`
+        If set, descriptions of anything which could not be read are appended here.
+
+    Yields
+    ------
+    path, size, mtime
+        For each archivable file, in no particular order.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nThreads,
+                                               thread_name_prefix='archivescan') as executor:
+        pending = {executor.submit(_scanDir, r) for r in roots}
+        while pending:
+            done, pending = concurrent.futures.wait(pending,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                files, dirs, dirErrors = future.result()
+                for d in dirs:
+                    pending.add(executor.submit(_scanDir, d))
+                if errors is not None:
+                    errors.extend(dirErrors)
+                yield from files
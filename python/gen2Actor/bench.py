@@ -0,0 +1,265 @@
+"""End-to-end latency and throughput benchmarks for the gen2 actor.
+
+A real `PFS` Gen2 personality and a real `Gen2Cmd` command set are wired
+to a `fakes.FakeOcs` and a `fakes.FakeActor`, with the opdb in a scratch
+SQLite file. Each benchmark calls one of the actor's hot paths from N
+threads M times, and we report latency percentiles and throughput.
+
+Results can be saved as JSON, and compared against an earlier run to
+flag regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+
+from gen2Actor import fakes
+from gen2Actor import latency
+from gen2Actor import opdbpool
+
+# Pointing values which parse as coordinates; the header defaults are 'UNKNOWN'.
+fakePointing = {'FITS.SBR.RA': '10:00:00.000',
+                'FITS.SBR.DEC': '+20:00:00.00',
+                'FITS.SBR.RA_CMD': '10:00:00.000',
+                'FITS.SBR.DEC_CMD': '+20:00:00.00'}
+
+
+def fakeStatus(header):
+    """Return Gen2 alias values for all the cards of a header, from their defaults. """
+
+    status = {card[0]: card[3] for card in header.values() if card[0] != 'NA'}
+    status.update(fakePointing)
+    return status
+
+
+class Harness(object):
+    """A `PFS` and `Gen2Cmd` running against fake Gen2 and MHS ends.
+
+    Parameters
+    ----------
+    workDir : `str`
+        Scratch directory for the opdb, local state and data files.
+    ocs : `fakes.FakeOcs`
+        The fake Gen2 to talk to.
+    gen2Config : `dict`
+        Overrides for the actor's 'gen2' configuration.
+    """
+
+    def __init__(self, workDir, ocs, gen2Config=None):
+        # Find header_telescope.txt in this checkout, unless we have been told otherwise.
+        os.environ.setdefault('ICS_GEN2ACTOR_DIR',
+                              os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+        from gen2Actor import PFS
+        from gen2Actor.Commands import Gen2Cmd
+
+        self.workDir = workDir
+        self.dataDir = os.path.join(workDir, 'data')
+        os.makedirs(self.dataDir, exist_ok=True)
+        self.ocs = ocs
+
+        self.gen2 = PFS.PFS(logging.getLogger('bench.gen2'), None)
+        self.gen2.initialize(ocs)
+        self.gen2._reload()
+        ocs.setStatusValues(fakeStatus(self.gen2.tel_header))
+
+        config = dict(opdbUrl=f'sqlite:///{os.path.join(workDir, "opdb.sqlite")}',
+                      stateDir=os.path.join(workDir, 'state'),
+                      archive=['PFSC', 'PFSD', 'pfsConfig',
+                               'b1', 'r1', 'n1', 'b2', 'r2', 'n2'],
+                      domePollPeriod=3600.0)
+        if gen2Config is not None:
+            config.update(gen2Config)
+
+        self.actor = fakes.FakeActor(config)
+        self.actor.gen2 = self.gen2
+        self.gen2.actor = self.actor
+        self.actor.opdbPool = opdbpool.OpdbPool(config['opdbUrl'], logger=logging.getLogger('opdbpool'))
+        self.actor.opdbPool.createSqliteTables()
+
+        self.cmdSet = Gen2Cmd.Gen2Cmd(self.actor)
+        self.actor.commandSets['Gen2Cmd'] = self.cmdSet
+        self.actor.butler = fakes.FakeButler(self.dataDir)
+
+    def placeholderFile(self, name):
+        """Create an empty file in our data directory, and return its path. """
+
+        path = os.path.join(self.dataDir, name)
+        with open(path, 'wb'):
+            pass
+        return path
+
+    def close(self):
+        self.actor.statusPoller.stop()
+        self.actor.alertManager.flush()
+        self.actor.opdbPool.close()
+        self.actor.reactor.stop()
+        if self.actor.logPipeline is not None:
+            self.actor.logPipeline.stop()
+
+
+def _getVisit(h, thread, i):
+    cmd = fakes.FakeCmd(dict(caller='bench'))
+    h.cmdSet.getVisit(cmd)
+    if cmd.didFail:
+        raise RuntimeError(cmd.replies[-1][2])
+
+
+def _updateTelStatus(h, thread, i):
+    cmd = fakes.FakeCmd(dict(caller='bench', visit=100000 + thread))
+    h.cmdSet.updateTelStatus(cmd)
+
+
+def _returnNewHeader(h, thread, i):
+    h.gen2.return_new_header(f'PFSA{100000 + thread:06d}00', 'object', 1.0)
+
+
+def _archiveCallbacks(h, thread, i):
+    visit = 200000 + thread * 10000 + i
+    h.placeholderFile(f'PFSA{visit:06d}12.fits')
+    h.actor.models['ccd_r1'].keyVarDict['spsFileIds'].set(['r1', '2023-05-01', visit, 1, 2])
+
+
+def _archiveCommand(h, thread, i):
+    visit = 300000 + thread * 10000 + i
+    path = h.placeholderFile(f'PFSC{visit:06d}00.fits')
+    h.cmdSet.archive(fakes.FakeCmd(dict(pathname=path)))
+
+
+benchmarks = dict(getVisit=_getVisit,
+                  updateTelStatus=_updateTelStatus,
+                  return_new_header=_returnNewHeader,
+                  archiveCallbacks=_archiveCallbacks,
+                  archive=_archiveCommand)
+
+
+def runBenchmark(harness, name, nThreads, nIterations):
+    """Call one benchmark from nThreads threads, nIterations times each.
+
+    Returns
+    -------
+    result : `dict`
+        The latency percentiles in ms, the error count and the throughput in calls/s.
+    """
+
+    func = benchmarks[name]
+    stats = latency.LatencyStats(name, maxSamples=nThreads * nIterations)
+
+    def worker(thread):
+        for i in range(nIterations):
+            try:
+                with stats.timing():
+                    func(harness, thread, i)
+            except Exception as e:
+                logging.getLogger('bench').warning(f'{name} failed: {e}')
+
+    threads = [threading.Thread(target=worker, args=(t,), name=f'bench-{name}-{t}')
+               for t in range(nThreads)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.monotonic() - t0
+
+    p50, p90, p99 = stats.percentiles((50, 90, 99))
+    return dict(name=name, threads=nThreads, count=stats.count, errors=stats.errors,
+                p50=p50 * 1000, p90=p90 * 1000, p99=p99 * 1000,
+                throughput=stats.count / wall if wall > 0 else float('nan'))
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare two runs' results.
+
+    Returns
+    -------
+    lines : `list` of `str`
+        One line per benchmark in both runs.
+    regressions : `list` of `str`
+        The names of benchmarks whose p90 latency grew, or throughput
+        fell, by more than `tolerance`.
+    """
+
+    old = {r['name']: r for r in baseline['results']}
+    lines = []
+    regressions = []
+    for r in results['results']:
+        b = old.get(r['name'])
+        if b is None:
+            continue
+        p90Ratio = r['p90'] / b['p90'] if b['p90'] > 0 else float('nan')
+        rateRatio = r['throughput'] / b['throughput'] if b['throughput'] > 0 else float('nan')
+        regressed = p90Ratio > 1 + tolerance or rateRatio < 1 - tolerance
+        if regressed:
+            regressions.append(r['name'])
+        lines.append(f'{r["name"]:<18} p90 {b["p90"]:9.2f} -> {r["p90"]:9.2f} ms ({p90Ratio:5.2f}x)  '
+                     f'rate {b["throughput"]:9.1f} -> {r["throughput"]:9.1f}/s ({rateRatio:5.2f}x)'
+                     f'{"  REGRESSION" if regressed else ""}')
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the gen2 actor against a fake Gen2.')
+    parser.add_argument('--benchmarks', default=','.join(benchmarks),
+                        help=f'comma-separated benchmarks, from {",".join(benchmarks)}')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--iterations', type=int, default=50,
+                        help='calls per thread')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='fake Gen2 call latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.002,
+                        help='fake Gen2 call latency jitter, in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workDir', default=None,
+                        help='scratch directory. Default is a new temporary one.')
+    parser.add_argument('--out', default=None,
+                        help='save the results as JSON in this file')
+    parser.add_argument('--compare', default=None,
+                        help='compare against the results saved in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fractional slowdown counted as a regression')
+    opts = parser.parse_args(argv)
+
+    names = [n.strip() for n in opts.benchmarks.split(',') if n.strip()]
+    for n in names:
+        if n not in benchmarks:
+            parser.error(f'unknown benchmark {n}')
+
+    logging.basicConfig(level=logging.WARNING)
+    workDir = opts.workDir if opts.workDir is not None else tempfile.mkdtemp(prefix='gen2bench')
+    ocs = fakes.FakeOcs(latency=opts.latency, jitter=opts.jitter, seed=opts.seed)
+    harness = Harness(workDir, ocs)
+
+    results = dict(host=platform.node(), time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   latency=opts.latency, jitter=opts.jitter,
+                   iterations=opts.iterations, results=[])
+    try:
+        print('benchmark          threads  count errors       p50       p90       p99 (ms)    calls/s')
+        for name in names:
+            r = runBenchmark(harness, name, opts.threads, opts.iterations)
+            results['results'].append(r)
+            print(f'{name:<18} {r["threads"]:7d} {r["count"]:6d} {r["errors"]:6d} '
+                  f'{r["p50"]:9.2f} {r["p90"]:9.2f} {r["p99"]:9.2f} {r["throughput"]:10.1f}')
+    finally:
+        harness.close()
+
+    if opts.out is not None:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if opts.compare is not None:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, tolerance=opts.tolerance)
+        print()
+        for line in lines:
+            print(line)
+        if regressions:
+            print(f'regressions: {",".join(regressions)}')
+            return 1
+    return 0
@@ -0,0 +1,126 @@
+"""Checksums of the files we archive, computed in worker processes.
+
+Files are read through mmap, so that the hash functions see the page
+cache directly and no large buffers are copied into Python. The work is
+done in a separate pool of processes, so that hashing gigabytes of
+detector data does not hold the GIL of the actor process.
+
+MD5 is always available. CRC32C needs the optional `crc32c` package.
+"""
+
+import concurrent.futures
+import hashlib
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+algorithms = ('md5', 'crc32c')
+
+
+def fileChecksum(path, algorithm='md5'):
+    """Return the checksum of one file. Runs in a worker process.
+
+    Returns
+    -------
+    path : `str`
+        The path we were given.
+    size : `int`
+        The number of bytes read.
+    digest : `str`
+        The checksum, in hex.
+    elapsed : `float`
+        Seconds spent reading and hashing.
+    pid : `int`
+        The worker's process ID.
+    """
+
+    if algorithm == 'crc32c' and crc32c is None:
+        raise ValueError('crc32c checksums need the crc32c package')
+    if algorithm not in algorithms:
+        raise ValueError(f'unknown checksum algorithm {algorithm}')
+
+    t0 = time.monotonic()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            data = b''
+            mm = None
+        else:
+            mm = data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if algorithm == 'md5':
+                digest = hashlib.md5(data).hexdigest()
+            else:
+                digest = f'{crc32c.crc32c(data):08x}'
+        finally:
+            if mm is not None:
+                mm.close()
+
+    return path, size, digest, time.monotonic() - t0, os.getpid()
+
+
+class ChecksumPool(object):
+    """A pool of processes computing file checksums, with per-worker throughput.
+
+    Parameters
+    ----------
+    nProcs : `int`
+        The number of worker processes.
+    algorithm : `str`
+        One of `algorithms`.
+    """
+
+    def __init__(self, nProcs=2, algorithm='md5'):
+        if algorithm == 'crc32c' and crc32c is None:
+            raise ValueError('crc32c checksums need the crc32c package')
+        if algorithm not in algorithms:
+            raise ValueError(f'unknown checksum algorithm {algorithm}')
+
+        self.algorithm = algorithm
+        self.nProcs = nProcs
+        # Do not fork the actor, with its reactor and hub connections.
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=nProcs,
+                                                               mp_context=multiprocessing.get_context('spawn'))
+        self.workerStats = dict()
+        self.lock = threading.Lock()
+
+    def _record(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        path, size, digest, elapsed, pid = future.result()
+        with self.lock:
+            stats = self.workerStats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += size
+            stats[2] += elapsed
+
+    def submit(self, path):
+        """Start computing the checksum of a file. Returns a `concurrent.futures.Future`. """
+
+        future = self.executor.submit(fileChecksum, str(path), self.algorithm)
+        future.add_done_callback(self._record)
+        return future
+
+    def checksum(self, path, timeout=None):
+        """Return (size, digest) for a file, blocking until it has been computed. """
+
+        path, size, digest, elapsed, pid = self.submit(path).result(timeout=timeout)
+        return size, digest
+
+    def throughput(self):
+        """Return (pid, nFiles, MB, MB/s) for each worker process which has done some work. """
+
+        with self.lock:
+            stats = sorted(self.workerStats.items())
+        return [(pid, nFiles, nBytes / 1e6, nBytes / 1e6 / elapsed if elapsed > 0 else float('nan'))
+                for pid, (nFiles, nBytes, elapsed) in stats]
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,408 @@
+"""In-process stand-ins for Gen2 and MHS, for benchmarks and load tests.
+
+`FakeOcs` implements the parts of the g2cam OCS interface which `PFS`
+and `Gen2Cmd` use, with a configurable latency and jitter per call.
+`FakeActor`, `FakeCmd`, `FakeModel` and `FakeKeyVar` stand in for the
+actorcore/opscore objects, so that a real `Gen2Cmd` can be driven
+without a tron hub, and `FakeReactor` for the single twisted thread
+which delivers keyword replies to their callbacks.
+
+None of this is used in operations.
+"""
+
+import collections
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from gen2Actor import latency
+
+
+class FakeStatusTable(object):
+    """An OCS status table: a bag of attributes with setvals(). """
+
+    def __init__(self, name, keys):
+        self.name = name
+        self.values = dict.fromkeys(keys)
+        self.lock = threading.Lock()
+
+    def setvals(self, **kwargs):
+        with self.lock:
+            self.values.update(kwargs)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in ('name', 'values', 'lock'):
+            object.__setattr__(self, name, value)
+        else:
+            self.setvals(**{name: value})
+
+
+class FakeInsConfig(object):
+    def getCodeByNumber(self, obcpnum):
+        return 'PFS'
+
+    def getNameByNumber(self, obcpnum):
+        return 'PFS'
+
+
+class FakeThreadPool(object):
+    """Runs tasks in their own daemon threads. """
+
+    def addTask(self, task):
+        t = threading.Thread(target=task.execute, daemon=True)
+        t.start()
+
+
+class FakeOcs(object):
+    """An in-process Gen2 OCS interface.
+
+    Parameters
+    ----------
+    latency : `float`
+        Base latency of every call, in seconds.
+    jitter : `float`
+        Standard deviation of the Gaussian latency jitter, in seconds.
+    latencies : `dict`
+        Per-method (latency, jitter) overrides.
+    status : `dict`
+        Initial Gen2 alias to value mapping. Unknown aliases read as '##NODATA##'.
+    firstVisit : `int`
+        Frame numbers for getFrames start at firstVisit * 100.
+    seed : `int`
+        For the jitter random number generator.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, latencies=None, status=None,
+                 firstVisit=100000, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.latencies = dict(latencies) if latencies is not None else dict()
+        self.status = dict(status) if status is not None else dict()
+        self.rng = random.Random(seed)
+
+        self.frameCounters = collections.defaultdict(lambda: firstVisit * 100)
+        self.scriptedFrames = collections.defaultdict(collections.deque)
+        self.statusTables = dict()
+        self.archived = []
+        self.events = []
+        self.subtagValues = collections.defaultdict(dict)
+        self.calls = collections.Counter()
+        self.threadPool = FakeThreadPool()
+        self.lock = threading.Lock()
+
+    def _delay(self, method):
+        with self.lock:
+            self.calls[method] += 1
+            lat, jit = self.latencies.get(method, (self.latency, self.jitter))
+            dt = max(0.0, self.rng.gauss(lat, jit)) if jit else lat
+        if dt > 0:
+            time.sleep(dt)
+
+    def setStatusValues(self, status):
+        """Change the Gen2 status values we serve. """
+        with self.lock:
+            self.status.update(status)
+
+    def queueFrames(self, frameType, frames):
+        """Have the next getFrames call for frameType return these frames. """
+        with self.lock:
+            self.scriptedFrames[frameType].append(list(frames))
+
+    def _statusValue(self, alias):
+        return self.status.get(alias, '##NODATA##')
+
+    # Configuration
+    def get_obcpnum(self):
+        return 27
+
+    def get_INSconfig(self):
+        return FakeInsConfig()
+
+    # Status fetches
+    def requestOCSstatus(self, statusDict):
+        self._delay('requestOCSstatus')
+        with self.lock:
+            for k in statusDict:
+                statusDict[k] = self._statusValue(k)
+        return statusDict
+
+    def requestOCSstatusList2List(self, aliases):
+        self._delay('requestOCSstatusList2List')
+        with self.lock:
+            return [self._statusValue(a) for a in aliases]
+
+    def getOCSstatusList2List(self, aliases):
+        self._delay('getOCSstatusList2List')
+        with self.lock:
+            return [self._statusValue(a) for a in aliases]
+
+    # Frames and archiving
+    def getFrames(self, num, frameType):
+        self._delay('getFrames')
+        with self.lock:
+            scripted = self.scriptedFrames[frameType]
+            if scripted:
+                return scripted.popleft()
+            first = self.frameCounters[frameType]
+            self.frameCounters[frameType] += num
+        return [f'PFS{frameType}{n:08d}' for n in range(first, first + num)]
+
+    def archive_framelist(self, framelist):
+        self._delay('archive_framelist')
+        with self.lock:
+            self.archived.extend(framelist)
+
+    # Our status tables and events
+    def addStatusTable(self, tableName, keys, formatDict=None, nameMap=None):
+        table = FakeStatusTable(tableName, keys)
+        with self.lock:
+            self.statusTables[tableName] = table
+        return table
+
+    def setStatus(self, tableName, **kwargs):
+        self.statusTables[tableName].setvals(**kwargs)
+
+    def exportStatusTable(self, tableName):
+        self._delay('exportStatusTable')
+
+    def exportStatus(self):
+        self._delay('exportStatus')
+
+    def send_event(self, event):
+        self._delay('send_event')
+        with self.lock:
+            self.events.append(event)
+
+    def setvals(self, tag, **kwargs):
+        self._delay('setvals')
+        with self.lock:
+            self.subtagValues[tag].update(kwargs)
+
+    def shutdown(self, res):
+        pass
+
+
+_typedClasses = [(baseType, type(f'Fake{baseType.__name__.title()}', (baseType,),
+                                 dict(baseType=baseType)))
+                 for baseType in (int, float, str)]
+
+
+def typed(value):
+    """Wrap a Python value so that it looks like an opscore typed value (has .baseType). """
+
+    for baseType, cls in _typedClasses:
+        if isinstance(value, baseType):
+            return cls(value)
+    return value
+
+
+class FakeKeyVar(object):
+    """An opscore keyvar which calls its callbacks when set(). """
+
+    def __init__(self, name, values=None):
+        self.name = name
+        self.valueList = [] if values is None else [typed(v) for v in values]
+        self.callbacks = []
+
+    def getValue(self):
+        if not self.valueList:
+            raise ValueError(f'{self.name} has no value')
+        return self.valueList[0] if len(self.valueList) == 1 else tuple(self.valueList)
+
+    def addCallback(self, callback, callNow=False):
+        self.callbacks.append(callback)
+        if callNow:
+            callback(self)
+
+    def _removeAllCallbacks(self):
+        self.callbacks = []
+
+    def set(self, values):
+        """Set new values and call all the callbacks, as a keyword reply would. """
+        self.valueList = [typed(v) for v in values]
+        for cb in list(self.callbacks):
+            cb(self)
+
+
+class KeyVarDict(dict):
+    """Creates keyvars on first access, but does not pretend to hold ones never set. """
+
+    def __missing__(self, name):
+        kv = self[name] = FakeKeyVar(name)
+        return kv
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) and bool(dict.__getitem__(self, name).valueList)
+
+
+class FakeModel(object):
+    def __init__(self, actorName):
+        self.actor = actorName
+        self.keyVarDict = KeyVarDict()
+
+
+class FakeKeyword(object):
+    def __init__(self, name, values):
+        self.name = name
+        self.values = list(values) if isinstance(values, (list, tuple)) else [values]
+
+
+class FakeParsedCmd(object):
+    def __init__(self, keywords):
+        self.keywords = {k: FakeKeyword(k, v) for k, v in keywords.items()}
+
+
+class FakeCmd(object):
+    """Records the replies to one MHS command.
+
+    Parameters
+    ----------
+    keywords : `dict`
+        The command's parsed keywords, name to value(s).
+    cmdr : `str`
+        Who sent the command.
+    """
+
+    def __init__(self, keywords=None, cmdr='bench.fake', maxReplies=10000):
+        self.cmd = FakeParsedCmd(keywords or dict())
+        self.cmdr = cmdr
+        self.replies = collections.deque(maxlen=maxReplies)
+        self.finished = threading.Event()
+        self.didFail = False
+        self.lock = threading.Lock()
+
+    def _reply(self, flag, text):
+        with self.lock:
+            self.replies.append((time.monotonic(), flag, text))
+
+    def debug(self, text=''):
+        self._reply('d', text)
+
+    def diag(self, text=''):
+        self._reply('d', text)
+
+    def inform(self, text=''):
+        self._reply('i', text)
+
+    def respond(self, text=''):
+        self._reply('i', text)
+
+    def warn(self, text=''):
+        self._reply('w', text)
+
+    def finish(self, text=''):
+        self._reply(':', text)
+        self.finished.set()
+
+    def fail(self, text=''):
+        self._reply('f', text)
+        self.didFail = True
+        self.finished.set()
+
+    @property
+    def isAlive(self):
+        return not self.finished.is_set()
+
+
+class FakeButler(object):
+    """Maps any getPath request into files under a single directory.
+
+    With createFiles, an empty placeholder file is created for each new path.
+    """
+
+    def __init__(self, root, createFiles=False):
+        self.root = root
+        self.createFiles = createFiles
+
+    def getPath(self, kind, idDict):
+        if kind == 'spsFile':
+            name = f'PFSA{idDict["visit"]:06d}{idDict["spectrograph"]}{idDict["armNum"]}.fits'
+        elif kind == 'mcsFile':
+            name = f'PFSC{idDict["visit"]:06d}{idDict["frame"]:02d}.fits'
+        elif kind == 'agccFile':
+            name = f'PFSD{idDict["visit"]:06d}{idDict["agccFrameNum"]:02d}.fits'
+        elif kind == 'pfsConfig':
+            name = f'pfsConfig-0x{idDict["pfsConfigId"]:016x}-{idDict["visit"]:06d}.fits'
+        else:
+            raise KeyError(f'unknown path kind: {kind}')
+        path = f'{self.root}/{name}'
+        if self.createFiles and not os.path.exists(path):
+            with open(path, 'wb'):
+                pass
+        return path
+
+
+class FakeReactor(object):
+    """A single thread running calls in order, as the twisted reactor runs keyvar callbacks.
+
+    The time each call spends queued, from `callFromThread` until it
+    starts, is recorded in `lag`.
+    """
+
+    def __init__(self, maxSamples=100000):
+        self.lag = latency.LatencyStats('reactorLag', maxSamples=maxSamples)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='fakeReactor', daemon=True)
+        self.thread.start()
+
+    def callFromThread(self, func, *args, **kwargs):
+        self.queue.put((time.monotonic(), func, args, kwargs))
+
+    def pending(self):
+        """Return how many calls are waiting to run. """
+        return self.queue.qsize()
+
+    def _run(self):
+        log = logging.getLogger('fakeReactor')
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            queued, func, args, kwargs = item
+            self.lag.record(time.monotonic() - queued)
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                log.warning(f'reactor call {func} failed: {e}')
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class FakeActor(object):
+    """Enough of an actorcore Actor to host a `Gen2Cmd`.
+
+    Parameters
+    ----------
+    gen2Config : `dict`
+        The 'gen2' section of the actor configuration.
+    modelNames : iterable of `str`
+        The actor models to create.
+    """
+
+    def __init__(self, gen2Config, modelNames=None):
+        if modelNames is None:
+            modelNames = ['gen2', 'iic', 'sps', 'mcs', 'fps', 'ag', 'agcc', 'dcb']
+            for sm in 1, 2, 3, 4:
+                modelNames.extend([f'ccd_b{sm}', f'ccd_r{sm}', f'hx_n{sm}'])
+
+        self.name = 'gen2'
+        self.actorConfig = dict(gen2=dict(gen2Config))
+        self.models = {name: FakeModel(name) for name in modelNames}
+        self.bcast = FakeCmd(cmdr='bcast')
+        self.reactor = FakeReactor()
+        self.commandSets = dict()
+        self.logger = logging.getLogger('fakeActor')
+
+    def sendVersionKey(self, cmd):
+        cmd.inform('version="fake"')
@@ -0,0 +1,138 @@
+"""Pools of Gen2 frame IDs, fetched in bulk ahead of need.
+
+Each Gen2 getFrames request is a blocking round trip, and some of our
+consumers (AG and MCS sequences, say) want frame IDs in quick bursts. A
+`FramePool` keeps a stock of IDs of one frame type, fetched batchSize at
+a time. Whenever a draw leaves fewer than lowWater IDs, a refill is
+started in the background, so that drawers only ever wait on Gen2 when
+a burst is larger than the stock. Pools start empty, and are first
+filled by the first draw, so that an actor which never uses one does not
+use up any frame IDs.
+
+There is no pool of 'A' frames: those share the Gen2 PFSA counter with
+the visits, each of which takes a block of 100 frames from a 100-frame
+boundary, and a pool fetch would move the counter off that boundary.
+
+IDs left in a pool when we exit are simply never used, as with any other
+frame ID which Gen2 issued but no file was taken for.
+"""
+
+import collections
+import logging
+import threading
+
+from gen2Actor import latency
+
+# Frame types which may not be pooled: see above.
+unpooledFrameTypes = frozenset(('A',))
+
+
+class FramePool(object):
+    """A stock of Gen2 frame IDs of one type.
+
+    Parameters
+    ----------
+    frameType : `str`
+        The Gen2 frame type, e.g. 'A' for PFSA frames.
+    fetch : callable
+        Called as fetch(num) to get num new frame IDs from Gen2.
+    batchSize : `int`
+        How many IDs to fetch at a time.
+    lowWater : `int`
+        Refill once fewer than this many IDs are left.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, frameType, fetch, batchSize=100, lowWater=20, logger=None):
+        if frameType in unpooledFrameTypes:
+            raise ValueError(f'{frameType} frame IDs cannot be pooled')
+        self.frameType = frameType
+        self.fetch = fetch
+        self.batchSize = batchSize
+        self.lowWater = lowWater
+        self.logger = logger if logger is not None else logging.getLogger('framepool')
+
+        self.frameIds = collections.deque()
+        self.lock = threading.Lock()
+        # Only one Gen2 request at a time per pool.
+        self.fetchLock = threading.Lock()
+        self.refilling = False
+
+        self.fetchStats = latency.LatencyStats(f'getFrames{frameType}')
+        self.nDrawn = 0
+        self.nFetched = 0
+        self.nWaits = 0
+
+    def available(self):
+        with self.lock:
+            return len(self.frameIds)
+
+    def _fetchLocked(self, num):
+        """Fetch num IDs into the pool. The caller must hold fetchLock. """
+
+        with self.fetchStats.timing():
+            frameIds = list(self.fetch(num))
+        with self.lock:
+            self.frameIds.extend(frameIds)
+            self.nFetched += len(frameIds)
+        self.logger.info(f'fetched {len(frameIds)} {self.frameType} frame IDs: '
+                         f'{frameIds[0] if frameIds else None}..{frameIds[-1] if frameIds else None}')
+
+    def fill(self):
+        """Fetch a batch if the pool is below its low-water mark. Returns the number now available. """
+
+        with self.fetchLock:
+            if self.available() < max(self.lowWater, 1):
+                self._fetchLocked(self.batchSize)
+        return self.available()
+
+    def _refill(self):
+        try:
+            self.fill()
+        except Exception as e:
+            self.logger.warning(f'failed to refill {self.frameType} frame ID pool: {e}')
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def refillInBackground(self):
+        """Start a refill in its own thread, unless one is already running. """
+
+        with self.lock:
+            if self.refilling:
+                return
+            self.refilling = True
+        t = threading.Thread(target=self._refill, name=f'framePool{self.frameType}', daemon=True)
+        t.start()
+
+    def draw(self, num=1):
+        """Take num frame IDs, fetching from Gen2 now only if the pool cannot supply them.
+
+        Returns
+        -------
+        frameIds : `list` of `str`
+            In the order Gen2 issued them.
+        """
+
+        waited = False
+        while True:
+            with self.lock:
+                if len(self.frameIds) >= num:
+                    frameIds = [self.frameIds.popleft() for _ in range(num)]
+                    self.nDrawn += num
+                    low = len(self.frameIds) < self.lowWater
+                    break
+
+            if not waited:
+                waited = True
+                with self.lock:
+                    self.nWaits += 1
+            with self.fetchLock:
+                short = num - self.available()
+                if short > 0:
+                    self._fetchLocked(max(short, self.batchSize))
+
+        if low:
+            self.refillInBackground()
+        return frameIds
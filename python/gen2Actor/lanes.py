@@ -0,0 +1,193 @@
+"""Admission control for the commands Gen2 sends us, by lane.
+
+g2cam runs every exec command (and our autonomous tasks) on one shared
+thread pool, and `PFS.dispatchCommand` is called on one of its workers.
+A long mcsexpose, or a pile of fits_file or sleep commands, can
+therefore hold every worker while a reqframes waits for one to come
+free. We cannot reorder g2cam's own queue, but we can bound how many of
+its workers each kind of command may hold. Each command belongs to a
+lane:
+
+- 'critical': latency-critical requests, e.g. reqframes and getstatus,
+- 'normal': MHS commands and everything not listed,
+- 'bulk': exposures, file transfers and sleeps.
+
+The critical lane is never limited. The others run at most maxRunning
+commands at once; up to maxWaiting more may wait up to maxWait seconds
+for one of those to finish, and anything beyond that is refused at once
+with `LaneBusy`. Commands run on the g2cam worker which dispatched them,
+so as long as the normal and bulk lanes together cannot hold all of
+g2cam's workers, a critical command always finds a free one.
+
+Each lane records how long its commands waited to be admitted and how
+long they ran, to size the limits by.
+"""
+
+import logging
+import threading
+import time
+
+from gen2Actor import latency
+
+laneNames = ('critical', 'normal', 'bulk')
+
+# Lane -> (maxRunning, maxWaiting). The critical lane is not limited.
+defaultLimits = dict(normal=(4, 4), bulk=(2, 2))
+
+# Command name -> lane. Anything not listed is in the 'normal' lane.
+defaultCommandLanes = dict(reqframes='critical',
+                           getstatus='critical',
+                           getstatus2='critical',
+                           putstatus='critical',
+                           obcp_mode='critical',
+                           mcsexpose='bulk',
+                           fits_file='bulk',
+                           view_file='bulk',
+                           view_fits='bulk',
+                           sleep='bulk')
+
+
+class LaneBusy(RuntimeError):
+    """A command was refused because its lane was full. """
+    pass
+
+
+class Lane(object):
+    """One lane: a bound on its running commands, with wait and run time statistics.
+
+    Parameters
+    ----------
+    name : `str`
+        The lane name.
+    maxRunning : `int`
+        How many of the lane's commands may run at once. None for no limit.
+    maxWaiting : `int`
+        How many more may wait for a running one to finish.
+    maxWait : `float`
+        How long a command may wait, in seconds.
+    """
+
+    def __init__(self, name, maxRunning=None, maxWaiting=0, maxWait=0.0):
+        self.name = name
+        self.maxRunning = maxRunning
+        self.maxWaiting = maxWaiting
+        self.maxWait = maxWait
+
+        self.waitStats = latency.LatencyStats(f'{name}Wait')
+        self.runStats = latency.LatencyStats(f'{name}Run')
+        self.cond = threading.Condition()
+        self.nRunning = 0
+        self.nWaiting = 0
+        self.nRefused = 0
+
+    def _isFree(self):
+        return self.maxRunning is None or self.nRunning < self.maxRunning
+
+    def _admit(self, cmdName):
+        """Wait for a slot to run a command in, or raise `LaneBusy`. """
+
+        t0 = time.monotonic()
+        with self.cond:
+            if not self._isFree():
+                if self.nWaiting >= self.maxWaiting:
+                    self.nRefused += 1
+                    raise LaneBusy(f'{self.name} lane is full ({self.nRunning} running, '
+                                   f'{self.nWaiting} waiting): refusing {cmdName}')
+                self.nWaiting += 1
+                try:
+                    admitted = self.cond.wait_for(self._isFree, timeout=self.maxWait)
+                finally:
+                    self.nWaiting -= 1
+                if not admitted:
+                    self.nRefused += 1
+                    self.waitStats.record(time.monotonic() - t0, failed=True)
+                    raise LaneBusy(f'{cmdName} waited {self.maxWait:0.1f}s '
+                                   f'for the {self.name} lane: refusing it')
+            self.nRunning += 1
+        self.waitStats.record(time.monotonic() - t0)
+
+    def _release(self):
+        with self.cond:
+            self.nRunning -= 1
+            self.cond.notify()
+
+    def run(self, cmdName, func, *args, **kwargs):
+        """Run a command in this thread, once the lane admits it. """
+
+        self._admit(cmdName)
+        try:
+            with self.runStats.timing():
+                return func(*args, **kwargs)
+        finally:
+            self._release()
+
+
+class LaneDispatcher(object):
+    """Run commands through their lanes.
+
+    Parameters
+    ----------
+    limits : `dict`
+        Lane name to (maxRunning, maxWaiting), on top of `defaultLimits`.
+    commandLanes : `dict`
+        Command name to lane name, on top of `defaultCommandLanes`.
+    maxWait : `float`
+        How long a command may wait to be admitted, in seconds.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, limits=None, commandLanes=None, maxWait=5.0, logger=None):
+        self.logger = logger if logger is not None else logging.getLogger('lanes')
+
+        laneLimits = dict(defaultLimits)
+        if limits is not None:
+            for laneName, limit in limits.items():
+                if laneName not in laneNames:
+                    raise ValueError(f'unknown lane {laneName}')
+                laneLimits[laneName] = limit
+        self.lanes = dict()
+        for name in laneNames:
+            maxRunning, maxWaiting = laneLimits.get(name, (None, 0))
+            self.lanes[name] = Lane(name, maxRunning, maxWaiting, maxWait=maxWait)
+
+        self.commandLanes = dict(defaultCommandLanes)
+        if commandLanes is not None:
+            for cmdName, laneName in commandLanes.items():
+                if laneName not in self.lanes:
+                    raise ValueError(f'unknown lane {laneName} for {cmdName}')
+                self.commandLanes[cmdName] = laneName
+
+    def laneFor(self, cmdName):
+        return self.lanes[self.commandLanes.get(cmdName, 'normal')]
+
+    def run(self, cmdName, func, *args, **kwargs):
+        """Run a command in this thread once its lane admits it, or raise `LaneBusy`. """
+
+        lane = self.laneFor(cmdName)
+        try:
+            return lane.run(cmdName, func, *args, **kwargs)
+        except LaneBusy as e:
+            self.logger.warning(str(e))
+            raise
+
+
+def parseConfig(config):
+    """Return (limits, commandLanes, maxWait) from the gen2Lanes* configuration variables.
+
+    gen2Lanes is a list of lane:maxRunning:maxWaiting, e.g. 'normal:4:4,bulk:2:2',
+    and gen2CommandLanes a list of command:lane, e.g. 'pfscmd:bulk'.
+    """
+
+    def items(s):
+        for item in str(s).split(','):
+            item = item.strip()
+            if item:
+                yield [f.strip() for f in item.split(':')]
+
+    limits = {name: (int(maxRunning), int(maxWaiting))
+              for name, maxRunning, maxWaiting in items(config.get('gen2Lanes', ''))}
+    commandLanes = {cmdName: laneName
+                    for cmdName, laneName in items(config.get('gen2CommandLanes', ''))}
+    maxWait = float(config.get('gen2LaneMaxWait', 5.0))
+    return limits, commandLanes, maxWait
@@ -0,0 +1,93 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+class LatencyStats(object):
+    """Rolling latency samples for one named operation.
+
+    Keeps the most recent `maxSamples` durations, plus lifetime call and
+    error counts. All methods are thread-safe.
+    """
+
+    def __init__(self, name, maxSamples=1000):
+        self.name = name
+        self.samples = collections.deque(maxlen=maxSamples)
+        self.count = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, dt, failed=False):
+        """Add one sample, in seconds. """
+        with self.lock:
+            self.samples.append(dt)
+            self.count += 1
+            if failed:
+                self.errors += 1
+
+    @contextlib.contextmanager
+    def timing(self):
+        """Context manager which records the duration of its body.
+
+        Exceptions are counted as errors and re-raised.
+        """
+        t0 = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(time.monotonic() - t0, failed=failed)
+
+    def percentiles(self, pcts=(50, 90, 99)):
+        """Return the given percentiles of the retained samples, in seconds.
+
+        Returns NaN for each percentile if there are no samples yet.
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return [float('nan')] * len(pcts)
+
+        n = len(samples)
+        return [samples[min(n - 1, int(round(p / 100.0 * (n - 1))))] for p in pcts]
+
+    def percentile(self, pct):
+        return self.percentiles((pct,))[0]
+
+    def summary(self, pcts=(50, 90, 99)):
+        """Return a one-line human summary, with times in ms. """
+        vals = self.percentiles(pcts)
+        parts = [f'p{p}={v*1000:0.1f}ms' for p, v in zip(pcts, vals)]
+        return f'{self.name}: n={self.count} errors={self.errors} {" ".join(parts)}'
+
+    def keyValues(self, pcts=(50, 90, 99)):
+        """Return an MHS keyword value list: name,count,errors,p...(ms) """
+        vals = self.percentiles(pcts)
+        ms = ','.join(f'{v*1000:0.2f}' for v in vals)
+        return f'"{self.name}",{self.count},{self.errors},{ms}'
+
+
+class LatencyRegistry(object):
+    """A thread-safe, create-on-demand collection of `LatencyStats`. """
+
+    def __init__(self, maxSamples=1000):
+        self.maxSamples = maxSamples
+        self.stats = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            try:
+                return self.stats[name]
+            except KeyError:
+                s = self.stats[name] = LatencyStats(name, maxSamples=self.maxSamples)
+                return s
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.stats.values()))
+
+    def timing(self, name):
+        return self[name].timing()
@@ -0,0 +1,214 @@
+"""Non-blocking, rate-limited logging for the hot paths.
+
+Our callbacks and Gen2 calls log at INFO on every event, and the file
+handlers write synchronously in whichever thread logged. A `LogPipeline`
+moves a logger's handlers behind a queue: the logging thread only
+formats the message and enqueues it, and a `QueueListener` thread does
+the writing.
+
+Before being queued, INFO and DEBUG records pass a per-call-site token
+bucket (`RateLimitFilter`): each source line may log `burst` records at
+once and `rate` per second sustained, and the rest are dropped and
+counted. The next record let through from that line says how many were
+dropped, and every `reportInterval` seconds we log a summary line for
+any line which is still being held back. Warnings and errors are never
+dropped, and nor are the lines which `logstats` pairs up to time Gen2
+calls.
+
+The written lines keep the layout `logstats` parses::
+
+    2023-05-01 21:12:34,567 | I | PFSCommands.py:180 (reqframes) | reqframes num=100 type='A'
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from gen2Actor import logstats
+
+compactFormat = '%(asctime)s | %(levelname).1s | %(filename)s:%(lineno)d (%(funcName)s) | %(message)s'
+
+# The functions whose log lines logstats needs, all of them.
+logstatsFuncs = frozenset(funcName.strip('()') for funcNames, _, _ in logstats.callPatterns.values()
+                          for funcName in funcNames)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop INFO and DEBUG records from source lines which log too often.
+
+    Parameters
+    ----------
+    rate : `float`
+        Records per second allowed from each source line, sustained.
+    burst : `int`
+        Records allowed from a source line at once.
+    exemptFuncs : iterable of `str`
+        Functions whose records are always let through.
+    """
+
+    def __init__(self, rate=1.0, burst=20, exemptFuncs=logstatsFuncs):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exemptFuncs = frozenset(exemptFuncs)
+
+        # (pathname, lineno) -> [tokens, last refill time, suppressed count, funcName]
+        self.sites = dict()
+        self.lock = threading.Lock()
+        self.nPassed = 0
+        self.nSuppressed = 0
+
+    def filter(self, record):
+        if (record.levelno >= logging.WARNING
+                or record.funcName in self.exemptFuncs
+                or getattr(record, 'rateLimitExempt', False)):
+            self.nPassed += 1
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [float(self.burst), now, 0, record.funcName]
+            else:
+                site[0] = min(float(self.burst), site[0] + (now - site[1]) * self.rate)
+                site[1] = now
+
+            if site[0] < 1.0:
+                site[2] += 1
+                self.nSuppressed += 1
+                return False
+
+            site[0] -= 1.0
+            suppressed = site[2]
+            site[2] = 0
+            self.nPassed += 1
+
+        if suppressed:
+            record.msg = f'{record.getMessage()} [{suppressed} similar suppressed]'
+            record.args = None
+        return True
+
+    def takeSuppressed(self):
+        """Return and reset [(pathname, lineno, funcName, count)] for the lines being held back. """
+
+        held = []
+        with self.lock:
+            for (pathname, lineno), site in self.sites.items():
+                if site[2]:
+                    held.append((pathname, lineno, site[3], site[2]))
+                    site[2] = 0
+        return held
+
+
+class LogPipeline(object):
+    """Put a logger's handlers behind a queue and a per-source-line rate limit.
+
+    Parameters
+    ----------
+    logger : `logging.Logger`
+        The logger whose handlers to take over. Records propagated from
+        its children go through the pipeline too.
+    rate, burst : `float`, `int`
+        Per source line, see `RateLimitFilter`.
+    reportInterval : `float`
+        How often to log a summary of the lines being held back, in seconds.
+    compact : `bool`
+        Whether to switch the handlers to `compactFormat`.
+    """
+
+    def __init__(self, logger, rate=1.0, burst=20, reportInterval=60.0, compact=True):
+        self.logger = logger
+        self.reportInterval = reportInterval
+        self.compact = compact
+
+        self.limiter = RateLimitFilter(rate=rate, burst=burst)
+        self.queue = queue.SimpleQueue()
+        self.queueHandler = None
+        self.listener = None
+        self.handlers = []
+        self.oldFormatters = []
+        self.ev_quit = threading.Event()
+
+    def start(self):
+        """Take over the logger's handlers. Returns False if there were none to take over. """
+
+        handlers = [h for h in self.logger.handlers
+                    if not isinstance(h, logging.handlers.QueueHandler)]
+        if not handlers:
+            return False
+
+        self.handlers = handlers
+        self.oldFormatters = [h.formatter for h in handlers]
+        if self.compact:
+            for h in handlers:
+                h.setFormatter(logging.Formatter(compactFormat))
+
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers,
+                                                       respect_handler_level=True)
+        self.listener.start()
+
+        self.queueHandler = logging.handlers.QueueHandler(self.queue)
+        self.queueHandler.addFilter(self.limiter)
+        self.logger.addHandler(self.queueHandler)
+        for h in handlers:
+            self.logger.removeHandler(h)
+
+        t = threading.Thread(target=self._reportLoop, name='logReport', daemon=True)
+        t.start()
+        return True
+
+    def report(self):
+        """Log one line per source line which has had records dropped since the last report. """
+
+        for pathname, lineno, funcName, count in self.limiter.takeSuppressed():
+            self.logger.info('%d records suppressed from %s:%d (%s) in the last %0.0fs',
+                             count, pathname, lineno, funcName, self.reportInterval,
+                             extra=dict(rateLimitExempt=True))
+
+    def _reportLoop(self):
+        while not self.ev_quit.wait(self.reportInterval):
+            self.report()
+
+    def queued(self):
+        """Return the number of records waiting to be written. """
+        return self.queue.qsize()
+
+    def stop(self):
+        """Write out what is queued, and give the handlers back to the logger. """
+
+        if self.listener is None:
+            return
+        self.ev_quit.set()
+        self.report()
+        self.logger.removeHandler(self.queueHandler)
+        self.listener.stop()
+        for h, formatter in zip(self.handlers, self.oldFormatters):
+            h.setFormatter(formatter)
+            self.logger.addHandler(h)
+        self.listener = None
+
+
+def fromConfig(logger, config):
+    """Start a `LogPipeline` for a logger, per the logQueue etc. configuration variables.
+
+    Returns
+    -------
+    pipeline : `LogPipeline` or None
+        None if disabled, or if the logger has no handlers of its own.
+    """
+
+    if str(config.get('logQueue', True)).lower() in ('false', '0', 'no'):
+        return None
+
+    pipeline = LogPipeline(logger,
+                           rate=float(config.get('logRate', 1.0)),
+                           burst=int(config.get('logBurst', 20)),
+                           reportInterval=float(config.get('logReportInterval', 60.0)),
+                           compact=str(config.get('logCompact', True)).lower() not in ('false', '0', 'no'))
+    if not pipeline.start():
+        return None
+    return pipeline
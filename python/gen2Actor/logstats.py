@@ -0,0 +1,390 @@
+"""Latency statistics for Gen2 calls, from the gen2 actor logs.
+
+The Gen2-side log has one line per event, like::
+
+    2023-05-01 21:12:34,567 | I | PFSCommands.py:180 (reqframes) | reqframes num=100 type='A'
+
+For each kind of call we care about we know which line marks its start
+and which its end. Lines which carry a call id (``#123``) are paired by
+that id, so that concurrent calls are timed correctly; others, e.g. from
+older logs, are paired in arrival order. Each file is
+reduced independently (and in parallel) to fixed-size, mergeable
+log-binned histograms, so memory use does not grow with the amount of
+log read.
+"""
+
+import argparse
+import collections
+import datetime
+import gzip
+import math
+import multiprocessing
+import os
+import re
+import sys
+
+# How to recognize the start and end of each call type:
+# (functions which log them, start text, end text)
+callPatterns = collections.OrderedDict(
+    reqframes=(('(reqframes)',), 'reqframes num=', 'framelist:'),
+    status=(('(update_header_stat)',), 'updating telescope info', 'updated telescope info'),
+    archive=(('(archivePfsFile)', '(archivePfsFiles)'), 'archiving: ', 'archived: '),
+    header=(('(return_new_header)',), 'fetching header...', 'fetched header'),
+    mhs=(('(_runPfsCmd)', '(mhsReply)'), 'dispatching MHS command', 'finished MHS command'),
+)
+
+# The id which ties a call's start and end lines together, when they have one.
+callIdRE = re.compile(r' #(\d+)\b')
+
+# A start with no end after this long is dropped as an orphan.
+maxPairingAge = 3600.0
+# And we never keep more than this many unfinished starts per call type.
+maxPending = 1000
+
+timeFormat = '%Y-%m-%d %H:%M:%S,%f'
+
+
+class LogHistogram(object):
+    """A mergeable histogram of durations in logarithmic bins.
+
+    Bins run from `lo` to `hi` seconds with `perDecade` bins per decade,
+    plus an underflow and an overflow bin.
+    """
+
+    lo = 1e-3
+    hi = 1e4
+    perDecade = 10
+
+    def __init__(self):
+        self.nBins = int(round(math.log10(self.hi / self.lo) * self.perDecade)) + 2
+        self.counts = [0] * self.nBins
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def binOf(self, dt):
+        if dt < self.lo:
+            return 0
+        if dt >= self.hi:
+            return self.nBins - 1
+        return 1 + int(math.log10(dt / self.lo) * self.perDecade)
+
+    def binEdges(self, i):
+        """Return the (low, high) edges of bin i, in seconds. """
+        if i == 0:
+            return 0.0, self.lo
+        if i == self.nBins - 1:
+            return self.hi, float('inf')
+        return (self.lo * 10 ** ((i - 1) / self.perDecade),
+                self.lo * 10 ** (i / self.perDecade))
+
+    def add(self, dt):
+        self.counts[self.binOf(dt)] += 1
+        self.n += 1
+        self.total += dt
+        self.max = max(self.max, dt)
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct):
+        """Return an estimate of the given percentile, from the geometric middle of its bin. """
+        if self.n == 0:
+            return float('nan')
+        target = pct / 100.0 * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target and c > 0:
+                lo, hi = self.binEdges(i)
+                if lo == 0.0:
+                    return hi
+                if hi == float('inf'):
+                    return self.max
+                return math.sqrt(lo * hi)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else float('nan')
+
+
+def nightOf(t):
+    """Return the observing night (the date at the start of the night) of a local timestamp. """
+    return (t - datetime.timedelta(hours=12)).date()
+
+
+def hourOfNight(t):
+    """Return hours since the noon before t, 0..23. """
+    return (t.hour - 12) % 24
+
+
+class LogSummary(object):
+    """The reduced statistics from one or more log files.
+
+    Parameters
+    ----------
+    slowThreshold : `float`
+        Calls longer than this many seconds are listed individually.
+    maxSlow : `int`
+        Keep at most this many of the slowest calls. None keeps them all.
+    """
+
+    def __init__(self, slowThreshold=None, maxSlow=1000):
+        self.slowThreshold = slowThreshold
+        self.maxSlow = maxSlow
+        self.total = collections.defaultdict(LogHistogram)
+        self.nightly = collections.defaultdict(LogHistogram)
+        self.hourly = collections.defaultdict(LogHistogram)
+        self.slow = []
+        self.nLines = 0
+        self.nUnmatched = collections.Counter()
+        self.nOrphans = collections.Counter()
+        self.nBadLines = 0
+
+    def add(self, call, t0, dt):
+        self.total[call].add(dt)
+        self.nightly[(nightOf(t0), call)].add(dt)
+        self.hourly[(call, hourOfNight(t0))].add(dt)
+        if self.slowThreshold is not None and dt > self.slowThreshold:
+            self.slow.append((t0, call, dt))
+            if self.maxSlow is not None and len(self.slow) > 2 * self.maxSlow:
+                self._trimSlow()
+
+    def _trimSlow(self):
+        if self.maxSlow is None:
+            return
+        self.slow.sort(key=lambda s: -s[2])
+        del self.slow[self.maxSlow:]
+
+    def merge(self, other):
+        for attr in 'total', 'nightly', 'hourly':
+            mine = getattr(self, attr)
+            for k, h in getattr(other, attr).items():
+                mine[k].merge(h)
+        self.slow.extend(other.slow)
+        self._trimSlow()
+        self.nLines += other.nLines
+        self.nUnmatched.update(other.nUnmatched)
+        self.nOrphans.update(other.nOrphans)
+        self.nBadLines += other.nBadLines
+
+
+def openLog(path):
+    """Open a plain or gzipped log file, or stdin for '-', as text. """
+    if path == '-':
+        return sys.stdin
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, 'rt', errors='replace')
+
+
+def scanStream(stream, calls, summary):
+    """Pair up start and end lines for the given call types in one stream. """
+
+    patterns = [(call,) + callPatterns[call] for call in calls]
+    # Starts without ids, oldest first.
+    pending = {call: collections.deque() for call in calls}
+    # Starts with ids: id -> start time, oldest first.
+    pendingIds = {call: collections.OrderedDict() for call in calls}
+
+    for line in stream:
+        summary.nLines += 1
+        for call, funcNames, startText, endText in patterns:
+            if not any(funcName in line for funcName in funcNames):
+                continue
+            isStart = startText in line
+            if not isStart and endText not in line:
+                continue
+
+            ts = line.split('|', 1)[0].strip()
+            try:
+                t = datetime.datetime.strptime(ts, timeFormat)
+            except ValueError:
+                summary.nBadLines += 1
+                break
+
+            m = callIdRE.search(line)
+            if m is not None:
+                callId = m.group(1)
+                idStarts = pendingIds[call]
+                if isStart:
+                    if idStarts.pop(callId, None) is not None:
+                        summary.nOrphans[call] += 1
+                    idStarts[callId] = t
+                    if len(idStarts) > maxPending:
+                        idStarts.popitem(last=False)
+                        summary.nOrphans[call] += 1
+                    break
+
+                while idStarts:
+                    oldId, oldT = next(iter(idStarts.items()))
+                    if (t - oldT).total_seconds() <= maxPairingAge:
+                        break
+                    del idStarts[oldId]
+                    summary.nOrphans[call] += 1
+                t0 = idStarts.pop(callId, None)
+                if t0 is None:
+                    summary.nUnmatched[call] += 1
+                else:
+                    summary.add(call, t0, (t - t0).total_seconds())
+                break
+
+            starts = pending[call]
+            if isStart:
+                starts.append(t)
+                if len(starts) > maxPending:
+                    starts.popleft()
+                    summary.nOrphans[call] += 1
+                break
+
+            while starts and (t - starts[0]).total_seconds() > maxPairingAge:
+                starts.popleft()
+                summary.nOrphans[call] += 1
+            if not starts:
+                summary.nUnmatched[call] += 1
+                break
+            t0 = starts.popleft()
+            summary.add(call, t0, (t - t0).total_seconds())
+            break
+
+    for call in calls:
+        summary.nOrphans[call] += len(pending[call]) + len(pendingIds[call])
+    return summary
+
+
+def scanFile(args):
+    """Reduce one log file to a LogSummary. Runs in a worker process. """
+
+    path, calls, slowThreshold, maxSlow = args
+    summary = LogSummary(slowThreshold=slowThreshold, maxSlow=maxSlow)
+    try:
+        with openLog(path) as f:
+            scanStream(f, calls, summary)
+    except (OSError, EOFError) as e:
+        print(f'failed to read {path}: {e}', file=sys.stderr)
+    return summary
+
+
+def scanFiles(paths, calls, slowThreshold=None, nProcs=None, maxSlow=1000):
+    """Reduce many log files, in parallel, to a single merged LogSummary. """
+
+    summary = LogSummary(slowThreshold=slowThreshold, maxSlow=maxSlow)
+    jobs = [(p, calls, slowThreshold, maxSlow) for p in paths]
+    if '-' in paths or len(paths) == 1 or nProcs == 1:
+        results = map(scanFile, jobs)
+        for s in results:
+            summary.merge(s)
+    else:
+        with multiprocessing.Pool(nProcs) as pool:
+            for s in pool.imap_unordered(scanFile, jobs):
+                summary.merge(s)
+    return summary
+
+
+def ms(dt):
+    return f'{dt*1000:9.1f}'
+
+
+def printPercentiles(summary, out=sys.stdout):
+    print('call          n      mean       p50       p90       p99       max   (ms)', file=out)
+    for call, h in summary.total.items():
+        print(f'{call:<10} {h.n:6d} {ms(h.mean)} {ms(h.percentile(50))} {ms(h.percentile(90))} '
+              f'{ms(h.percentile(99))} {ms(h.max)}', file=out)
+
+
+def printNightly(summary, out=sys.stdout):
+    print('night      call          n       p50       p90       max   (ms)', file=out)
+    for (night, call), h in sorted(summary.nightly.items()):
+        print(f'{night} {call:<10} {h.n:6d} {ms(h.percentile(50))} {ms(h.percentile(90))} '
+              f'{ms(h.max)}', file=out)
+
+
+def printHeatmap(summary, pct=90, out=sys.stdout):
+    """Print one row per call type, one column per hour of the night (from 18:00), of the given percentile. """
+
+    hours = [(h + 6) % 24 for h in range(24)]
+    labels = ' '.join(f'{(h + 12) % 24:5d}' for h in hours)
+    print(f'p{pct} (ms) by local hour', file=out)
+    print(f'{"call":<10} {labels}', file=out)
+    for call in summary.total:
+        cells = []
+        for h in hours:
+            hist = summary.hourly.get((call, h))
+            if hist is None or hist.n == 0:
+                cells.append('    .')
+            else:
+                cells.append(f'{hist.percentile(pct)*1000:5.0f}')
+        print(f'{call:<10} {" ".join(cells)}', file=out)
+
+
+def writeCsv(summary, outdir):
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, 'percentiles.csv'), 'w') as f:
+        f.write('call,n,mean,p50,p90,p99,max\n')
+        for call, h in summary.total.items():
+            f.write(f'{call},{h.n},{h.mean},{h.percentile(50)},{h.percentile(90)},'
+                    f'{h.percentile(99)},{h.max}\n')
+    with open(os.path.join(outdir, 'nightly.csv'), 'w') as f:
+        f.write('night,call,n,p50,p90,max\n')
+        for (night, call), h in sorted(summary.nightly.items()):
+            f.write(f'{night},{call},{h.n},{h.percentile(50)},{h.percentile(90)},{h.max}\n')
+    with open(os.path.join(outdir, 'heatmap.csv'), 'w') as f:
+        f.write('call,hourSinceNoon,n,p50,p90\n')
+        for (call, hour), h in sorted(summary.hourly.items()):
+            f.write(f'{call},{hour},{h.n},{h.percentile(50)},{h.percentile(90)}\n')
+    with open(os.path.join(outdir, 'histograms.csv'), 'w') as f:
+        f.write('call,binLow,binHigh,count\n')
+        for call, h in summary.total.items():
+            for i, c in enumerate(h.counts):
+                if c:
+                    lo, hi = h.binEdges(i)
+                    f.write(f'{call},{lo},{hi},{c}\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gen2 call latencies from gen2 actor logs.')
+    parser.add_argument('logs', nargs='*', default=['-'],
+                        help='log files, possibly gzipped. "-" or nothing for stdin.')
+    parser.add_argument('--calls', default=','.join(callPatterns),
+                        help=f'comma-separated call types, from {",".join(callPatterns)}')
+    parser.add_argument('--slow', type=float, default=None,
+                        help='list calls slower than this many seconds')
+    parser.add_argument('--onlySlow', action='store_true',
+                        help='only list the slow calls, no tables')
+    parser.add_argument('--procs', type=int, default=None,
+                        help='number of worker processes. Default is one per CPU.')
+    parser.add_argument('--csv', default=None,
+                        help='also write CSV tables into this directory')
+    opts = parser.parse_args(argv)
+
+    calls = [c.strip() for c in opts.calls.split(',') if c.strip()]
+    for c in calls:
+        if c not in callPatterns:
+            parser.error(f'unknown call type {c}')
+
+    summary = scanFiles(opts.logs, calls, slowThreshold=opts.slow, nProcs=opts.procs)
+
+    if opts.slow is not None:
+        for t0, call, dt in sorted(summary.slow):
+            print(f'{t0.strftime("%Y-%m-%d %H:%M:%S")} {call} {dt}')
+        if opts.onlySlow:
+            return
+        print()
+
+    print(f'# {summary.nLines} lines, {summary.nBadLines} bad timestamps, '
+          f'unmatched ends: {dict(+summary.nUnmatched)}, orphan starts: {dict(+summary.nOrphans)}')
+    printPercentiles(summary)
+    print()
+    printNightly(summary)
+    print()
+    printHeatmap(summary)
+
+    if opts.csv is not None:
+        writeCsv(summary, opts.csv)
@@ -0,0 +1,312 @@
+"""Deadlines, hedged requests and circuit breakers for Gen2 OCS calls.
+
+Every OCS call we make is a blocking round trip to Gen2, and Gen2 is
+sometimes slow. `OcsGuard.call` runs each call in a worker thread so that
+it can:
+
+- give up after a per-call deadline,
+- optionally send a second, hedged, request if the first has not
+  answered by the call's recent 95th percentile latency, and use
+  whichever answers first,
+- fail fast, without calling Gen2 at all, once a call has timed out
+  several times in a row (a circuit breaker), until a trial call succeeds.
+
+Latency samples are kept per call name, for the ocsStats command.
+
+Hedging only makes sense for calls without side effects, so getFrames
+(which allocates frames, and visits) is never hedged. Nor is
+archive_framelist ever abandoned: if it times out it may still succeed,
+and sending the files again would give STARS duplicates. We wait for
+its real answer, and only log that it is late.
+
+A call which is given up on keeps a worker thread until Gen2 answers.
+If too many are stuck like that, further calls fail at once rather than
+queue behind them.
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+from gen2Actor import latency
+
+
+class OcsTimeout(TimeoutError):
+    pass
+
+
+class OcsUnavailable(RuntimeError):
+    """Raised without calling Gen2 while a call's circuit breaker is open. """
+    pass
+
+
+class CallPolicy(object):
+    """How to guard one OCS call.
+
+    Parameters
+    ----------
+    deadline : `float`
+        Seconds to wait for an answer before giving up.
+    hedge : `bool`
+        Whether to send a hedged second request.
+    hedgePercentile : `float`
+        Send the hedge after this percentile of the recent latencies.
+    minSamples : `int`
+        Do not hedge until we have this many latency samples.
+    abandon : `bool`
+        Whether to give up on the call at its deadline. If False, we keep
+        waiting for the answer, and the circuit breaker does not apply.
+    """
+
+    def __init__(self, deadline, hedge=False, hedgePercentile=95, minSamples=20, abandon=True):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.abandon = abandon
+        self.hedgePercentile = hedgePercentile
+        self.minSamples = minSamples
+
+
+defaultPolicies = dict(
+    # Every request allocates frames, so a hedge would use up a visit.
+    getFrames=CallPolicy(10.0),
+    getOCSstatusList2List=CallPolicy(5.0, hedge=True),
+    requestOCSstatusList2List=CallPolicy(5.0, hedge=True),
+    # This fills in its argument in place, so a hedge would race with the original.
+    requestOCSstatus=CallPolicy(5.0),
+    # May still succeed after the deadline, so must not be given up on and retried.
+    archive_framelist=CallPolicy(30.0, abandon=False),
+    send_event=CallPolicy(5.0),
+)
+
+
+class CircuitBreaker(object):
+    """Count consecutive timeouts, and refuse calls for a while after too many.
+
+    After `resetAfter` seconds one trial call is let through; if it
+    succeeds the breaker closes again.
+    """
+
+    def __init__(self, threshold=3, resetAfter=30.0):
+        self.threshold = threshold
+        self.resetAfter = resetAfter
+        self.failures = 0
+        self.openedAt = None
+        self.trialRunning = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.openedAt is None:
+                return 'closed'
+            if time.monotonic() - self.openedAt >= self.resetAfter:
+                return 'halfOpen'
+            return 'open'
+
+    def allow(self):
+        """Return whether a call may go ahead now. """
+
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if time.monotonic() - self.openedAt < self.resetAfter or self.trialRunning:
+                return False
+            self.trialRunning = True
+            return True
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.trialRunning = False
+
+    def timedOut(self):
+        with self.lock:
+            self.failures += 1
+            self.trialRunning = False
+            if self.failures >= self.threshold:
+                self.openedAt = time.monotonic()
+
+
+class OcsGuard(object):
+    """Run OCS calls with deadlines, hedging and circuit breakers.
+
+    Parameters
+    ----------
+    ocs : g2cam OCS interface
+        The object whose methods we call.
+    policies : `dict`
+        Per-call `CallPolicy` overrides, by method name.
+    maxWorkers : `int`
+        Size of the thread pool the calls run in.
+    maxAbandoned : `int`
+        Fail calls at once while this many calls we gave up on are still
+        running. Default is half of maxWorkers.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    # The upper edges of the published histogram bins, in seconds.
+    histogramEdges = (0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, float('inf'))
+
+    def __init__(self, ocs, policies=None, maxWorkers=16, maxAbandoned=None, logger=None):
+        self.ocs = ocs
+        self.logger = logger if logger is not None else logging.getLogger('ocsguard')
+
+        self.policies = dict(defaultPolicies)
+        if policies is not None:
+            self.policies.update(policies)
+        self.defaultPolicy = CallPolicy(30.0)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers,
+                                                              thread_name_prefix='ocsguard')
+        self.stats = latency.LatencyRegistry()
+        self.breakers = dict()
+        self.nHedges = dict()
+        self.maxAbandoned = maxAbandoned if maxAbandoned is not None else max(1, maxWorkers // 2)
+        self.nAbandoned = 0
+        self.lock = threading.Lock()
+
+    def breaker(self, name):
+        with self.lock:
+            try:
+                return self.breakers[name]
+            except KeyError:
+                b = self.breakers[name] = CircuitBreaker()
+                return b
+
+    def _hedgeAfter(self, name, policy):
+        if not policy.hedge:
+            return None
+        stats = self.stats[name]
+        if stats.count < policy.minSamples:
+            return None
+        return stats.percentile(policy.hedgePercentile)
+
+    def _discardLate(self, name, future):
+        """Log the result of a request we no longer care about. """
+
+        with self.lock:
+            self.nAbandoned += 1
+
+        def _done(f):
+            with self.lock:
+                self.nAbandoned -= 1
+            if f.cancelled():
+                return
+            e = f.exception()
+            if e is not None:
+                self.logger.info(f'abandoned {name} call failed: {e}')
+            else:
+                self.logger.warning(f'discarding abandoned {name} result: {f.result()}')
+        future.add_done_callback(_done)
+
+    def call(self, name, *args, deadline=None, **kwargs):
+        """Call ocs.name(*args, **kwargs), guarded.
+
+        Parameters
+        ----------
+        name : `str`
+            The OCS method name.
+        deadline : `float`
+            Override the policy's deadline for this call, in seconds.
+
+        Raises
+        ------
+        OcsUnavailable
+            If the call's circuit breaker is open.
+        OcsTimeout
+            If Gen2 did not answer in time.
+        """
+        policy = self.policies.get(name, self.defaultPolicy)
+        if deadline is None:
+            deadline = policy.deadline
+        breaker = self.breaker(name)
+        stats = self.stats[name]
+
+        with self.lock:
+            nAbandoned = self.nAbandoned
+        if nAbandoned >= self.maxAbandoned:
+            raise OcsUnavailable(f'Gen2 {name} call refused: {nAbandoned} earlier calls are still stuck')
+
+        func = getattr(self.ocs, name)
+        if not policy.abandon:
+            return self._callToEnd(name, deadline, func, *args, **kwargs)
+
+        if not breaker.allow():
+            raise OcsUnavailable(f'Gen2 {name} calls suspended after {breaker.failures} timeouts')
+
+        t0 = time.monotonic()
+        futures = [self.executor.submit(func, *args, **kwargs)]
+
+        hedgeAfter = self._hedgeAfter(name, policy)
+        firstWait = deadline if hedgeAfter is None else min(hedgeAfter, deadline)
+        done, _ = concurrent.futures.wait(futures, timeout=firstWait)
+        if not done and hedgeAfter is not None and time.monotonic() - t0 < deadline:
+            self.logger.info(f'hedging {name} call after {time.monotonic() - t0:0.3f}s')
+            with self.lock:
+                self.nHedges[name] = self.nHedges.get(name, 0) + 1
+            futures.append(self.executor.submit(func, *args, **kwargs))
+
+        # Take the first successful answer. If one request fails while
+        # another is still running, keep waiting for the other.
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = deadline - (time.monotonic() - t0)
+            done, pending = concurrent.futures.wait(pending, timeout=max(remaining, 0),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                if f.exception() is None:
+                    for other in pending:
+                        self._discardLate(name, other)
+                    stats.record(time.monotonic() - t0)
+                    breaker.succeeded()
+                    return f.result()
+                error = f.exception()
+
+        if pending:
+            for f in pending:
+                self._discardLate(name, f)
+            stats.record(time.monotonic() - t0, failed=True)
+            breaker.timedOut()
+            raise OcsTimeout(f'Gen2 {name} call did not answer within {deadline}s')
+
+        # Everything failed outright. Gen2 answered, so this does not count against the breaker.
+        stats.record(time.monotonic() - t0, failed=True)
+        breaker.succeeded()
+        raise error
+
+    def _callToEnd(self, name, deadline, func, *args, **kwargs):
+        """Call func, waiting however long it takes, and complaining once deadline has passed. """
+
+        stats = self.stats[name]
+        t0 = time.monotonic()
+        future = self.executor.submit(func, *args, **kwargs)
+        done, _ = concurrent.futures.wait([future], timeout=deadline)
+        if not done:
+            self.logger.warning(f'Gen2 {name} call has not answered within {deadline}s; still waiting')
+        try:
+            ret = future.result()
+        except Exception:
+            stats.record(time.monotonic() - t0, failed=True)
+            raise
+        stats.record(time.monotonic() - t0)
+        return ret
+
+    def histogram(self, name):
+        """Return the counts of recent latencies of one call in each of our histogram bins. """
+
+        counts = [0] * len(self.histogramEdges)
+        stats = self.stats[name]
+        with stats.lock:
+            samples = list(stats.samples)
+        for dt in samples:
+            for i, edge in enumerate(self.histogramEdges):
+                if dt <= edge:
+                    counts[i] += 1
+                    break
+        return counts
@@ -0,0 +1,205 @@
+"""Pooled opdb access for the gen2 actor.
+
+The gen2 actor writes to opdb from many threads: the MHS command thread,
+the twisted reactor (keyvar callbacks), the Gen2 command threads and
+our own workers. This module lends each statement a connection out of a
+small SQLAlchemy pool, with the insert statements for the hot tables
+built once and reused. (They are only cached on our side: psycopg2 does
+not prepare them on the server.)
+
+Inserts are not retried once they have been sent, as the first attempt
+may have committed before the connection dropped. Only a failure to
+check out a connection, or a lost connection during a query, is retried.
+
+By default we connect to the opdb which `pfs.utils.database.opdb.OpDB`
+is configured for. Any SQLAlchemy URL works too, so a local SQLite file
+can stand in for it when testing or benchmarking (see bin/opdbbench.py).
+"""
+
+import logging
+import threading
+
+import sqlalchemy
+import sqlalchemy.exc
+
+from gen2Actor import latency
+
+# The columns we may write for each of the hot tables. Each insert binds
+# only the columns it was given, so the others get their defaults.
+hotTables = dict(
+    pfs_visit=('pfs_visit_id', 'pfs_visit_description', 'pfs_design_id', 'issued_at'),
+    tel_status=('pfs_visit_id', 'status_sequence_id',
+                'altitude', 'azimuth', 'insrot', 'inst_pa', 'adc_pa',
+                'm2_pos3', 'm2_off3', 'tel_ra', 'tel_dec',
+                'dome_shutter_status', 'dome_light_status',
+                'dither_ra', 'dither_dec', 'dither_pa',
+                'caller', 'created_at'),
+    env_condition=('pfs_visit_id', 'status_sequence_id',
+                   'dome_temperature', 'dome_pressure', 'dome_humidity',
+                   'outside_temperature', 'outside_pressure', 'outside_humidity',
+                   'created_at'),
+)
+
+# Minimal versions of the hot tables, for a SQLite stand-in.
+sqliteSchema = """
+CREATE TABLE IF NOT EXISTS pfs_visit (pfs_visit_id INTEGER, pfs_visit_description TEXT,
+                                      pfs_design_id INTEGER, issued_at TEXT);
+CREATE TABLE IF NOT EXISTS tel_status (pfs_visit_id INTEGER, status_sequence_id INTEGER,
+                                       altitude REAL, azimuth REAL, insrot REAL, inst_pa REAL,
+                                       adc_pa REAL, m2_pos3 REAL, m2_off3 REAL,
+                                       tel_ra REAL, tel_dec REAL,
+                                       dome_shutter_status INTEGER, dome_light_status INTEGER,
+                                       dither_ra REAL, dither_dec REAL, dither_pa REAL,
+                                       caller TEXT, created_at TEXT);
+CREATE TABLE IF NOT EXISTS env_condition (pfs_visit_id INTEGER, status_sequence_id INTEGER,
+                                          dome_temperature REAL, dome_pressure REAL,
+                                          dome_humidity REAL, outside_temperature REAL,
+                                          outside_pressure REAL, outside_humidity REAL,
+                                          created_at TEXT);
+"""
+
+
+def opdbUrl(config):
+    """Return the opdb URL: opdbUrl from config if set, otherwise the one OpDB is configured with. """
+
+    url = config.get('opdbUrl')
+    if url:
+        return str(url)
+
+    from pfs.utils.database.opdb import OpDB
+    url = OpDB().engine.url
+    return url if isinstance(url, str) else url.render_as_string(hide_password=False)
+
+
+class OpdbPool(object):
+    """Pooled opdb connections with cached insert statements and latency stats.
+
+    Each statement checks a connection out of the pool for just as long
+    as it runs, so any number of threads can share a small pool.
+
+    Parameters
+    ----------
+    url : `str`
+        SQLAlchemy database URL. See `opdbUrl`.
+    poolSize : `int`
+        The number of connections to keep open.
+    logger : `logging.Logger`
+        Where to complain.
+    """
+
+    def __init__(self, url, poolSize=4, logger=None):
+        self.url = url
+        self.logger = logger if logger is not None else logging.getLogger('opdbpool')
+
+        self.engine = sqlalchemy.create_engine(url, pool_size=poolSize,
+                                               pool_pre_ping=True)
+        self.stats = latency.LatencyRegistry()
+
+        # (table, columns) -> insert statement
+        self.statements = dict()
+        self.lock = threading.Lock()
+
+    def _insertStatement(self, table, values):
+        """Return the insert statement for the columns given in values, in hotTables order. """
+
+        columns = hotTables[table]
+        unknown = set(values) - set(columns)
+        if unknown:
+            raise KeyError(f'unknown {table} columns: {sorted(unknown)}')
+        columns = tuple(c for c in columns if c in values)
+
+        key = (table, columns)
+        with self.lock:
+            stmt = self.statements.get(key)
+            if stmt is None:
+                colNames = ', '.join(columns)
+                params = ', '.join(f':{c}' for c in columns)
+                stmt = sqlalchemy.text(f'INSERT INTO {table} ({colNames}) VALUES ({params})')
+                self.statements[key] = stmt
+        return stmt
+
+    def healthCheck(self):
+        """Return True if a pooled connection answers a trivial query. """
+
+        try:
+            with self.engine.connect() as conn:
+                with self.stats.timing('healthCheck'):
+                    conn.execute(sqlalchemy.text('SELECT 1'))
+                    conn.rollback()
+        except Exception as e:
+            self.logger.warning(f'opdb health check failed: {e}')
+            return False
+        return True
+
+    def _isConnectionLost(self, e):
+        return e.connection_invalidated or isinstance(e, sqlalchemy.exc.OperationalError)
+
+    def _connect(self, statName):
+        """Check a connection out of the pool, retrying once if it cannot be opened. """
+
+        try:
+            return self.engine.connect()
+        except sqlalchemy.exc.DBAPIError as e:
+            if not self._isConnectionLost(e):
+                raise
+            self.logger.warning(f'cannot connect to opdb for {statName}, retrying: {e}')
+            return self.engine.connect()
+
+    def _execute(self, statName, stmt, params, fetch=False):
+        """Run one statement on a pooled connection.
+
+        A query (fetch=True) is run again if the connection is lost while
+        it runs; anything else is only retried if we could not connect.
+        """
+
+        for attempt in 0, 1:
+            try:
+                with self._connect(statName) as conn:
+                    with self.stats.timing(statName):
+                        res = conn.execute(stmt, params)
+                        ret = res.scalar() if fetch else None
+                        conn.commit()
+                return ret
+            except sqlalchemy.exc.DBAPIError as e:
+                if fetch and attempt == 0 and self._isConnectionLost(e):
+                    self.logger.warning(f'opdb connection lost during {statName}, reconnecting: {e}')
+                    continue
+                raise
+
+    def insert(self, table, **values):
+        """Insert one row into one of the hot tables.
+
+        Only the columns in `values` are bound, so the others get their database defaults.
+        """
+
+        self._execute(f'insert_{table}', self._insertStatement(table, values), values)
+
+    def insertMany(self, table, rows):
+        """Insert several rows into one of the hot tables, batching the rows with the same columns.
+
+        Only the columns in each row are bound, so the others get their database defaults.
+        """
+
+        batches = dict()
+        for values in rows:
+            stmt = self._insertStatement(table, values)
+            batches.setdefault(stmt, []).append(values)
+
+        for stmt, params in batches.items():
+            self._execute(f'insertMany_{table}', stmt, params)
+
+    def queryScalar(self, sql, params=None, name='query'):
+        """Run a query and return its first column of its first row. """
+
+        return self._execute(name, sqlalchemy.text(sql), params or {}, fetch=True)
+
+    def createSqliteTables(self):
+        """Create minimal hot tables, when standing in for opdb with SQLite. """
+
+        with self.engine.begin() as conn:
+            for stmt in sqliteSchema.split(';'):
+                if stmt.strip():
+                    conn.execute(sqlalchemy.text(stmt))
+
+    def close(self):
+        self.engine.dispose()
@@ -0,0 +1,138 @@
+"""Batched subcommand progress reports to Gen2.
+
+Our long-running Gen2 commands report their progress on a subtag with
+`ocs.setvals`: PFS.sleep once a second, execCmd once per output line,
+and pfscmd once per MHS reply. Each of those is a separate round trip
+to Gen2. A `ProgressReporter` instead merges the updates for each
+subtag, later values replacing earlier ones as they would in Gen2, and
+sends at most one setvals per subtag per flushInterval:
+
+- the first update after a quiet interval is sent at once, so the
+  operator sees a command start without delay,
+- updates within flushInterval of the last send are held, and sent
+  together when the interval is up,
+- terminal updates (task_end or task_error) are sent at once, together
+  with anything held for that subtag.
+"""
+
+import logging
+import threading
+import time
+
+from gen2Actor import cachedict
+
+terminalItems = frozenset(('task_end', 'task_error'))
+
+
+class ProgressReporter(object):
+    """Merge and rate-limit the progress updates sent on each subtag.
+
+    Parameters
+    ----------
+    setvals : callable
+        Called as setvals(subtag, **items) to send, e.g. `ocs.setvals`.
+    flushInterval : `float`
+        The shortest time between sends for one subtag, in seconds.
+        0 sends every update at once.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, setvals, flushInterval=1.0, logger=None):
+        self.setvals = setvals
+        self.flushInterval = flushInterval
+        self.logger = logger if logger is not None else logging.getLogger('progress')
+
+        # subtag -> dict of items not yet sent
+        self.pending = dict()
+        # subtag -> time of the last send
+        self.lastSent = cachedict.cacheDict(size=1000)
+        # subtag -> lock held while taking and sending its updates, so they go out in order.
+        self.sendLocks = cachedict.cacheDict(size=1000)
+        self.cond = threading.Condition()
+        self.flusher = None
+
+        self.nUpdates = 0
+        self.nSent = 0
+        self.nFailed = 0
+
+    def update(self, subtag, **items):
+        """Report some progress items on a subtag, now or within flushInterval. """
+
+        now = time.monotonic()
+        with self.cond:
+            self.nUpdates += 1
+            self.pending.setdefault(subtag, dict()).update(items)
+            last = self.lastSent.get(subtag)
+            sendNow = (self.flushInterval <= 0
+                       or terminalItems.intersection(items)
+                       or last is None
+                       or now - last >= self.flushInterval)
+            if not sendNow:
+                self._startFlusher()
+                self.cond.notify()
+                return
+
+        self.flush(subtag)
+
+    def flush(self, subtag):
+        """Send anything held for a subtag now. """
+
+        with self.cond:
+            sendLock = self.sendLocks.get(subtag)
+            if sendLock is None:
+                sendLock = self.sendLocks[subtag] = threading.Lock()
+
+        with sendLock:
+            with self.cond:
+                items = self.pending.pop(subtag, None)
+                if not items:
+                    return
+                if terminalItems.intersection(items):
+                    self.lastSent.pop(subtag, None)
+                else:
+                    self.lastSent[subtag] = time.monotonic()
+                self.nSent += 1
+
+            try:
+                self.setvals(subtag, **items)
+            except Exception:
+                with self.cond:
+                    self.nFailed += 1
+                raise
+
+    def flushAll(self):
+        with self.cond:
+            subtags = list(self.pending)
+        for subtag in subtags:
+            self.flush(subtag)
+
+    def _startFlusher(self):
+        """Start the thread which sends held updates. The caller must hold cond. """
+
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self._flushLoop, name='progressFlusher',
+                                            daemon=True)
+            self.flusher.start()
+
+    def _flushLoop(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                due = []
+                wait = None
+                for subtag in self.pending:
+                    dt = self.lastSent.get(subtag, now) + self.flushInterval - now
+                    if dt <= 0:
+                        due.append(subtag)
+                    elif wait is None or dt < wait:
+                        wait = dt
+                if not due:
+                    self.cond.wait(wait)
+                    continue
+
+            for subtag in due:
+                try:
+                    self.flush(subtag)
+                except Exception as e:
+                    self.logger.warning(f'failed to send progress for {subtag}: {e}')
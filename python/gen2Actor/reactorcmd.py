@@ -0,0 +1,38 @@
+"""Replies sent from our own threads, via the reactor.
+
+Command replies must only be sent from the twisted reactor thread. Work
+which runs on our executors and threads can instead reply through a
+`ReactorCmd`, which passes each reply to the reactor with
+`callFromThread`. The reactor runs those calls in the order they were
+made, so the replies keep their order.
+"""
+
+replyMethods = frozenset(('debug', 'diag', 'inform', 'respond', 'warn', 'finish', 'fail'))
+
+
+class ReactorCmd(object):
+    """Wrap a Command so that its replies are sent by the reactor.
+
+    Parameters
+    ----------
+    cmd : `Command`
+        The command to reply to.
+    callInReactor : callable
+        Called as callInReactor(func, *args) to have the reactor call func,
+        e.g. `reactor.callFromThread`.
+
+    Anything other than the reply methods is read from cmd itself.
+    """
+
+    def __init__(self, cmd, callInReactor):
+        self._cmd = cmd
+        self._callInReactor = callInReactor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cmd, name)
+        if name not in replyMethods:
+            return attr
+
+        def reply(text=''):
+            self._callInReactor(attr, text)
+        return reply
@@ -0,0 +1,178 @@
+"""Replaying a recorded gen2 session against a fake Gen2, for load testing.
+
+The events of a session (see `session`) are fed to a `bench.Harness`,
+i.e. a real `PFS` and `Gen2Cmd` wired to a `fakes.FakeOcs`:
+
+- 'status' events set the fake Gen2 status and latch it,
+- 'frames' events script the fake getFrames answer and request the frames,
+- 'keyvar' events set the fake MHS keyvar, which calls our callbacks.
+
+Events are played at their recorded pace divided by `speed`, or as fast
+as possible. With one thread they are applied strictly in order, so a
+replay is deterministic; with more, events overlap as they would when
+Gen2 or the opdb is slow.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import tempfile
+import threading
+import time
+
+from gen2Actor import bench
+from gen2Actor import fakes
+from gen2Actor import latency
+from gen2Actor import session
+
+
+class Replayer(object):
+    """Play a session's events into a harness.
+
+    Parameters
+    ----------
+    harness : `bench.Harness`
+        What to drive.
+    events : `list` of `dict`
+        The session events, in time order.
+    speed : `float`
+        Play at this multiple of the recorded pace. 0 or None means as fast as possible.
+    nThreads : `int`
+        How many events may be applied at once.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, harness, events, speed=1.0, nThreads=1, logger=None):
+        self.harness = harness
+        self.events = events
+        self.speed = speed
+        self.nThreads = nThreads
+        self.logger = logger if logger is not None else logging.getLogger('replay')
+
+        self.stats = latency.LatencyRegistry(maxSamples=100000)
+        self.lag = latency.LatencyStats('lag', maxSamples=100000)
+        self.nIgnored = 0
+        self.lock = threading.Lock()
+
+    def apply(self, event):
+        """Apply one event to the harness. """
+
+        h = self.harness
+        kind = event['kind']
+        if kind == 'status':
+            h.ocs.setStatusValues(event['values'])
+            h.gen2.update_header_stat()
+        elif kind == 'frames':
+            h.ocs.queueFrames(event['type'], event['frames'])
+            h.gen2.reqframes(num=event['num'], type=event['type'])
+        elif kind == 'keyvar':
+            model = h.actor.models.get(event['actor'])
+            if model is None:
+                with self.lock:
+                    self.nIgnored += 1
+                return
+            model.keyVarDict[event['key']].set(event['values'])
+        else:
+            with self.lock:
+                self.nIgnored += 1
+
+    def _timedApply(self, event):
+        try:
+            with self.stats.timing(event['kind']):
+                self.apply(event)
+        except Exception as e:
+            self.logger.warning(f'{event["kind"]} event at {event["t"]} failed: {e}')
+
+    def run(self):
+        """Play all the events. Returns the wall-clock time taken, in seconds. """
+
+        if not self.events:
+            return 0.0
+
+        executor = None
+        if self.nThreads > 1:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.nThreads,
+                                                             thread_name_prefix='replay')
+        futures = []
+        t0 = self.events[0]['t']
+        start = time.monotonic()
+        for event in self.events:
+            if self.speed:
+                due = start + (event['t'] - t0) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.lag.record(max(0.0, time.monotonic() - due))
+            if executor is None:
+                self._timedApply(event)
+            else:
+                futures.append(executor.submit(self._timedApply, event))
+
+        if executor is not None:
+            concurrent.futures.wait(futures)
+            executor.shutdown()
+        return time.monotonic() - start
+
+    def results(self, wall):
+        """Return the replay's latencies (ms), lag and throughput as a dict. """
+
+        def summary(stats):
+            p50, p90, p99 = stats.percentiles((50, 90, 99))
+            return dict(name=stats.name, count=stats.count, errors=stats.errors,
+                        p50=p50 * 1000, p90=p90 * 1000, p99=p99 * 1000)
+
+        nEvents = sum(s.count for s in self.stats)
+        return dict(speed=self.speed, threads=self.nThreads, wall=wall,
+                    events=nEvents, ignored=self.nIgnored,
+                    throughput=nEvents / wall if wall > 0 else float('nan'),
+                    sessionSeconds=self.events[-1]['t'] - self.events[0]['t'] if self.events else 0.0,
+                    lag=summary(self.lag),
+                    results=[summary(s) for s in self.stats])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded gen2 session against a fake Gen2.')
+    parser.add_argument('session', help='session file, from the recordSession command')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of the recorded pace. 0 plays as fast as possible.')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='events applied at once. 1 keeps the replay deterministic.')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='fake Gen2 call latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.002,
+                        help='fake Gen2 call latency jitter, in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workDir', default=None,
+                        help='scratch directory. Default is a new temporary one.')
+    parser.add_argument('--out', default=None,
+                        help='save the results as JSON in this file')
+    opts = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    events = session.loadSession(opts.session)
+    workDir = opts.workDir if opts.workDir is not None else tempfile.mkdtemp(prefix='gen2replay')
+    ocs = fakes.FakeOcs(latency=opts.latency, jitter=opts.jitter, seed=opts.seed)
+    harness = bench.Harness(workDir, ocs)
+    # Let the archiving callbacks find a file for each data file announced.
+    harness.actor.butler.createFiles = True
+
+    replayer = Replayer(harness, events, speed=opts.speed, nThreads=opts.threads)
+    try:
+        wall = replayer.run()
+    finally:
+        harness.close()
+    results = replayer.results(wall)
+
+    print(f'{results["events"]} events ({results["ignored"]} ignored) from {results["sessionSeconds"]:0.1f}s '
+          f'of session in {wall:0.1f}s: {results["throughput"]:0.1f} events/s')
+    lag = results['lag']
+    print(f'schedule lag p50/p90/p99: {lag["p50"]:0.2f}/{lag["p90"]:0.2f}/{lag["p99"]:0.2f} ms')
+    print('event       count errors       p50       p90       p99 (ms)')
+    for r in results['results']:
+        print(f'{r["name"]:<10} {r["count"]:6d} {r["errors"]:6d} {r["p50"]:9.2f} {r["p90"]:9.2f} {r["p99"]:9.2f}')
+
+    if opts.out is not None:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,82 @@
+"""Recording what Gen2 and MHS tell us, so that a night can be replayed offline.
+
+A session file is JSON lines, one event per line, each with the time it
+happened (`t`, seconds since the epoch) and its `kind`:
+
+- 'status': `values`, the raw Gen2 alias values of a full status latch.
+- 'frames': `num`, `type` and `frames`, a getFrames request and its answer.
+- 'keyvar': `actor`, `key` and `values`, an MHS keyword we have a callback for.
+
+See `replay` for playing one back.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+def plainValues(valueList):
+    """Convert opscore typed values to plain Python ones, for JSON. """
+
+    values = []
+    for v in valueList:
+        baseType = getattr(v.__class__, 'baseType', None)
+        if v is None or baseType is None:
+            values.append(v)
+        else:
+            values.append(baseType(v))
+    return values
+
+
+class SessionRecorder(object):
+    """Append session events to a JSON-lines file.
+
+    Parameters
+    ----------
+    path : `str`
+        The session file. Appended to if it exists.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger if logger is not None else logging.getLogger('session')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+        self.nEvents = 0
+
+    def record(self, kind, **fields):
+        """Record one event, of the given kind, happening now. """
+
+        event = dict(t=time.time(), kind=kind)
+        event.update(fields)
+        line = json.dumps(event, separators=(',', ':'), default=str)
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + '\n')
+            self.nEvents += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        self.logger.info(f'closed session {self.path} after {self.nEvents} events')
+
+
+def loadSession(path):
+    """Return the events of a session file, in time order. """
+
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    events.sort(key=lambda e: e['t'])
+    return events
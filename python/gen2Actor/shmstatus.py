@@ -0,0 +1,313 @@
+"""The latest Gen2 telescope status, in shared memory for actors on the same host.
+
+Each time the gen2 actor latches the full Gen2 status, the typed values
+are written into a named POSIX shared memory segment. Actors on the same
+host can then read the current telescope position and environment
+directly, without a hub round trip or another Gen2 status request::
+
+    from gen2Actor import shmstatus
+
+    reader = shmstatus.ShmStatusReader()
+    values = reader.read(['ALTITUDE', 'AZIMUTH', 'INR-STR'])
+
+The segment holds a small fixed header, a JSON description of the
+columns, one record (a NumPy structured array row) of typed values and
+a validity byte per column. Updates are protected by a sequence counter
+(a seqlock): the writer makes it odd before changing anything and even
+again afterwards, and a reader retries until it has copied the record
+between two reads of the same even value. Readers never block the
+writer. There must only be one writer at a time, so a `ShmStatusWriter`
+serializes the threads which publish through it. This relies on the x86-64 memory model, which keeps stores in
+order.
+
+Header layout, all little-endian:
+
+    0  8s  magic, b'G2STAT01'
+    8  u8  sequence counter
+   16  f8  latch timestamp, seconds since the epoch
+   24  u8  layout generation, bumped when the columns change
+   32  u4  layout offset      36  u4  layout length
+   40  u4  record offset      44  u4  record size
+   48  u4  validity offset    52  u4  number of columns
+"""
+
+import json
+import logging
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+DEFAULT_NAME = 'gen2Status'
+magic = b'G2STAT01'
+headerSize = 64
+segmentSize = 1 << 16
+stringWidth = 48
+
+
+class ShmStatusError(RuntimeError):
+    pass
+
+
+def _dtypeFromHeader(header):
+    """Return the record dtype for the header cards we fetch from Gen2. """
+
+    fields = []
+    for name, card in header.items():
+        alias, _, _, default, _ = card
+        if alias == 'NA':
+            continue
+        if isinstance(default, float):
+            fields.append((name, '<f8'))
+        elif isinstance(default, int):
+            fields.append((name, '<i8'))
+        else:
+            fields.append((name, f'S{stringWidth}'))
+    return np.dtype(fields)
+
+
+class _Segment(object):
+    """Typed views of the fixed header fields of a segment. """
+
+    def __init__(self, shm):
+        self.shm = shm
+        buf = shm.buf
+        self.magic = np.ndarray((8,), 'u1', buffer=buf, offset=0)
+        self.seq = np.ndarray((), '<u8', buffer=buf, offset=8)
+        self.timestamp = np.ndarray((), '<f8', buffer=buf, offset=16)
+        self.generation = np.ndarray((), '<u8', buffer=buf, offset=24)
+        self.offsets = np.ndarray((6,), '<u4', buffer=buf, offset=32)
+
+    def release(self):
+        for a in 'magic', 'seq', 'timestamp', 'generation', 'offsets':
+            setattr(self, a, None)
+
+
+class ShmStatusWriter(object):
+    """Publish typed status snapshots into a shared memory segment.
+
+    Parameters
+    ----------
+    name : `str`
+        The segment name (under /dev/shm on Linux).
+    header : `dict`
+        The parsed header file, as returned by `PFS.read_header_list`.
+        If None, the header passed with the first snapshot is used.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, header=None, logger=None):
+        self.name = name
+        self.logger = logger if logger is not None else logging.getLogger('shmstatus')
+        # Held for every change to the segment: the seqlock only allows one writer.
+        self.lock = threading.Lock()
+
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=segmentSize)
+        except FileExistsError:
+            # Left over from a previous run: take it over, keeping any attached readers.
+            self.shm = shared_memory.SharedMemory(name=name, create=False)
+            if self.shm.size < segmentSize:
+                self.shm.close()
+                self.shm.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=segmentSize)
+        self.seg = _Segment(self.shm)
+        if self.seg.seq % 2:
+            self.seg.seq[...] = self.seg.seq + 1
+
+        self.header = None
+        self.record = None
+        self.valid = None
+        self.nPublished = 0
+        if header is not None:
+            self.setHeader(header)
+
+    def setHeader(self, header):
+        """(Re-)write the column layout for a header. """
+
+        with self.lock:
+            self._setHeader(header)
+
+    def _setHeader(self, header):
+        """(Re-)write the column layout for a header. Needs the lock. """
+
+        dtype = _dtypeFromHeader(header)
+        layout = json.dumps(dict(names=list(dtype.names),
+                                 formats=[dtype.fields[n][0].str for n in dtype.names])).encode()
+
+        layoutOffset = headerSize
+        recordOffset = (layoutOffset + len(layout) + 63) // 64 * 64
+        validOffset = recordOffset + dtype.itemsize
+        if validOffset + len(dtype.names) > self.shm.size:
+            raise ShmStatusError(f'{len(dtype.names)} columns do not fit in {self.shm.size} bytes')
+
+        seg = self.seg
+        seg.seq[...] = seg.seq + 1
+        self.shm.buf[layoutOffset:layoutOffset + len(layout)] = layout
+        seg.offsets[:] = (layoutOffset, len(layout), recordOffset, dtype.itemsize,
+                          validOffset, len(dtype.names))
+        self.record = np.ndarray((), dtype, buffer=self.shm.buf, offset=recordOffset)
+        self.valid = np.ndarray((len(dtype.names),), 'u1', buffer=self.shm.buf, offset=validOffset)
+        self.valid[:] = 0
+        seg.magic[:] = np.frombuffer(magic, 'u1')
+        seg.generation[...] = seg.generation + 1
+        seg.seq[...] = seg.seq + 1
+
+        self.header = header
+        self.logger.info(f'publishing {len(dtype.names)} status columns in shared memory {self.name}')
+
+    def publish(self, snap, header=None):
+        """Write one snapshot into the segment. """
+
+        with self.lock:
+            if header is not None and header is not self.header:
+                self._setHeader(header)
+            if self.record is None:
+                raise ShmStatusError('no header has been set')
+
+            record = self.record
+            valid = self.valid
+            names = record.dtype.names
+            fields = record.dtype.fields
+
+            seg = self.seg
+            seg.seq[...] = seg.seq + 1
+            try:
+                for i, name in enumerate(names):
+                    ok = snap.isValid(name)
+                    val = snap.get(name)
+                    if ok and val is not None:
+                        if isinstance(val, str):
+                            val = val.encode('utf-8', 'replace')[:stringWidth]
+                        try:
+                            record[name] = val
+                        except (TypeError, ValueError, OverflowError):
+                            ok = False
+                    else:
+                        ok = False
+                    if not ok:
+                        kind = fields[name][0].kind
+                        record[name] = np.nan if kind == 'f' else (-9999 if kind == 'i' else b'')
+                    valid[i] = ok
+                seg.timestamp[...] = snap.timestamp
+            finally:
+                seg.seq[...] = seg.seq + 1
+            self.nPublished += 1
+
+    def close(self, unlink=False):
+        with self.lock:
+            self.record = self.valid = None
+            self.seg.release()
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+
+
+class ShmStatusReader(object):
+    """Read the status published by a `ShmStatusWriter` on this host.
+
+    Parameters
+    ----------
+    name : `str`
+        The segment name.
+    maxTries : `int`
+        How many times to retry a read which raced with an update.
+    """
+
+    def __init__(self, name=DEFAULT_NAME, maxTries=1000):
+        self.name = name
+        self.maxTries = maxTries
+        self.shm = shared_memory.SharedMemory(name=name, create=False)
+        # Do not let Python's resource tracker remove the writer's segment when we exit.
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.seg = _Segment(self.shm)
+        if bytes(self.seg.magic) != magic:
+            raise ShmStatusError(f'shared memory {name} is not a gen2 status segment')
+        self.generation = None
+        self._loadLayout()
+
+    def _loadLayout(self):
+        for _ in range(self.maxTries):
+            seq = int(self.seg.seq)
+            if seq % 2:
+                time.sleep(0)
+                continue
+            layoutOffset, layoutLen, recordOffset, recordSize, validOffset, nCols = \
+                (int(v) for v in self.seg.offsets)
+            generation = int(self.seg.generation)
+            layout = json.loads(bytes(self.shm.buf[layoutOffset:layoutOffset + layoutLen]))
+            if int(self.seg.seq) != seq:
+                continue
+
+            dtype = np.dtype(dict(names=layout['names'], formats=layout['formats']))
+            self.dtype = dtype
+            self.index = {name: i for i, name in enumerate(dtype.names)}
+            self.record = np.ndarray((), dtype, buffer=self.shm.buf, offset=recordOffset)
+            self.valid = np.ndarray((nCols,), 'u1', buffer=self.shm.buf, offset=validOffset)
+            self.generation = generation
+            return
+        raise ShmStatusError(f'could not read a stable layout from {self.name}')
+
+    def names(self):
+        return list(self.dtype.names)
+
+    def readRecord(self):
+        """Return a consistent copy of the whole status.
+
+        Returns
+        -------
+        timestamp : `float`
+            When the status was latched. 0 if it never has been.
+        record : `numpy.ndarray`
+            A 0-d structured array with one field per header card.
+        valid : `numpy.ndarray` of `bool`
+            Per column, in `names()` order.
+        """
+
+        seg = self.seg
+        for _ in range(self.maxTries):
+            seq = int(seg.seq)
+            if seq % 2:
+                time.sleep(0)
+                continue
+            if int(seg.generation) != self.generation:
+                self._loadLayout()
+                continue
+            timestamp = float(seg.timestamp)
+            record = self.record.copy()
+            valid = self.valid.astype(bool)
+            if int(seg.seq) == seq:
+                return timestamp, record, valid
+        raise ShmStatusError(f'could not get a consistent read of {self.name}')
+
+    def read(self, names=None):
+        """Return a consistent dict of the current values of some or all cards.
+
+        Strings are decoded, and invalid values are None. The latch
+        time is included as 'timestamp'.
+        """
+
+        timestamp, record, valid = self.readRecord()
+        if names is None:
+            names = self.dtype.names
+        values = dict(timestamp=timestamp)
+        for name in names:
+            if not valid[self.index[name]]:
+                values[name] = None
+                continue
+            val = record[name].item()
+            if isinstance(val, bytes):
+                val = val.decode('utf-8', 'replace')
+            values[name] = val
+        return values
+
+    def age(self):
+        """Return how many seconds ago the published status was latched. """
+        return time.time() - float(self.seg.timestamp)
+
+    def close(self):
+        self.record = self.valid = None
+        self.seg.release()
+        self.shm.close()
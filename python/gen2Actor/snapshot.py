@@ -0,0 +1,112 @@
+"""Typed, immutable snapshots of the Gen2 telescope status.
+
+Each time we latch the Gen2 status dictionary, the raw values are
+converted once, according to the types in header_telescope.txt, into a
+`StatusSnapshot`. Everything downstream (MHS keywords, FITS headers,
+opdb rows) reads from the snapshot, and conversion problems are
+collected once per latch rather than reported at every access.
+"""
+
+import time
+
+
+class StatusSnapshot(object):
+    """An immutable, typed copy of one latched Gen2 status dictionary.
+
+    Values are looked up by FITS card name (e.g. 'ALTITUDE'), as in the
+    header file. A value which could not be fetched is None, and one
+    which could not be converted is the raw Gen2 value; in both cases the
+    field is flagged as invalid.
+    """
+
+    __slots__ = ('timestamp', 'errors', '_index', '_values', '_valid')
+
+    def __init__(self, timestamp, index, values, valid, errors):
+        object.__setattr__(self, 'timestamp', timestamp)
+        object.__setattr__(self, 'errors', errors)
+        object.__setattr__(self, '_index', index)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_valid', valid)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    @classmethod
+    def fromStatusDict(cls, header, statusDict, names=None, timestamp=None):
+        """Convert a raw Gen2 status dictionary in a single pass.
+
+        Parameters
+        ----------
+        header : `dict`
+            The parsed header file, as returned by `PFS.read_header_list`.
+        statusDict : `dict`
+            Gen2 status alias to raw value.
+        names : iterable of `str`, optional
+            If set, only convert these FITS cards.
+        timestamp : `float`, optional
+            When the status was latched. Defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if names is not None:
+            names = set(names)
+
+        index = dict()
+        values = []
+        valid = []
+        errors = []
+        for name, card in header.items():
+            if names is not None and name not in names:
+                continue
+            alias, _, valType, default, _ = card
+
+            ok = True
+            if alias == 'NA':
+                val = default
+            else:
+                try:
+                    val = statusDict[alias]
+                except KeyError:
+                    val = None
+                    ok = False
+                    errors.append(f'{name}: no value for {alias}')
+                else:
+                    try:
+                        val = valType(val)
+                    except Exception:
+                        ok = False
+                        errors.append(f'{name}: failed to convert {val!r} with {valType.__name__}')
+
+            index[name] = len(values)
+            values.append(val)
+            valid.append(ok)
+
+        return cls(timestamp, index, tuple(values), tuple(valid), tuple(errors))
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, name, default=None):
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            return default
+
+    def isValid(self, name):
+        """Return True if name was fetched and converted without error. """
+        try:
+            return self._valid[self._index[name]]
+        except KeyError:
+            return False
+
+    def names(self):
+        return list(self._index.keys())
+
+    def items(self):
+        return [(name, self._values[i]) for name, i in self._index.items()]
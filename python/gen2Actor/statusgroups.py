@@ -0,0 +1,130 @@
+"""Named groups of Gen2 status keys, each polled at its own cadence.
+
+Latching the full telescope status is too expensive to do often, but
+some consumers (the dome, screen and ring lamp keywords, say) only need
+a handful of values and want them promptly. A `StatusPoller` thread
+fetches each registered `StatusGroup` through the small, fast status
+interface whenever it is due, and hands the resulting typed snapshot to
+the group's callback.
+"""
+
+import logging
+import threading
+import time
+
+# The FITS cards behind the dome, screen, vent and ring lamp keywords.
+domeCards = ('W_TFFSFP', 'W_TFFSRP', 'W_TSHUTR', 'W_TDLGHT', 'W_TVNTAL', 'W_TVNTOB',
+             'W_TFF1ST', 'W_TFF2ST', 'W_TFF3ST', 'W_TFF4ST',
+             'W_TFF1VC', 'W_TFF2VC', 'W_TFF3VC', 'W_TFF4VC',
+             'W_TFF1VV', 'W_TFF2VV', 'W_TFF3VV', 'W_TFF4VV')
+pointingCards = ('ALTITUDE', 'AZIMUTH', 'ZD', 'AIRMASS', 'INST-PA', 'INR-STR')
+environmentCards = ('DOM-HUM', 'DOM-PRS', 'DOM-TMP', 'DOM-WND',
+                    'OUT-HUM', 'OUT-PRS', 'OUT-TMP', 'OUT-WND')
+
+# The groups of cards which can be asked for by name, e.g. by subscribers.
+namedGroups = dict(dome=domeCards,
+                   pointing=pointingCards,
+                   environment=environmentCards)
+
+
+class StatusGroup(object):
+    """A named set of FITS cards to poll together.
+
+    Parameters
+    ----------
+    name : `str`
+        Our name for the group, e.g. 'dome'
+    cards : iterable of `str`
+        FITS card names, per header_telescope.txt
+    period : `float`
+        Seconds between polls.
+    callback : callable
+        Called with each new `StatusSnapshot` for the group.
+    fetch : callable
+        If set, used instead of the poller's fetch, e.g. to poll raw Gen2
+        aliases rather than FITS cards.
+    """
+
+    def __init__(self, name, cards, period, callback, fetch=None):
+        self.name = name
+        self.cards = tuple(cards)
+        self.period = period
+        self.callback = callback
+        self.fetch = fetch
+
+        self.lastPolled = 0.0
+        self.lastSnapshot = None
+        self.nPolls = 0
+        self.nFailures = 0
+
+    def isDue(self, now):
+        return now - self.lastPolled >= self.period
+
+
+class StatusPoller(threading.Thread):
+    """Poll the registered status groups, each when it is due.
+
+    Parameters
+    ----------
+    fetch : callable
+        Called with a list of FITS card names, and returns a `StatusSnapshot`.
+    tick : `float`
+        How often to check whether any group is due, in seconds.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, fetch, tick=0.5, logger=None):
+        super().__init__(name='statusPoller', daemon=True)
+        self.fetch = fetch
+        self.tick = tick
+        self.logger = logger if logger is not None else logging.getLogger('statusgroups')
+
+        self.groups = dict()
+        self.lock = threading.Lock()
+        self.ev_quit = threading.Event()
+
+    def addGroup(self, group):
+        with self.lock:
+            self.groups[group.name] = group
+
+    def removeGroup(self, name):
+        with self.lock:
+            return self.groups.pop(name, None)
+
+    def getGroups(self):
+        with self.lock:
+            return list(self.groups.values())
+
+    def stop(self):
+        self.ev_quit.set()
+
+    def poll(self, group):
+        """Fetch one group now and pass the snapshot to its callback. """
+
+        group.lastPolled = time.monotonic()
+        try:
+            fetch = group.fetch if group.fetch is not None else self.fetch
+            snap = fetch(group.cards)
+        except Exception as e:
+            group.nFailures += 1
+            if group.nFailures == 1 or group.nFailures % 100 == 0:
+                self.logger.warning(f'failed to poll status group {group.name} '
+                                    f'({group.nFailures} failures): {e}')
+            return None
+
+        group.nPolls += 1
+        group.lastSnapshot = snap
+        try:
+            group.callback(snap)
+        except Exception as e:
+            self.logger.warning(f'status group {group.name} callback failed: {e}')
+        return snap
+
+    def run(self):
+        while not self.ev_quit.is_set():
+            now = time.monotonic()
+            for group in self.getGroups():
+                if group.isDue(now) and not self.ev_quit.is_set():
+                    self.poll(group)
+            self.ev_quit.wait(self.tick)
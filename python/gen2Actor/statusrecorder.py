@@ -0,0 +1,297 @@
+"""A per-night, columnar record of every full Gen2 status snapshot we latch.
+
+Each night gets a directory under the recorder root, named by the date
+at the start of the night (HST), holding one memory-mapped .npy file
+per header card, typed from header_telescope.txt:
+
+- float cards are float64, with NaN where the value was bad,
+- int cards are int64, with `badInt` where the value was bad,
+- string cards are fixed-width bytes, truncated to `stringWidth`,
+
+plus `timestamp.npy` (the latch time, seconds since the epoch),
+`valid.npy` (one bool per row and card, in `columns.json` order) and
+`rowCount.npy`, which is only advanced once a row is complete. The
+timestamp column only ever increases, and is the index by time.
+
+Recording a snapshot is a few assignments into already-mapped pages.
+When a night's files fill up they are copied once into files of twice
+the size. `StatusReader` gives zero-copy, read-only NumPy views of a
+night's columns.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+badInt = -9999
+stringWidth = 48
+
+
+def nightOf(t):
+    """Return the night (YYYY-MM-DD at the start of the night, HST) of a timestamp. """
+
+    dt = datetime.datetime.fromtimestamp(t, tz=ZoneInfo("HST"))
+    return (dt - datetime.timedelta(hours=12)).date().isoformat()
+
+
+def columnsFromHeader(header):
+    """Return [(cardName, dtype string)] for the header cards we fetch from Gen2. """
+
+    columns = []
+    for name, card in header.items():
+        alias, _, _, default, _ = card
+        if alias == 'NA':
+            continue
+        if isinstance(default, float):
+            dtype = 'f8'
+        elif isinstance(default, int):
+            dtype = 'i8'
+        else:
+            dtype = f'S{stringWidth}'
+        columns.append((name, dtype))
+    return columns
+
+
+def _columnPath(nightDir, name):
+    # Some card names have characters (e.g. '-') which are fine in file names, but not '/'.
+    return os.path.join(nightDir, f'{name.replace("/", "_")}.npy')
+
+
+class _Night(object):
+    """The open, writable memory maps of one night. """
+
+    def __init__(self, nightDir, columns, capacity):
+        self.nightDir = nightDir
+        self.columns = columns
+        os.makedirs(nightDir, exist_ok=True)
+
+        metaPath = os.path.join(nightDir, 'columns.json')
+        if os.path.exists(metaPath):
+            with open(metaPath) as f:
+                self.columns = [tuple(c) for c in json.load(f)]
+            self.rowCount = np.load(os.path.join(nightDir, 'rowCount.npy'), mmap_mode='r+')
+            self.timestamp = np.load(os.path.join(nightDir, 'timestamp.npy'), mmap_mode='r+')
+            self.valid = np.load(os.path.join(nightDir, 'valid.npy'), mmap_mode='r+')
+            self.arrays = [np.load(_columnPath(nightDir, name), mmap_mode='r+')
+                           for name, dtype in self.columns]
+        else:
+            self.rowCount = np.lib.format.open_memmap(os.path.join(nightDir, 'rowCount.npy'),
+                                                      mode='w+', dtype='i8', shape=(1,))
+            self._create(capacity)
+            with open(metaPath, 'w') as f:
+                json.dump(self.columns, f)
+
+        self.capacity = len(self.timestamp)
+        self.index = {name: i for i, (name, dtype) in enumerate(self.columns)}
+
+    def _create(self, capacity, old=None):
+        """Create the column files, or grow them, copying from old (timestamp, valid, arrays). """
+
+        nightDir = self.nightDir
+
+        def newArray(path, dtype, shape, oldArray):
+            tmpPath = f'{path}.tmp.npy'
+            a = np.lib.format.open_memmap(tmpPath, mode='w+', dtype=dtype, shape=shape)
+            if oldArray is not None:
+                a[:len(oldArray)] = oldArray
+            a.flush()
+            os.replace(tmpPath, path)
+            return a
+
+        oldTimestamp, oldValid, oldArrays = old if old is not None else (None, None, None)
+        nCols = len(self.columns)
+        self.timestamp = newArray(os.path.join(nightDir, 'timestamp.npy'), 'f8', (capacity,),
+                                  oldTimestamp)
+        self.valid = newArray(os.path.join(nightDir, 'valid.npy'), 'bool', (capacity, nCols),
+                              oldValid)
+        self.arrays = [newArray(_columnPath(nightDir, name), dtype, (capacity,),
+                                None if oldArrays is None else oldArrays[i])
+                       for i, (name, dtype) in enumerate(self.columns)]
+        self.capacity = capacity
+
+    def grow(self):
+        self._create(2 * self.capacity, old=(self.timestamp, self.valid, self.arrays))
+
+
+class StatusRecorder(object):
+    """Append StatusSnapshots to per-night columnar files.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory holding one subdirectory per night.
+    header : `dict`
+        The parsed header file, as returned by `PFS.read_header_list`.
+        If None, the header passed with the first snapshot is used.
+    capacity : `int`
+        Initial number of rows in each night's files.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, root, header=None, capacity=20000, logger=None):
+        self.root = root
+        self.header = header
+        self.columns = None if header is None else columnsFromHeader(header)
+        self.capacity = capacity
+        self.logger = logger if logger is not None else logging.getLogger('statusrecorder')
+
+        self.night = None
+        self.nightName = None
+        self.lock = threading.Lock()
+        self.nRecorded = 0
+
+    def setHeader(self, header):
+        """Use a new header from the next night on. """
+
+        with self.lock:
+            self.header = header
+            self.columns = columnsFromHeader(header)
+
+    def _openNight(self, name):
+        nightDir = os.path.join(self.root, name)
+        self.night = _Night(nightDir, self.columns, self.capacity)
+        self.nightName = name
+        self.logger.info(f'recording status snapshots in {nightDir}, '
+                         f'{int(self.night.rowCount[0])} rows so far')
+
+    def record(self, snap, header=None):
+        """Append one snapshot, as a new row of its night's files.
+
+        Parameters
+        ----------
+        snap : `StatusSnapshot`
+            The snapshot to record.
+        header : `dict`
+            The header the snapshot was converted with. If it is not the
+            one we already have, its columns are used from the next night on.
+        """
+
+        if header is not None and header is not self.header:
+            self.setHeader(header)
+
+        t = snap.timestamp
+        name = nightOf(t)
+        with self.lock:
+            if name != self.nightName:
+                self._openNight(name)
+            night = self.night
+
+            row = int(night.rowCount[0])
+            if row > 0 and t < night.timestamp[row - 1]:
+                # Keep the time index sorted; a late arrival from another thread is close enough.
+                t = night.timestamp[row - 1]
+            if row >= night.capacity:
+                t0 = time.monotonic()
+                night.grow()
+                self.logger.info(f'grew {night.nightDir} to {night.capacity} rows '
+                                 f'in {time.monotonic() - t0:0.2f}s')
+
+            valid = night.valid[row]
+            for i, (colName, dtype) in enumerate(night.columns):
+                ok = snap.isValid(colName)
+                val = snap.get(colName)
+                if not ok or val is None:
+                    if dtype == 'f8':
+                        val = np.nan
+                    elif dtype == 'i8':
+                        val = badInt
+                    else:
+                        val = b''
+                    ok = False
+                elif isinstance(val, str):
+                    val = val.encode('utf-8', 'replace')[:stringWidth]
+                try:
+                    night.arrays[i][row] = val
+                except (TypeError, ValueError, OverflowError):
+                    ok = False
+                valid[i] = ok
+            night.timestamp[row] = t
+            night.rowCount[0] = row + 1
+            self.nRecorded += 1
+
+    def flush(self):
+        """Push the current night's pages to disk. Not needed for readers on the same host. """
+
+        with self.lock:
+            night = self.night
+            if night is None:
+                return
+            for a in [night.timestamp, night.valid, night.rowCount] + night.arrays:
+                a.flush()
+
+
+def nights(root):
+    """Return the names of the nights recorded under root. """
+
+    try:
+        return sorted(d for d in os.listdir(root)
+                      if os.path.exists(os.path.join(root, d, 'columns.json')))
+    except FileNotFoundError:
+        return []
+
+
+class StatusReader(object):
+    """Zero-copy, read-only access to one recorded night.
+
+    The arrays are views of the memory-mapped files, cut at the row
+    count when this reader was created (or last refreshed). A night
+    which is still being recorded can be re-read with `refresh`.
+
+    Parameters
+    ----------
+    nightDir : `str`
+        The night's directory.
+    """
+
+    def __init__(self, nightDir):
+        self.nightDir = nightDir
+        with open(os.path.join(nightDir, 'columns.json')) as f:
+            self.columns = [tuple(c) for c in json.load(f)]
+        self.index = {name: i for i, (name, dtype) in enumerate(self.columns)}
+        self.refresh()
+
+    def refresh(self):
+        """Pick up rows recorded since we were opened. """
+
+        self.nRows = int(np.load(os.path.join(self.nightDir, 'rowCount.npy'), mmap_mode='r')[0])
+        self._timestamp = np.load(os.path.join(self.nightDir, 'timestamp.npy'), mmap_mode='r')
+        self._valid = np.load(os.path.join(self.nightDir, 'valid.npy'), mmap_mode='r')
+        self._arrays = dict()
+
+    def __len__(self):
+        return self.nRows
+
+    def names(self):
+        return [name for name, dtype in self.columns]
+
+    @property
+    def timestamp(self):
+        return self._timestamp[:self.nRows]
+
+    def __getitem__(self, name):
+        """Return the column for one header card. """
+
+        try:
+            a = self._arrays[name]
+        except KeyError:
+            a = self._arrays[name] = np.load(_columnPath(self.nightDir, name), mmap_mode='r')
+        return a[:self.nRows]
+
+    def valid(self, name):
+        """Return whether each row's value of one card was good. """
+        return self._valid[:self.nRows, self.index[name]]
+
+    def rows(self, t0=None, t1=None):
+        """Return the slice of rows latched in [t0, t1), by searching the time index. """
+
+        ts = self.timestamp
+        i0 = 0 if t0 is None else int(np.searchsorted(ts, t0, side='left'))
+        i1 = self.nRows if t1 is None else int(np.searchsorted(ts, t1, side='left'))
+        return slice(i0, i1)
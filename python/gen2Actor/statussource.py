@@ -0,0 +1,238 @@
+"""Fetching Gen2 status values through the fastest working OCS interface.
+
+g2cam offers three ways to ask for status values:
+
+- 'fast': ocs.getOCSstatusList2List(aliases)
+- 'list': ocs.requestOCSstatusList2List(aliases)
+- 'dict': ocs.requestOCSstatus({alias: default, ...})
+
+'dict' is the long-standing production interface, and is the reference.
+A `StatusSource` tries the backends in order of measured latency, falls
+back to the next on error, and sets a backend aside for a while if it
+fails or if its values stop agreeing with the reference backend.
+
+Every value fetched is also kept, with when it was fetched, so that
+callers who can live with slightly old values can use `fetchCached`
+and only ask Gen2 for the ones which are too old.
+"""
+
+import logging
+import threading
+import time
+
+from gen2Actor import latency
+
+# Gen2 placeholders for missing values.
+badValues = {None, '##NODATA##', '##ERROR##', '##STATNONE##'}
+
+
+class StatusUnavailable(RuntimeError):
+    pass
+
+
+class StatusSource(object):
+    """Fetch lists of Gen2 status aliases through the best available interface.
+
+    Parameters
+    ----------
+    ocsCall : callable
+        Called as ocsCall(methodName, *args) to make an OCS call,
+        e.g. `OcsGuard.call`.
+    backends : sequence of `str`
+        The backends to use, in order of initial preference.
+    reference : `str`
+        The backend whose values we trust.
+    demoteFor : `float`
+        How long to set aside a failing or inconsistent backend, in seconds.
+    crossCheckInterval : `float`
+        How often to compare a non-reference backend against the reference, in seconds.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, ocsCall, backends=('fast', 'list', 'dict'), reference='dict',
+                 demoteFor=60.0, crossCheckInterval=300.0, logger=None):
+        self.ocsCall = ocsCall
+        self.backends = tuple(backends)
+        self.reference = reference
+        self.demoteFor = demoteFor
+        self.crossCheckInterval = crossCheckInterval
+        self.logger = logger if logger is not None else logging.getLogger('statussource')
+
+        self.stats = latency.LatencyRegistry(maxSamples=200)
+        self.demotedUntil = dict()
+        self.lastCrossCheck = dict()
+        self.lastUsed = None
+        self.lock = threading.Lock()
+
+        # alias -> (value, time.monotonic() when it was requested)
+        self.cache = dict()
+        self.nCacheHits = 0
+        self.nCacheMisses = 0
+
+        self._fetchers = dict(fast=self._fetchFast,
+                              list=self._fetchList,
+                              dict=self._fetchDict)
+
+    def _fetchFast(self, aliases):
+        return self.ocsCall('getOCSstatusList2List', aliases)
+
+    def _fetchList(self, aliases):
+        return self.ocsCall('requestOCSstatusList2List', aliases)
+
+    def _fetchDict(self, aliases):
+        statusDict = dict.fromkeys(aliases, '##NODATA##')
+        self.ocsCall('requestOCSstatus', statusDict)
+        return [statusDict[a] for a in aliases]
+
+    def _demote(self, backend, why):
+        with self.lock:
+            self.demotedUntil[backend] = time.monotonic() + self.demoteFor
+        self.logger.warning(f'setting aside {backend} status interface for {self.demoteFor}s: {why}')
+
+    def isDemoted(self, backend, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            return self.demotedUntil.get(backend, 0) > now
+
+    def candidates(self):
+        """Return the backends in the order we should try them.
+
+        Healthy backends come first, fastest (by median latency) first.
+        Backends without any measurements yet are tried in their listed
+        order before measured ones, so that everything gets measured.
+        """
+        now = time.monotonic()
+
+        def sortKey(ib):
+            i, backend = ib
+            p50 = self.stats[backend].percentile(50)
+            measured = p50 == p50
+            return (self.isDemoted(backend, now), measured, p50 if measured else i)
+
+        return [b for i, b in sorted(enumerate(self.backends), key=sortKey)]
+
+    def _fetchWith(self, backend, aliases):
+        with self.stats.timing(backend):
+            vals = self._fetchers[backend](aliases)
+        vals = list(vals)
+        if len(vals) != len(aliases):
+            raise StatusUnavailable(f'{backend} returned {len(vals)} values for {len(aliases)} aliases')
+        return vals
+
+    def _consistent(self, vals, refVals):
+        """Return None if two fetches of the same aliases agree, else a reason why not.
+
+        Numeric values move, so we only require that the same values are
+        missing and that non-numeric values match.
+        """
+        nBad = sum(v in badValues for v in vals)
+        nRefBad = sum(v in badValues for v in refVals)
+        if nBad > nRefBad:
+            return f'{nBad} missing values, vs. {nRefBad} from {self.reference}'
+        for v, r in zip(vals, refVals):
+            if isinstance(r, str) and r not in badValues and v != r:
+                return f'{v!r} != {r!r} from {self.reference}'
+        return None
+
+    def _crossCheck(self, backend, aliases, vals):
+        """Occasionally compare a backend against the reference.
+
+        Returns the reference values if they disagree, else None.
+        """
+        now = time.monotonic()
+        if now - self.lastCrossCheck.get(backend, 0) < self.crossCheckInterval:
+            return None
+        self.lastCrossCheck[backend] = now
+
+        try:
+            refVals = self._fetchWith(self.reference, aliases)
+        except Exception as e:
+            self.logger.warning(f'could not cross-check {backend} against {self.reference}: {e}')
+            return None
+        why = self._consistent(vals, refVals)
+        if why is None:
+            return None
+
+        self._demote(backend, f'inconsistent with {self.reference}: {why}')
+        return refVals
+
+    def fetch(self, aliases):
+        """Return a dict of the current values of the given Gen2 aliases.
+
+        Raises
+        ------
+        StatusUnavailable
+            If none of the backends could supply the values.
+        """
+        aliases = list(aliases)
+        errors = []
+        t0 = time.monotonic()
+        for backend in self.candidates():
+            try:
+                vals = self._fetchWith(backend, aliases)
+            except Exception as e:
+                errors.append(f'{backend}: {e}')
+                self._demote(backend, e)
+                continue
+
+            if backend != self.reference:
+                refVals = self._crossCheck(backend, aliases, vals)
+                if refVals is not None:
+                    vals, backend = refVals, self.reference
+            self.lastUsed = backend
+            values = dict(zip(aliases, vals))
+            with self.lock:
+                for alias, val in values.items():
+                    self.cache[alias] = (val, t0)
+            return values
+
+        raise StatusUnavailable(f'no status interface worked: {"; ".join(errors)}')
+
+    def fetchCached(self, aliases, maxAge):
+        """Return the values of some aliases, fetching only those not cached recently enough.
+
+        Parameters
+        ----------
+        aliases : iterable of `str`
+            The Gen2 aliases.
+        maxAge : `float`
+            Cached values up to this many seconds old are good enough.
+            0 always fetches.
+
+        Returns
+        -------
+        values : `dict`
+            alias to value, in the order asked for.
+        ages : `dict`
+            alias to how many seconds old each value is.
+
+        Raises
+        ------
+        StatusUnavailable
+            If some values had to be fetched, and none of the backends could supply them.
+        """
+        aliases = list(dict.fromkeys(aliases))
+        now = time.monotonic()
+        values = dict()
+        ages = dict()
+        with self.lock:
+            for alias in aliases:
+                cached = self.cache.get(alias)
+                if cached is not None and now - cached[1] <= maxAge:
+                    values[alias] = cached[0]
+                    ages[alias] = now - cached[1]
+            missing = [a for a in aliases if a not in values]
+            self.nCacheHits += len(values)
+            self.nCacheMisses += len(missing)
+
+        if missing:
+            fetched = self.fetch(missing)
+            now = time.monotonic()
+            with self.lock:
+                for alias in missing:
+                    values[alias] = fetched[alias]
+                    ages[alias] = now - self.cache[alias][1]
+
+        return {a: values[a] for a in aliases}, {a: ages[a] for a in aliases}
@@ -0,0 +1,233 @@
+"""Callback-storm load tests of the archiving keyvar callbacks.
+
+A `CallbackStorm` synthesises mcs.mcsFileIds, agcc.pfsdPathIds and
+ccd_xx.spsFileIds updates, each for a new file, at a fixed total rate
+and mix, and delivers them to a `bench.Harness` through a
+`fakes.FakeReactor`. As in the real actor, all the callbacks run one
+after the other on that one thread, so if they cannot keep up, the
+updates queue up. For each rate we report:
+
+- the callback latency (time spent in the callbacks for one update),
+- the reactor lag (time an update waits before its callbacks start),
+- the reactor queue and archive backlog (files claimed in the archive
+  ledger but not yet archived), and how long the backlog took to drain
+  once the storm stopped.
+"""
+
+import argparse
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+
+from gen2Actor import bench
+from gen2Actor import fakes
+from gen2Actor import latency
+
+# Where each source's synthetic visits start, and how many files each visit has.
+firstVisits = dict(mcs=400000, agcc=500000, sps=600000)
+framesPerVisit = dict(mcs=10, agcc=50)
+armNums = dict(b=1, r=2)
+
+
+class CallbackStorm(object):
+    """Deliver synthetic archiving keyvar updates to a harness at a given rate.
+
+    Parameters
+    ----------
+    harness : `bench.Harness`
+        What to drive. Its butler should create placeholder files.
+    mix : `dict`
+        Source ('mcs', 'agcc' or 'sps') to relative weight.
+    pfsDay : `str`
+        The day to put in the keyvars.
+    seed : `int`
+        For choosing the source of each update.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, harness, mix, pfsDay='2023-05-01', seed=None, logger=None):
+        self.harness = harness
+        self.mix = {src: float(w) for src, w in mix.items() if float(w) > 0}
+        for src in self.mix:
+            if src not in firstVisits:
+                raise ValueError(f'unknown keyvar source: {src}')
+        self.pfsDay = pfsDay
+        self.rng = random.Random(seed)
+        self.logger = logger if logger is not None else logging.getLogger('storm')
+
+        archive = harness.actor.actorConfig['gen2']['archive']
+        self.spsCams = [cam for cam in archive if len(cam) == 2 and cam[0] in armNums]
+        if 'sps' in self.mix and not self.spsCams:
+            raise ValueError('no ccd cameras are configured for archiving')
+
+        # Counters carry across rates, so that every update is for a new file.
+        self.nEvents = dict.fromkeys(firstVisits, 0)
+
+    def _event(self, source):
+        """Return (model, key, values) for the next update from one source. """
+
+        n = self.nEvents[source]
+        self.nEvents[source] += 1
+        if source == 'mcs':
+            visit, frame = divmod(n, framesPerVisit['mcs'])
+            return 'mcs', 'mcsFileIds', [self.pfsDay, firstVisits['mcs'] + visit, frame]
+        if source == 'agcc':
+            visit, frame = divmod(n, framesPerVisit['agcc'])
+            return 'agcc', 'pfsdPathIds', [self.pfsDay, firstVisits['agcc'] + visit, frame]
+
+        visit, camNum = divmod(n, len(self.spsCams))
+        cam = self.spsCams[camNum]
+        return (f'ccd_{cam}', 'spsFileIds',
+                [cam, self.pfsDay, firstVisits['sps'] + visit, int(cam[1]), armNums[cam[0]]])
+
+    def _pickSource(self):
+        return self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+
+    def _deliver(self, stats, source, model, key, values):
+        keyVar = self.harness.actor.models[model].keyVarDict[key]
+        t0 = time.monotonic()
+        failed = True
+        try:
+            keyVar.set(values)
+            failed = False
+        finally:
+            dt = time.monotonic() - t0
+            stats[source].record(dt, failed=failed)
+            stats['all'].record(dt, failed=failed)
+
+    def archiveBacklog(self):
+        """Return the number of files claimed for archiving but not yet archived or failed. """
+
+        ledger = getattr(self.harness.actor, 'archiveLedger', None)
+        if ledger is None:
+            return 0
+        return ledger.counts().get('queued', 0)
+
+    def runRate(self, rate, duration, drainTimeout=60.0, sampleInterval=0.5):
+        """Deliver rate updates per second for duration seconds, then wait for the backlog to drain.
+
+        Returns
+        -------
+        result : `dict`
+            Latencies and lags in ms, backlogs in updates or files, times in seconds.
+        """
+
+        reactor = fakes.FakeReactor()
+        stats = latency.LatencyRegistry(maxSamples=100000)
+        nEvents = max(1, int(rate * duration))
+
+        backlog = dict(reactor=0, archive=0)
+        sampling = threading.Event()
+
+        def sample():
+            while not sampling.wait(sampleInterval):
+                backlog['reactor'] = max(backlog['reactor'], reactor.pending())
+                backlog['archive'] = max(backlog['archive'], self.archiveBacklog())
+
+        sampler = threading.Thread(target=sample, name='stormSampler', daemon=True)
+        sampler.start()
+
+        ledger = getattr(self.harness.actor, 'archiveLedger', None)
+        counts0 = ledger.counts() if ledger is not None else dict()
+        start = time.monotonic()
+        for i in range(nEvents):
+            delay = start + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            source = self._pickSource()
+            reactor.callFromThread(self._deliver, stats, source, *self._event(source))
+        sent = time.monotonic()
+
+        reactor.stop()
+        delivered = time.monotonic()
+        while self.archiveBacklog() > 0 and time.monotonic() - delivered < drainTimeout:
+            time.sleep(0.05)
+        drained = time.monotonic()
+        sampling.set()
+        sampler.join()
+
+        counts1 = ledger.counts() if ledger is not None else dict()
+
+        def ms(stats):
+            p50, p99, pMax = stats.percentiles((50, 99, 100))
+            return dict(count=stats.count, errors=stats.errors,
+                        p50=p50 * 1000, p99=p99 * 1000, max=pMax * 1000)
+
+        return dict(rate=rate, events=nEvents,
+                    sendSeconds=sent - start,
+                    achieved=nEvents / (delivered - start) if delivered > start else float('nan'),
+                    callbacks={s.name: ms(s) for s in stats},
+                    lag=ms(reactor.lag),
+                    maxReactorQueue=backlog['reactor'],
+                    maxArchiveBacklog=backlog['archive'],
+                    finalArchiveBacklog=self.archiveBacklog(),
+                    drainSeconds=drained - delivered,
+                    archived=counts1.get('archived', 0) - counts0.get('archived', 0),
+                    failed=counts1.get('failed', 0) - counts0.get('failed', 0))
+
+
+def _parseMix(mixStr):
+    mix = dict()
+    for part in mixStr.split(','):
+        src, _, weight = part.partition('=')
+        mix[src.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the archiving keyvar callbacks '
+                                                 'against a fake Gen2.')
+    parser.add_argument('--rates', default='5,10,20,50,100,200',
+                        help='comma-separated total update rates to try, per second')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run each rate for')
+    parser.add_argument('--mix', default='mcs=5,agcc=3,sps=2',
+                        help='relative weights of the mcs, agcc and sps updates')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='fake Gen2 call latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.002,
+                        help='fake Gen2 call latency jitter, in seconds')
+    parser.add_argument('--archiveLatency', type=float, default=0.05,
+                        help='fake Gen2 archive_framelist latency, in seconds')
+    parser.add_argument('--batchTimeout', type=float, default=2.0,
+                        help='archiveBatchTimeout for the SPS files. 0 archives each file on its own.')
+    parser.add_argument('--drainTimeout', type=float, default=60.0,
+                        help='longest to wait for the archive backlog after each rate, in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workDir', default=None,
+                        help='scratch directory. Default is a new temporary one.')
+    parser.add_argument('--out', default=None,
+                        help='save the results as JSON in this file')
+    opts = parser.parse_args(argv)
+
+    rates = [float(r) for r in opts.rates.split(',') if r.strip()]
+    logging.basicConfig(level=logging.WARNING)
+    workDir = opts.workDir if opts.workDir is not None else tempfile.mkdtemp(prefix='gen2storm')
+    ocs = fakes.FakeOcs(latency=opts.latency, jitter=opts.jitter, seed=opts.seed,
+                        latencies=dict(archive_framelist=(opts.archiveLatency, opts.jitter)))
+    harness = bench.Harness(workDir, ocs, gen2Config=dict(archiveBatchTimeout=opts.batchTimeout))
+    harness.actor.butler.createFiles = True
+
+    storm = CallbackStorm(harness, _parseMix(opts.mix), seed=opts.seed)
+    results = dict(mix=storm.mix, duration=opts.duration, latency=opts.latency,
+                   archiveLatency=opts.archiveLatency, batchTimeout=opts.batchTimeout, results=[])
+    print('    rate achieved  cb p50  cb p99   lag p50   lag p99   lag max  queue backlog drain (ms, s)')
+    try:
+        for rate in rates:
+            r = storm.runRate(rate, opts.duration, drainTimeout=opts.drainTimeout)
+            results['results'].append(r)
+            cb = r['callbacks']['all']
+            lag = r['lag']
+            print(f'{rate:8.1f} {r["achieved"]:8.1f} {cb["p50"]:7.2f} {cb["p99"]:7.2f} '
+                  f'{lag["p50"]:9.2f} {lag["p99"]:9.2f} {lag["max"]:9.2f} '
+                  f'{r["maxReactorQueue"]:6d} {r["maxArchiveBacklog"]:7d} {r["drainSeconds"]:6.1f}')
+    finally:
+        harness.close()
+
+    if opts.out is not None:
+        with open(opts.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,145 @@
+"""Actors' subscriptions to a few Gen2 status aliases, pushed only on change.
+
+An actor which only cares about a couple of Gen2 values registers them
+(raw Gen2 aliases, or the aliases behind a named group of cards) with a
+minimum period. The gen2 actor polls the union of all subscriptions in a
+single status request, at the shortest period anyone asked for, and
+each subscriber is told only about its values which have changed since
+it was last told, and no more often than its own period.
+"""
+
+import logging
+import math
+import threading
+
+
+def _same(a, b):
+    if a == b:
+        return True
+    return (isinstance(a, float) and isinstance(b, float)
+            and math.isnan(a) and math.isnan(b))
+
+
+class Subscription(object):
+    """One subscriber's aliases and what it has been sent of them.
+
+    Parameters
+    ----------
+    subscriber : `str`
+        Who the values are for, e.g. the commander of the subscribe command.
+    aliases : iterable of `str`
+        The Gen2 aliases.
+    period : `float`
+        Minimum seconds between pushes.
+    """
+
+    def __init__(self, subscriber, aliases, period):
+        self.subscriber = subscriber
+        self.aliases = tuple(aliases)
+        self.period = period
+
+        self.lastValues = dict()
+        self.lastPushed = 0.0
+        self.nPushes = 0
+        self.nValues = 0
+
+    def changes(self, values, now):
+        """Return the values which changed since our last push, if we are due one.
+
+        Parameters
+        ----------
+        values : `dict`
+            Alias to current value, for at least our aliases.
+        now : `float`
+            The current time.
+
+        Returns
+        -------
+        changed : `dict`
+            Alias to new value, in our alias order. Empty if nothing
+            changed or we are not due.
+        """
+
+        if now - self.lastPushed < self.period:
+            return dict()
+
+        changed = dict()
+        for alias in self.aliases:
+            if alias not in values:
+                continue
+            val = values[alias]
+            if alias not in self.lastValues or not _same(self.lastValues[alias], val):
+                changed[alias] = val
+
+        if changed:
+            self.lastValues.update(changed)
+            self.lastPushed = now
+            self.nPushes += 1
+            self.nValues += len(changed)
+        return changed
+
+
+class SubscriptionSet(object):
+    """All the current subscriptions, by subscriber.
+
+    Parameters
+    ----------
+    minPeriod : `float`
+        No subscriber may ask for a shorter period than this.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, minPeriod=1.0, logger=None):
+        self.minPeriod = minPeriod
+        self.logger = logger if logger is not None else logging.getLogger('subscriptions')
+
+        self.subscriptions = dict()
+        self.lock = threading.Lock()
+
+    def subscribe(self, subscriber, aliases, period):
+        """Register (or replace) a subscriber's aliases. Returns the new `Subscription`. """
+
+        aliases = list(dict.fromkeys(aliases))
+        sub = Subscription(subscriber, aliases, max(period, self.minPeriod))
+        with self.lock:
+            self.subscriptions[subscriber] = sub
+        self.logger.info(f'{subscriber} subscribed to {len(aliases)} aliases every {sub.period}s')
+        return sub
+
+    def unsubscribe(self, subscriber):
+        """Drop a subscriber. Returns its `Subscription`, or None if it had none. """
+
+        with self.lock:
+            sub = self.subscriptions.pop(subscriber, None)
+        if sub is not None:
+            self.logger.info(f'{subscriber} unsubscribed')
+        return sub
+
+    def getSubscriptions(self):
+        with self.lock:
+            return list(self.subscriptions.values())
+
+    def union(self):
+        """Return all the subscribed aliases, once each. """
+
+        aliases = dict()
+        for sub in self.getSubscriptions():
+            aliases.update(dict.fromkeys(sub.aliases))
+        return list(aliases)
+
+    def period(self):
+        """Return the shortest subscribed period, or None if there are no subscriptions. """
+
+        periods = [sub.period for sub in self.getSubscriptions()]
+        return min(periods) if periods else None
+
+    def changes(self, values, now):
+        """Return [(subscriber, changed values)] for each subscriber with something new. """
+
+        pushes = []
+        for sub in self.getSubscriptions():
+            changed = sub.changes(values, now)
+            if changed:
+                pushes.append((sub.subscriber, changed))
+        return pushes
@@ -0,0 +1,192 @@
+"""Local, crash-safe visit allocation, used when Gen2 cannot supply frame IDs.
+
+Visits are issued from a reserved range which Gen2 itself never reaches,
+so they cannot collide with real frame IDs. The last issued visit is
+kept in a small counter file which is replaced atomically and fsync'ed
+before the visit is returned, so a crash can at worst leave a gap in the
+sequence, never a duplicate. Every issued visit is also appended to a
+log, which is what we report when the visits need to be registered with
+Gen2 afterwards.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+
+
+class VisitAllocationError(RuntimeError):
+    pass
+
+
+class LocalVisitAllocator(object):
+    """Issue visits from a reserved range, durably.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory for the counter and log files.
+    first, last : `int`
+        The inclusive range of visits we are allowed to issue.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, root, first=990000, last=999999, logger=None):
+        self.root = root
+        self.first = first
+        self.last = last
+        self.logger = logger if logger is not None else logging.getLogger('visitalloc')
+
+        os.makedirs(root, exist_ok=True)
+        self.counterPath = os.path.join(root, 'localVisit.counter')
+        self.logPath = os.path.join(root, 'localVisits.log')
+        self.lockPath = os.path.join(root, 'localVisit.lock')
+        self.lock = threading.Lock()
+
+    def isLocal(self, visit):
+        """Return True if visit is in our reserved range. """
+        return self.first <= visit <= self.last
+
+    def _readCounter(self):
+        try:
+            with open(self.counterPath) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            self.logger.warning(f'corrupt local visit counter {self.counterPath}: {e}')
+            return None
+
+    def _writeCounter(self, visit):
+        """Atomically replace the counter file, and make sure it is on disk. """
+
+        tmpPath = f'{self.counterPath}.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(f'{visit}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.counterPath)
+
+        dirFd = os.open(self.root, os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+    def _logVisit(self, visit, reason):
+        reason = ' '.join(str(reason).split())
+        with open(self.logPath, 'a') as f:
+            f.write(f'{visit} {time.time():0.3f} {reason}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _lastIssued(self):
+        """Return the highest visit ever issued, from the counter and all logs. """
+
+        last = self._readCounter()
+        for visit, _, _ in self.issued(includeReconciled=True):
+            if last is None or visit > last:
+                last = visit
+        return last
+
+    def allocate(self, reason=''):
+        """Durably allocate and return the next local visit.
+
+        Raises
+        ------
+        VisitAllocationError
+            If the reserved range has been used up.
+        """
+        with self.lock, open(self.lockPath, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            last = self._lastIssued()
+            visit = self.first if last is None else last + 1
+            if not self.isLocal(visit):
+                raise VisitAllocationError(f'local visit range {self.first}..{self.last} is used up')
+
+            self._writeCounter(visit)
+            self._logVisit(visit, reason)
+
+        self.logger.warning(f'allocated local visit {visit}: {reason}')
+        return visit
+
+    def _logFiles(self, includeReconciled=False):
+        paths = []
+        if includeReconciled:
+            paths.extend(os.path.join(self.root, fn) for fn in sorted(os.listdir(self.root))
+                         if fn.startswith('localVisits.') and fn.endswith('.reconciled'))
+        paths.append(self.logPath)
+        return paths
+
+    def issued(self, includeReconciled=False):
+        """Return the locally issued visits, as (visit, timestamp, reason) tuples.
+
+        By default only the visits which have not yet been marked as
+        reconciled with Gen2 are returned.
+        """
+        visits = []
+        for path in self._logFiles(includeReconciled=includeReconciled):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        parts = line.rstrip('\n').split(' ', 2)
+                        try:
+                            visits.append((int(parts[0]), float(parts[1]),
+                                           parts[2] if len(parts) > 2 else ''))
+                        except (ValueError, IndexError):
+                            self.logger.warning(f'skipping bad line in {path}: {line!r}')
+            except FileNotFoundError:
+                pass
+        return visits
+
+    def markReconciled(self, visits):
+        """Set aside some issued visits, once they have been registered with Gen2.
+
+        Parameters
+        ----------
+        visits : iterable of `int`
+            The visits which were registered, e.g. those `issued` listed.
+            Any others issued since stay in the active log.
+
+        Returns
+        -------
+        path : `str` or None
+            The file the visits were appended to, or None if there was nothing to do.
+        """
+        visits = set(visits)
+        with self.lock, open(self.lockPath, 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                with open(self.logPath) as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                return None
+
+            done = []
+            keep = []
+            for line in lines:
+                try:
+                    visit = int(line.split(' ', 1)[0])
+                except ValueError:
+                    visit = None
+                (done if visit in visits else keep).append(line)
+            if not done:
+                return None
+
+            # Appending, so that two reconciles within a second cannot lose each other's visits.
+            stamp = time.strftime('%Y%m%dT%H%M%S')
+            newPath = os.path.join(self.root, f'localVisits.{stamp}.reconciled')
+            with open(newPath, 'a') as f:
+                f.writelines(done)
+                f.flush()
+                os.fsync(f.fileno())
+
+            tmpPath = f'{self.logPath}.tmp'
+            with open(tmpPath, 'w') as f:
+                f.writelines(keep)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpPath, self.logPath)
+        return newPath
@@ -0,0 +1,218 @@
+"""Per-visit summaries of the telescope and environment, from the recorded status.
+
+tel_status and env_condition get a row for every updateTelStatus call,
+so an exposure has a dozen near-identical rows and no summary over the
+exposure itself. When a visit ends, a `VisitSummarizer` reads the
+status snapshots latched during the visit from the `statusrecorder`
+files, reduces them to one row (the mean, min and max of the dome and
+outside conditions and of the seeing and transparency, and the start
+and drift of the altitude, azimuth and rotator angle) and appends that
+row to a local JSON lines file.
+
+opdb has no table for these rows yet, so they are not written there.
+The gen2 actor keeps them in visitSummaries.jsonl in its stateDir
+(by default $ICS_MHS_DATA_ROOT/gen2). Each line is one visit, a JSON
+object whose keys are the column names: pfs_visit_id, started_at,
+ended_at and created_at (ISO times, HST), n_samples, and the summary
+columns described in `summarizeWindow`, null where there was no good
+value. A visit normally has one line, but one which is ended again
+after a restart can have more: the last one wins. Each write is
+fsync'ed, so the lines survive a crash. Read them with `readSummaries`,
+e.g. to load them into a table once opdb has one::
+
+    from gen2Actor import visitsummary
+
+    path = os.path.expandvars('$ICS_MHS_DATA_ROOT/gen2/visitSummaries.jsonl')
+    rows = list(visitsummary.readSummaries(path))
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from gen2Actor import cachedict
+from gen2Actor import statusrecorder
+
+# Summary column prefix -> FITS card, for each kind of reduction.
+rangeCards = dict(dome_temperature='DOM-TMP', dome_humidity='DOM-HUM', dome_pressure='DOM-PRS',
+                  outside_temperature='OUT-TMP', outside_humidity='OUT-HUM', outside_pressure='OUT-PRS',
+                  seeing='SEEING', transparency='TRANSP')
+driftCards = dict(altitude='ALTITUDE', azimuth='AZIMUTH', insrot='INR-STR')
+
+
+def summarizeWindow(root, t0, t1):
+    """Reduce the status recorded under root between two times.
+
+    Parameters
+    ----------
+    root : `str`
+        The status recorder root directory.
+    t0, t1 : `float`
+        The window, seconds since the epoch.
+
+    Returns
+    -------
+    summary : `dict`
+        n_samples, plus the <prefix>_mean/_min/_max and <prefix>_start/_drift
+        columns. Values are None when no sample had a good value.
+    """
+
+    cards = list(rangeCards.values()) + list(driftCards.values())
+    values = {card: [] for card in cards}
+    nSamples = 0
+    for night in sorted({statusrecorder.nightOf(t0), statusrecorder.nightOf(t1)}):
+        nightDir = os.path.join(root, night)
+        if not os.path.exists(os.path.join(nightDir, 'columns.json')):
+            continue
+        reader = statusrecorder.StatusReader(nightDir)
+        rows = reader.rows(t0, t1)
+        nSamples += rows.stop - rows.start
+        for card in cards:
+            if card in reader.index:
+                good = reader.valid(card)[rows]
+                values[card].append(np.asarray(reader[card][rows], dtype='f8')[good])
+
+    summary = dict(n_samples=nSamples)
+    for prefix, card in rangeCards.items():
+        vals = np.concatenate(values[card]) if values[card] else np.empty(0)
+        for stat, func in ('mean', np.mean), ('min', np.min), ('max', np.max):
+            summary[f'{prefix}_{stat}'] = float(func(vals)) if len(vals) else None
+    for prefix, card in driftCards.items():
+        vals = np.concatenate(values[card]) if values[card] else np.empty(0)
+        summary[f'{prefix}_start'] = float(vals[0]) if len(vals) else None
+        summary[f'{prefix}_drift'] = float(vals[-1] - vals[0]) if len(vals) else None
+
+    return summary
+
+
+class VisitSummarizer(object):
+    """Track when visits start, and write their status summaries when they end.
+
+    Parameters
+    ----------
+    root : `str`
+        The status recorder root directory.
+    path : `str`
+        The JSON lines file to append the summary rows to.
+    maxVisits : `int`
+        How many unfinished visits to remember.
+    logger : `logging.Logger`
+        Where to log.
+    """
+
+    def __init__(self, root, path, maxVisits=1000, logger=None):
+        self.root = root
+        self.path = path
+        self.logger = logger if logger is not None else logging.getLogger('visitsummary')
+
+        self.starts = cachedict.cacheDict(size=maxVisits)
+        self.lock = threading.Lock()
+        self.nWritten = 0
+        self.nFailed = 0
+
+    def visitStarted(self, visit, t=None):
+        """Note the start of a visit, unless we already know it. """
+
+        with self.lock:
+            if visit not in self.starts:
+                self.starts[visit] = time.time() if t is None else t
+
+    def started(self, visit):
+        with self.lock:
+            return self.starts.get(visit)
+
+    def visitsEnded(self, visits, t=None):
+        """Summarize some visits which have ended, and write their rows.
+
+        Visits we never saw start are skipped.
+
+        Returns
+        -------
+        rows : `list` of `dict`
+            The summary rows.
+
+        Raises
+        ------
+        OSError
+            If the rows could not be written.
+        """
+
+        t1 = time.time() if t is None else t
+        rows = []
+        for visit in visits:
+            with self.lock:
+                t0 = self.starts.pop(visit, None)
+            if t0 is None:
+                continue
+            row = summarizeWindow(self.root, t0, t1)
+            row.update(pfs_visit_id=visit,
+                       started_at=_isoTime(t0), ended_at=_isoTime(t1),
+                       created_at=datetime.datetime.now(tz=ZoneInfo("HST")).isoformat())
+            rows.append(row)
+
+        if rows:
+            try:
+                self._write(rows)
+            except OSError as e:
+                self.nFailed += len(rows)
+                self.logger.warning(f'failed to write {len(rows)} visit summaries to {self.path}: {e}')
+                raise
+            self.nWritten += len(rows)
+        return rows
+
+    def _write(self, rows):
+        lines = ''.join(json.dumps(row) + '\n' for row in rows)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def visitEnded(self, visit, t=None):
+        """Summarize one visit. Returns its row, or None if we never saw it start. """
+
+        rows = self.visitsEnded([visit], t=t)
+        return rows[0] if rows else None
+
+
+def readSummaries(path, visits=None):
+    """Yield the summary rows written to a file by a `VisitSummarizer`.
+
+    Parameters
+    ----------
+    path : `str`
+        The JSON lines file.
+    visits : iterable of `int`
+        If set, only yield the rows of these visits.
+
+    Yields
+    ------
+    row : `dict`
+        One summary row, keyed by column name. Only the last row written
+        for each visit is returned, in the order the visits were ended.
+    """
+
+    visits = None if visits is None else set(visits)
+    rows = dict()
+    with open(path) as f:
+        for lineNum, line in enumerate(f, start=1):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                logging.getLogger('visitsummary').warning(f'skipping bad line {lineNum} of {path}')
+                continue
+            visit = row.get('pfs_visit_id')
+            if visits is None or visit in visits:
+                rows.pop(visit, None)
+                rows[visit] = row
+    yield from rows.values()
+
+
+def _isoTime(t):
+    return datetime.datetime.fromtimestamp(t, tz=ZoneInfo("HST")).isoformat()